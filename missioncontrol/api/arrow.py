@@ -0,0 +1,56 @@
+import pyarrow
+from django.http import HttpResponse
+
+
+ARROW_STREAM_CONTENT_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+def get_response_format(request):
+    '''
+    Returns the format a response should be in ('arrow' or 'json'), going by
+    the format parameter or (failing that) the Accept header
+    '''
+    response_format = request.GET.get('format')
+    if response_format:
+        return response_format
+    if ARROW_STREAM_CONTENT_TYPE in request.META.get('HTTP_ACCEPT', ''):
+        return 'arrow'
+    return 'json'
+
+
+def get_series_arrays(rows, series_columns):
+    '''
+    Returns a dictionary of column name -> array for rows of (<series
+    columns...>, timestamp, value, usage_hours)
+
+    The series columns (e.g. build id and version) are dictionary encoded,
+    timestamps are converted to seconds since the epoch (unless they're
+    already offsets in seconds).
+    '''
+    columns = list(zip(*rows)) or [[]] * (len(series_columns) + 3)
+    arrays = {
+        series_column: pyarrow.array(column, type=pyarrow.string()).dictionary_encode()
+        for (series_column, column) in zip(series_columns, columns)
+    }
+    (timestamps, values, usage_hours) = columns[len(series_columns):]
+    if timestamps and hasattr(timestamps[0], 'timestamp'):
+        arrays['timestamp'] = pyarrow.array(
+            timestamps, type=pyarrow.timestamp('s', tz='UTC')).cast(pyarrow.int64())
+    else:
+        arrays['timestamp'] = pyarrow.array(timestamps, type=pyarrow.int64())
+    arrays['value'] = pyarrow.array(values, type=pyarrow.float64())
+    arrays['usage_hours'] = pyarrow.array(usage_hours, type=pyarrow.float64())
+    return arrays
+
+
+def get_arrow_response(arrays, metadata=None):
+    '''
+    Returns a response with a table of the given arrays, in the arrow IPC
+    streaming format
+    '''
+    table = pyarrow.table(arrays, metadata=metadata)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return HttpResponse(sink.getvalue().to_pybytes(),
+                        content_type=ARROW_STREAM_CONTENT_TYPE)
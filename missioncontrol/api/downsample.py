@@ -0,0 +1,56 @@
+import math
+
+import numpy
+
+
+def _get_x(x):
+    # points are either (timestamp, ...) or (seconds since a base, ...)
+    return x.timestamp() if hasattr(x, 'timestamp') else x
+
+
+def _get_rate(value, usage_hours):
+    # what's graphed: the measure per 1000 usage hours
+    return value / (usage_hours / 1000.0) if usage_hours else 0.0
+
+
+def _get_bucket_bounds(num_points, max_points):
+    # the points between the first and the last, split into max_points - 2
+    # (roughly) equally sized buckets
+    bucket_size = (num_points - 2) / (max_points - 2)
+    return [(int(math.floor(i * bucket_size)) + 1, int(math.floor((i + 1) * bucket_size)) + 1)
+            for i in range(max_points - 2)]
+
+
+def _get_lttb_indices(xs, ys, max_points):
+    # for each bucket, picks the point forming the largest triangle with the
+    # last point picked and the average of the next bucket (the areas in a
+    # bucket are calculated with array operations)
+    (xs, ys) = (numpy.array(xs, dtype=float), numpy.array(ys, dtype=float))
+    indices = [0]
+    bucket_bounds = _get_bucket_bounds(len(xs), max_points)
+    for (i, (start, end)) in enumerate(bucket_bounds):
+        (next_start, next_end) = (bucket_bounds[i + 1] if i + 1 < len(bucket_bounds)
+                                  else (len(xs) - 1, len(xs)))
+        (avg_x, avg_y) = (xs[next_start:next_end].mean(), ys[next_start:next_end].mean())
+        (a_x, a_y) = (xs[indices[-1]], ys[indices[-1]])
+        areas = numpy.abs((a_x - avg_x) * (ys[start:end] - a_y) -
+                          (a_x - xs[start:end]) * (avg_y - a_y))
+        indices.append(start + int(areas.argmax()))
+    indices.append(len(xs) - 1)
+    return indices
+
+
+def downsample(points, max_points):
+    '''
+    Returns (at most) max_points of a series of (x, value, usage_hours)
+    points sorted by x, chosen with the Largest-Triangle-Three-Buckets
+    algorithm so the shape of the graphed rate is preserved
+
+    The first and last points are always kept, max_points must be at
+    least 3.
+    '''
+    if len(points) <= max_points:
+        return points
+    xs = [_get_x(point[0]) for point in points]
+    ys = [_get_rate(point[1], point[2]) for point in points]
+    return [points[i] for i in _get_lttb_indices(xs, ys, max_points)]
@@ -8,5 +8,6 @@ urlpatterns = [
     url(r'^channel-platform-summary/$', views.channel_platform_summary,
         name='channel-platform-summary'),
     url(r'^measure/$', views.measure, name='measure'),
+    url(r'^measures/$', views.measures, name='measures'),
     url(r'^experiment/$', views.experiment, name='experiment'),
 ]
@@ -1,26 +1,129 @@
+import collections
 import datetime
+import functools
+import hashlib
+import itertools
+import json
 import logging
+import operator
+import time
 import pytz
 from pkg_resources import parse_version
 from distutils.util import strtobool
 
 from django.core.cache import cache
-from django.db.models import (Max, Min)
-from django.http import (HttpResponseBadRequest, HttpResponseNotFound, JsonResponse)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import (DateTimeField, F, Max, Min, OuterRef, Q, Subquery)
+from django.http import (HttpResponse, HttpResponseBadRequest, HttpResponseNotFound,
+                         JsonResponse, StreamingHttpResponse)
 from django.utils import timezone
-
-from missioncontrol.base.models import (Application,
-                                        Build,
-                                        Channel,
+from django.utils.cache import patch_vary_headers
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
+
+from missioncontrol.api.arrow import (get_arrow_response,
+                                      get_response_format,
+                                      get_series_arrays)
+from missioncontrol.api.downsample import downsample
+from missioncontrol.base.cache import (get_with_soft_expiry,
+                                       set_with_soft_expiry)
+from missioncontrol.base.models import (Build,
+                                        DailyDatum,
                                         Datum,
-                                        Measure,
-                                        Platform)
+                                        HourlyDatum,
+                                        Measure)
 from missioncontrol.etl.date import datetime_to_utc
-from missioncontrol.etl.measuresummary import get_measure_summary_cache_key
-from missioncontrol.etl.presto import (QueryBuilder, DIMENSION_LIST)
+from missioncontrol.etl.measuresummary import (get_measure_summaries,
+                                               get_measure_summaries_last_modified)
+from missioncontrol.etl.presto import (get_aggregates, DIMENSION_LIST)
+from missioncontrol.etl.tasks import update_aggregates
+from missioncontrol.etl.watermarks import (get_many_series_last_modified,
+                                           get_series_last_modified)
+from missioncontrol.settings import (AGGREGATES_CACHE_EXPIRY,
+                                     AGGREGATES_CACHE_HARD_EXPIRY,
+                                     API_DATUM_CHUNK_SIZE,
+                                     API_RESPONSE_CACHE_EXPIRY,
+                                     MEASURE_MIN_DATAPOINTS)
 
 logger = logging.getLogger(__name__)
 
+# resolutions measure data is available in, from coarsest to finest
+DATUM_RESOLUTIONS = (
+    ('day', datetime.timedelta(days=1), DailyDatum),
+    ('hour', datetime.timedelta(hours=1), HourlyDatum),
+    ('raw', datetime.timedelta(minutes=5), Datum)
+)
+
+
+def _get_response_version(request, get_last_modified):
+    # returns when the data a response is based on was last modified, and a
+    # hash identifying the response (by its normalized query parameters and
+    # format and the data version), or None if it can't be cached
+    if not hasattr(request, 'response_version'):
+        last_modified = get_last_modified(request)
+        if last_modified is None:
+            request.response_version = None
+        else:
+            params = urlencode(sorted((key, value) for key in request.GET.keys()
+                                      for value in request.GET.getlist(key)))
+            version = [request.path, params, get_response_format(request),
+                       last_modified.isoformat()]
+            if request.GET.get('start') is None:
+                # without a start time, the data covered is relative to now,
+                # so also change the version every cache interval
+                version.append(str(int(time.time() // API_RESPONSE_CACHE_EXPIRY)))
+            request.response_version = (last_modified, hashlib.sha1(
+                ':'.join(version).encode('utf-8')).hexdigest())
+    return request.response_version
+
+
+def cached_response(get_last_modified, store=True):
+    '''
+    Caches the responses of a view, keyed by their query parameters (and
+    format) and by when the data they're based on was last modified (as returned by
+    get_last_modified(request), or None if unknown)
+
+    Responses carry an ETag and Last-Modified, so clients polling for
+    unchanged data get a "304 Not Modified" without us touching the
+    database. If store is False, only that is done, and other requests are
+    always passed on to the view.
+    '''
+    def _get_etag(request):
+        response_version = _get_response_version(request, get_last_modified)
+        return response_version[1] if response_version else None
+
+    def _get_last_modified(request):
+        response_version = _get_response_version(request, get_last_modified)
+        return response_version[0] if response_version else None
+
+    def decorator(view):
+        @condition(etag_func=_get_etag, last_modified_func=_get_last_modified)
+        @functools.wraps(view)
+        def wrapper(request):
+            etag = _get_etag(request)
+            if etag is None or not store:
+                response = view(request)
+                patch_vary_headers(response, ['Accept'])
+                return response
+            cache_key = 'response:%s' % etag
+            cached = cache.get(cache_key)
+            if cached is not None:
+                (content_type, content) = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = view(request)
+                # (streamed responses are never held in memory, so can't be
+                # cached either)
+                if response.status_code == 200 and not response.streaming:
+                    cache.set(cache_key, (response['Content-Type'], response.content),
+                              API_RESPONSE_CACHE_EXPIRY)
+            # the format of the response may depend on the Accept header
+            patch_vary_headers(response, ['Accept'])
+            return response
+        return wrapper
+    return decorator
+
 
 def aggregates(request):
     '''
@@ -29,19 +132,21 @@ def aggregates(request):
     This method is unused in the frontend currently and may be removed
     soon. It is also quite slow. Using it is not recommended.
     '''
-    url_path = request.GET.urlencode()
-    results = cache.get('aggregates:%s' % url_path)
-
+    cache_key = 'aggregates:%s' % request.GET.urlencode()
+    measurements = request.GET.getlist('measurements')
+    dimensions = request.GET.getlist('dimensions')
+    conditions = {}
+    for dimension in DIMENSION_LIST:
+        if dimension in request.GET:
+            conditions[dimension] = request.GET.getlist(dimension)
+
+    # stale results are returned while they're recalculated in the background
+    results = get_with_soft_expiry(cache_key, lambda cache_key: update_aggregates.apply_async(
+        args=[cache_key, measurements, conditions, dimensions]))
     if results is None:
-        measurements = request.GET.getlist('measurements')
-        dimensions = request.GET.getlist('dimensions')
-        conditions = {}
-        for dimension in DIMENSION_LIST:
-            if dimension in request.GET:
-                conditions[dimension] = request.GET.getlist(dimension)
-        query_builder = QueryBuilder(measurements, conditions, dimensions)
-        results = [dict(row) for row in query_builder.execute().fetchall()]
-        cache.set('aggregates:%s' % url_path, results)
+        results = get_aggregates(measurements, conditions, dimensions)
+        set_with_soft_expiry(cache_key, results, AGGREGATES_CACHE_EXPIRY,
+                             AGGREGATES_CACHE_HARD_EXPIRY)
 
     return JsonResponse(data=dict(results=results))
 
@@ -50,6 +155,10 @@ def _sorted_version_list(versions):
     return list(reversed(sorted(versions, key=parse_version)))
 
 
+# (the summaries themselves are cached, so the responses aren't stored:
+# that way they always reflect which measures are enabled and what's in the
+# summary cache)
+@cached_response(lambda request: get_measure_summaries_last_modified(), store=False)
 def channel_platform_summary(request):
     '''
     Lists measures available for specified channel/platform combinations
@@ -62,67 +171,69 @@ def channel_platform_summary(request):
     except ValueError:
         only_crash_measures = False
 
-    applications = Application.objects.all()
+    # every enabled (application, platform, channel, measure) in one query,
+    # grouped by combination
+    measure_channels = Measure.channels.through.objects.filter(
+        measure__enabled=True, measure__application__isnull=False,
+        measure__platform__isnull=False)
     if application_filter:
-        applications = applications.filter(name__in=application_filter)
-
-    platforms = Platform.objects.order_by('id').all()
+        measure_channels = measure_channels.filter(
+            measure__application__name__in=application_filter)
     if platform_filter:
-        platforms = platforms.filter(name__in=platform_filter)
-
-    channels = Channel.objects.all()
+        measure_channels = measure_channels.filter(measure__platform__name__in=platform_filter)
     if channel_filter:
-        channels = channels.filter(name__in=channel_filter)
+        measure_channels = measure_channels.filter(channel__name__in=channel_filter)
+    if only_crash_measures:
+        measure_channels = measure_channels.filter(measure__name__in=[
+            'main_crashes', 'content_crashes', 'content_shutdown_crashes'])
+    measure_keys = list(measure_channels.order_by(
+        'measure__application_id', 'channel_id', 'measure__platform_id', 'measure_id'
+    ).values_list('measure__application__name', 'measure__platform__name',
+                  'channel__name', 'measure__name'))
+
+    measure_summary_map = get_measure_summaries(measure_keys)
 
     summaries = []
-    for application in applications:
-        for channel in channels:
-            for platform in platforms:
-                measures = Measure.objects.filter(
-                    channels=channel, application=application,
-                    platform=platform, enabled=True)
-                if only_crash_measures:
-                    measures = measures.filter(name__in=['main_crashes', 'content_crashes',
-                                                         'content_shutdown_crashes'])
-                if not measures.exists():
-                    continue
-                measure_names = measures.values_list('name', flat=True)
-                measure_name_map = {
-                    get_measure_summary_cache_key(application.name,
-                                                  platform.name, channel.name,
-                                                  measure_name): measure_name
-                    for measure_name in measure_names
-                }
-                measure_summary_map = cache.get_many(measure_name_map.keys())
-                latest_version_seen = None
-                latest_version_field_duration = None
-                if measure_summary_map.values():
-                    latest_version_seen = _sorted_version_list(
-                        [measure_summary['versions'][0]['version'] for
-                         measure_summary in measure_summary_map.values()])[0]
-                    latest_version_field_duration = max(
-                        [measure_summary['versions'][0]['fieldDuration'] for
-                         measure_summary in measure_summary_map.values() if
-                         measure_summary['versions'][0]['version'] ==
-                         latest_version_seen])
-                summaries.append({
-                    'application': application.name,
-                    'expectedMeasures': list(measure_names),
-                    'latestVersionSeen': latest_version_seen,
-                    'latestVersionFieldDuration': latest_version_field_duration,
-                    'channel': channel.name,
-                    'platform': platform.name,
-                    'measures': [{
-                        'name': measure_name_map[measure_summary_cache_key],
-                        **measure_summary,
-                        'lastUpdated': (datetime_to_utc(measure_summary['lastUpdated'])
-                                        if measure_summary.get('lastUpdated') else None)
-                    } for (measure_summary_cache_key, measure_summary) in
-                                 measure_summary_map.items()]
-                })
+    for ((application_name, platform_name, channel_name), combination_measure_keys) in \
+            itertools.groupby(measure_keys, key=lambda measure_key: measure_key[:3]):
+        combination_measure_keys = list(combination_measure_keys)
+        measure_summaries = [
+            (measure_key[3], measure_summary_map[measure_key])
+            for measure_key in combination_measure_keys if measure_key in measure_summary_map]
+        latest_version_seen = None
+        latest_version_field_duration = None
+        if measure_summaries:
+            latest_version_seen = _sorted_version_list(
+                [measure_summary['versions'][0]['version'] for
+                 (_, measure_summary) in measure_summaries])[0]
+            latest_version_field_duration = max(
+                [measure_summary['versions'][0]['fieldDuration'] for
+                 (_, measure_summary) in measure_summaries if
+                 measure_summary['versions'][0]['version'] ==
+                 latest_version_seen])
+        summaries.append({
+            'application': application_name,
+            'expectedMeasures': [measure_key[3] for measure_key in combination_measure_keys],
+            'latestVersionSeen': latest_version_seen,
+            'latestVersionFieldDuration': latest_version_field_duration,
+            'channel': channel_name,
+            'platform': platform_name,
+            'measures': [{
+                'name': measure_name,
+                **measure_summary,
+                'lastUpdated': (datetime_to_utc(measure_summary['lastUpdated'])
+                                if measure_summary.get('lastUpdated') else None)
+            } for (measure_name, measure_summary) in measure_summaries]
+        })
     return JsonResponse(data={'summaries': summaries})
 
 
+def _get_interval_start(start, interval):
+    if start is not None:
+        return datetime.datetime.fromtimestamp(int(start), tz=pytz.UTC)
+    return timezone.now() - datetime.timedelta(seconds=int(interval))
+
+
 def _filter_datums_to_time_interval(datums, start, interval,
                                     offset=datetime.timedelta()):
     if start is not None:
@@ -139,9 +250,197 @@ def _filter_datums_to_time_interval(datums, start, interval,
         )
 
 
+def _rollups_cover(datum_model, series_filter, min_timestamp):
+    # whether the rollups have caught up with the raw data of the series
+    # matching series_filter from min_timestamp (or from the start, if None)
+    # -- they won't have for data ingested before there were rollups, until
+    # the backfill_datum_rollups command has been run
+    rollup_start = datum_model.objects.filter(series_filter).aggregate(
+        Min('timestamp'))['timestamp__min']
+    uncovered_datums = Datum.objects.filter(series_filter)
+    if rollup_start is not None:
+        uncovered_datums = uncovered_datums.filter(timestamp__lt=rollup_start)
+    if min_timestamp is not None:
+        uncovered_datums = uncovered_datums.filter(timestamp__gte=min_timestamp)
+    return not uncovered_datums.exists()
+
+
+def _get_datum_resolution(resolution, interval, series_filter, min_timestamp=None):
+    '''
+    Returns the name and model of the requested resolution or, if none was
+    requested, of the coarsest one still giving enough datapoints for interval
+
+    Raw data is returned instead if the rollups don't cover the data of the
+    series matching series_filter from min_timestamp (or ever, if None) yet.
+    '''
+    for (resolution_name, duration, datum_model) in DATUM_RESOLUTIONS:
+        if resolution == resolution_name or (
+                resolution is None and
+                int(interval) / duration.total_seconds() >= MEASURE_MIN_DATAPOINTS):
+            if datum_model is Datum or _rollups_cover(datum_model, series_filter,
+                                                      min_timestamp):
+                return (resolution_name, datum_model)
+            break
+    return (DATUM_RESOLUTIONS[-1][0], DATUM_RESOLUTIONS[-1][2])
+
+
+def _check_response_format(response_format):
+    # returns an error response if we can't return data in the format asked
+    # for
+    if response_format not in ('json', 'arrow'):
+        return HttpResponseBadRequest("Format must be one of: json, arrow")
+    return None
+
+
+def _check_measure_params(request):
+    # returns an error response if any of the (optional) parameters shared by
+    # the measure endpoints are invalid
+    (interval, start, resolution, max_points) = [
+        request.GET.get(param) for param in ('interval', 'start', 'resolution', 'max_points')]
+    if not all([val is None or val.isdigit() for val in (start, interval)]):
+        return HttpResponseBadRequest(
+            "Interval / start time must be specified in seconds (as an integer)")
+    if resolution not in [None] + [r[0] for r in DATUM_RESOLUTIONS]:
+        return HttpResponseBadRequest(
+            "Resolution must be one of: {}".format(
+                ', '.join([r[0] for r in DATUM_RESOLUTIONS])))
+    if max_points is not None and not (max_points.isdigit() and int(max_points) >= 3):
+        return HttpResponseBadRequest("Maximum number of points must be an integer >= 3")
+    return _check_response_format(get_response_format(request))
+
+
+def _is_enabled(param):
+    # whether a flag parameter (e.g. relative=1) is set
+    return not (param is None or (param.isdigit() and not int(param)))
+
+
+def _get_relative_rows(datums, start, interval, fields):
+    # returns (<fields...>, offset, value, usage_hours) rows for datums in the
+    # interval after start, with offsets (in seconds) relative to the first
+    # datum of their build (for the same measure), ordered by fields and
+    # offset -- all in one query
+    base_timestamps = datums.model.objects.filter(
+        build=OuterRef('build'), measure=OuterRef('measure')).order_by().values(
+            'build').annotate(base_timestamp=Min('timestamp')).values('base_timestamp')
+    start_offset = datetime.timedelta(seconds=int(start or 0))
+    end_offset = start_offset + datetime.timedelta(seconds=int(interval))
+    datums = datums.annotate(base_timestamp=Subquery(base_timestamps,
+                                                     output_field=DateTimeField()))
+    if connection.vendor == 'postgresql':
+        # (sqlite compares the timestamps it calculates as strings in a
+        # different format to the stored ones, so there we rely on the
+        # filtering below)
+        datums = datums.filter(timestamp__gte=F('base_timestamp') + start_offset,
+                               timestamp__lte=F('base_timestamp') + end_offset)
+    return (
+        row[:-4] + (int((row[-4] - row[-3]).total_seconds()),) + row[-2:] for row in
+        datums.order_by(*fields, 'timestamp').values_list(
+            *fields, 'timestamp', 'base_timestamp', 'value', 'usage_hours').iterator(
+                chunk_size=API_DATUM_CHUNK_SIZE)
+        if start_offset <= row[-4] - row[-3] <= end_offset)
+
+
+def _downsample_rows(rows, max_points, num_series_columns=2):
+    # downsamples the (<series columns...>, timestamp, value, usage_hours)
+    # rows of each series (e.g. build id and version), a series at a time
+    for (series, series_rows) in itertools.groupby(
+            rows, key=lambda row: row[:num_series_columns]):
+        for point in downsample([row[num_series_columns:] for row in series_rows],
+                                max_points):
+            yield series + tuple(point)
+
+
+def _get_build_series(rows):
+    # returns (build id, {data, version}) pairs for (build id, version,
+    # timestamp, value, usage hours) rows ordered by build id, a build at a
+    # time
+    for (build_id, build_rows) in itertools.groupby(rows, key=lambda row: row[0]):
+        build_rows = list(build_rows)
+        yield (build_id, {
+            'data': [row[2:] for row in build_rows],
+            'version': build_rows[0][1]
+        })
+
+
+def _get_branch_series(rows):
+    # returns (branch, data) pairs for (branch, timestamp, value, usage hours)
+    # rows ordered by branch, a branch at a time
+    for (branch, branch_rows) in itertools.groupby(rows, key=lambda row: row[0]):
+        yield (branch, [row[1:] for row in branch_rows])
+
+
+def _stream_measure_data(series, get_extra_data):
+    # yields the same json as a JsonResponse of {'measure_data':
+    # dict(series), **get_extra_data()} would have, a series at a time
+    yield '{"measure_data": {'
+    for (i, (key, value)) in enumerate(series):
+        yield '{}{}: {}'.format(', ' if i else '', json.dumps(key),
+                                json.dumps(value, cls=DjangoJSONEncoder))
+    yield '}'
+    for (key, value) in get_extra_data().items():
+        yield ', {}: {}'.format(json.dumps(key), json.dumps(value, cls=DjangoJSONEncoder))
+    yield '}'
+
+
+def _get_measure_data_response(series, get_extra_data, stream):
+    # (the extra data is only asked for once all the series have been read,
+    # so it can depend on them)
+    if stream:
+        return StreamingHttpResponse(_stream_measure_data(series, get_extra_data),
+                                     content_type='application/json')
+    measure_data = dict(series)
+    return JsonResponse(data={'measure_data': measure_data, **get_extra_data()})
+
+
+class _Cursor:
+    '''
+    Keeps track of the latest timestamp in (<series columns...>, timestamp,
+    value, usage hours) rows passing through it, to be passed back as the
+    since parameter of the next request for the same data
+    '''
+
+    def __init__(self, since):
+        self.since = since
+        self.latest_timestamp = None
+
+    def track(self, rows):
+        for row in rows:
+            if self.latest_timestamp is None or row[-3] > self.latest_timestamp:
+                self.latest_timestamp = row[-3]
+            yield row
+
+    @property
+    def value(self):
+        if self.latest_timestamp is None:
+            return int(self.since)
+        return int(self.latest_timestamp.timestamp())
+
+
+def _filter_datums_since(datums, since):
+    # points at the cursor are returned again, as they may have changed since
+    # (e.g. the rollup of the current hour)
+    return datums.filter(
+        timestamp__gte=datetime.datetime.fromtimestamp(int(since), tz=pytz.UTC))
+
+
+def _get_measure_last_modified(request):
+    if not all([request.GET.get(param) for param in ('channel', 'platform',
+                                                     'measure', 'interval')]):
+        return None
+    return get_series_last_modified(request.GET['platform'], request.GET['channel'])
+
+
+@cached_response(_get_measure_last_modified)
 def measure(request):
     '''
     Gets data specific to a channel/platform/measure combination
+
+    With stream=1, json responses are written out a build at a time as the
+    data is read from the database, rather than built up in memory first.
+
+    Clients polling for new data can pass since=<seconds since the epoch>
+    (0 for the first request), to only get the points at or after it along
+    with a cursor to pass as since next time.
     '''
     channel_name = request.GET.get('channel')
     platform_name = request.GET.get('platform')
@@ -150,12 +449,21 @@ def measure(request):
     start = request.GET.get('start')
     relative = request.GET.get('relative')
     versions = request.GET.getlist('version')
+    resolution = request.GET.get('resolution')
+    max_points = request.GET.get('max_points')
+    stream = _is_enabled(request.GET.get('stream'))
+    since = request.GET.get('since')
 
     if not all([channel_name, platform_name, measure_name, interval]):
         return HttpResponseBadRequest("All of channel, platform, measure, interval required")
-    if not all([val is None or val.isdigit() for val in (start, interval)]):
-        return HttpResponseBadRequest(
-            "Interval / start time must be specified in seconds (as an integer)")
+    params_error_response = _check_measure_params(request)
+    if params_error_response:
+        return params_error_response
+    if since is not None and not since.isdigit():
+        return HttpResponseBadRequest("Since must be specified in seconds (as an integer)")
+    if since is not None and _is_enabled(relative):
+        return HttpResponseBadRequest("Since can't be used in relative mode")
+    response_format = get_response_format(request)
 
     builds = Build.objects.filter(channel__name=channel_name,
                                   platform__name=platform_name)
@@ -170,33 +478,35 @@ def measure(request):
 
     datums = Datum.objects.filter(build__in=builds, measure=measure)
 
-    ret = {}
-
-    if relative is None or (relative.isdigit() and not int(relative)):
+    # the data is gathered as (build id, version, timestamp (or offset),
+    # value, usage hours) rows ordered by build id and timestamp
+    if not _is_enabled(relative):
         # default is to get latest data for all series
-        datums = _filter_datums_to_time_interval(datums, start, interval)
-
-        for (build_id, version, timestamp, value, usage_hours) in datums.values_list(
-                'build__build_id', 'build__version',
-                'timestamp', 'value', 'usage_hours').order_by('timestamp'):
-            if not ret.get(build_id):
-                ret[build_id] = {
-                    'data': [],
-                    'version': version
-                }
-            ret[build_id]['data'].append((timestamp, value, usage_hours))
+        (resolution, datum_model) = _get_datum_resolution(
+            resolution, interval, Q(build__in=builds, measure=measure),
+            _get_interval_start(start, interval))
+        datums = _filter_datums_to_time_interval(
+            datum_model.objects.filter(build__in=builds, measure=measure),
+            start, interval)
+        if since is not None:
+            datums = _filter_datums_since(datums, since)
+
+        rows = datums.values_list(
+            'build__build_id', 'build__version',
+            'timestamp', 'value', 'usage_hours').order_by(
+                'build__build_id', 'timestamp').iterator(chunk_size=API_DATUM_CHUNK_SIZE)
     else:
         if not versions:
             # if the user does not specify a list of versions, generate our
             # own based on the latest version with data
-            latest_build_id = datums.filter(
-                timestamp__gt=(datetime.datetime.now() -
-                               datetime.timedelta(days=1))
-            ).aggregate(
-                Max('build__build_id'))['build__build_id__max']
             if int(interval) == 0:
                 # if interval is 0 for relative, just use the interval of the latest
                 # released version
+                latest_build_id = datums.filter(
+                    timestamp__gt=(datetime.datetime.now() -
+                                   datetime.timedelta(days=1))
+                ).aggregate(
+                    Max('build__build_id'))['build__build_id__max']
                 timestamps_for_latest = datums.filter(
                     build__build_id=latest_build_id).aggregate(
                         Min('timestamp'), Max('timestamp'))
@@ -207,51 +517,190 @@ def measure(request):
             versions = _sorted_version_list(
                 [str(d[0]) for d in datums.values_list('build__version').distinct()]
             )[:4]
-        version_timestamps = {
-            (d[0], d[1]): d[2] for d in datums.filter(
-                build__version__in=versions).values_list(
-                    'build__version', 'build__build_id').distinct().annotate(
-                        Min('timestamp'))
-        }
-
-        # for each version/buildid combo, grab their data relative to the
-        # latest version
-        for (version_tuple, base_timestamp) in version_timestamps.items():
-            (version, build_id) = version_tuple
-            ret[build_id] = {
-                'version': version,
-                'data': []
-            }
-            if start:
-                start_timestamp = base_timestamp + datetime.timedelta(seconds=int(start))
-            else:
-                start_timestamp = base_timestamp
-            ret[build_id]['data'] = [
-                [int((timestamp - base_timestamp).total_seconds()), value, usage_hours] for
-                (timestamp, value, usage_hours) in datums.filter(
-                    build__version=version,
-                    build__build_id=build_id,
-                    timestamp__range=(start_timestamp,
-                                      start_timestamp + datetime.timedelta(seconds=int(interval)))
-                ).order_by('timestamp').values_list('timestamp', 'value', 'usage_hours')]
+        (resolution, datum_model) = _get_datum_resolution(
+            resolution, interval, Q(build__in=builds, build__version__in=versions,
+                                    measure=measure))
+
+        # grab the data of every version/buildid combo relative to its first
+        # datum
+        rows = _get_relative_rows(
+            datum_model.objects.filter(build__in=builds, build__version__in=versions,
+                                       measure=measure),
+            start, interval, ('build__build_id', 'build__version'))
+
+    cursor = None
+    if since is not None:
+        cursor = _Cursor(since)
+        rows = cursor.track(rows)
+
+    if max_points is not None:
+        # there's no point returning more points than can be graphed
+        rows = _downsample_rows(rows, int(max_points))
+
+    def _get_extra_data():
+        extra_data = {'resolution': resolution}
+        if cursor is not None:
+            extra_data['cursor'] = cursor.value
+        return extra_data
+
+    if response_format == 'arrow':
+        arrays = get_series_arrays(rows, ('build_id', 'version'))
+        return get_arrow_response(arrays, metadata={
+            key: str(value) for (key, value) in _get_extra_data().items()})
+
+    return _get_measure_data_response(_get_build_series(rows), _get_extra_data, stream)
+
+
+def _get_series_list(request):
+    # returns the (platform, channel, measure) series asked for, or None if
+    # any of them is malformed
+    series_list = [tuple(series.split(':')) for series in request.GET.getlist('series')]
+    if not all([len(series) == 3 and all(series) for series in series_list]):
+        return None
+    return list(collections.OrderedDict.fromkeys(series_list))
+
+
+def _get_measures_last_modified(request):
+    series_list = _get_series_list(request)
+    if not series_list or not request.GET.get('interval'):
+        return None
+    platform_channels = set([series[:2] for series in series_list])
+    last_modified = get_many_series_last_modified(platform_channels)
+    if len(last_modified) < len(platform_channels):
+        return None
+    return max(last_modified.values())
+
+
+@cached_response(_get_measures_last_modified)
+def measures(request):
+    '''
+    Gets data for several channel/platform/measure combinations at once
 
-    return JsonResponse(data={'measure_data': ret})
+    Takes any number of series (as "platform:channel:measure"), along with
+    the same parameters as the measure endpoint (applied to all of them)
+    '''
+    series_list = _get_series_list(request)
+    interval = request.GET.get('interval')
+    start = request.GET.get('start')
+    relative = _is_enabled(request.GET.get('relative'))
+    versions = request.GET.getlist('version')
+    resolution = request.GET.get('resolution')
+    max_points = request.GET.get('max_points')
+
+    if series_list is None:
+        return HttpResponseBadRequest("Series must be specified as platform:channel:measure")
+    if not all([series_list, interval]):
+        return HttpResponseBadRequest("Both series and interval required")
+    params_error_response = _check_measure_params(request)
+    if params_error_response:
+        return params_error_response
+    if relative and int(interval) == 0:
+        return HttpResponseBadRequest("Interval must be greater than 0 in relative mode")
+    response_format = get_response_format(request)
+
+    measure_ids = {
+        (platform_name, measure_name): measure_id for (measure_id, platform_name, measure_name)
+        in Measure.objects.filter(
+            name__in=set([series[2] for series in series_list]),
+            platform__name__in=set([series[0] for series in series_list])
+        ).values_list('id', 'platform__name', 'name')
+    }
+    missing_series = [':'.join(series) for series in series_list
+                      if (series[0], series[2]) not in measure_ids]
+    if missing_series:
+        return HttpResponseNotFound("Measure not available: {}".format(
+            ', '.join(missing_series)))
+    measure_names = {measure_id: measure_key for (measure_key, measure_id)
+                     in measure_ids.items()}
+
+    # all the series' data is fetched with one query
+    channel_measure_ids = collections.defaultdict(list)
+    for (platform_name, channel_name, measure_name) in series_list:
+        channel_measure_ids[channel_name].append(measure_ids[(platform_name, measure_name)])
+    series_filter = functools.reduce(operator.or_, [
+        Q(build__channel__name=channel_name, measure_id__in=channel_measure_ids[channel_name])
+        for channel_name in sorted(channel_measure_ids.keys())])
+    series_fields = ('measure_id', 'build__channel__name', 'build__build_id', 'build__version')
+
+    if versions:
+        series_filter &= Q(build__version__in=versions)
+    (resolution, datum_model) = _get_datum_resolution(
+        resolution, interval, series_filter,
+        None if relative else _get_interval_start(start, interval))
+    datums = datum_model.objects.filter(series_filter)
+
+    series_versions = None
+    if not relative:
+        datums = _filter_datums_to_time_interval(datums, start, interval)
+        rows = datums.values_list(
+            *series_fields, 'timestamp', 'value', 'usage_hours').order_by(
+                *series_fields, 'timestamp').iterator(chunk_size=API_DATUM_CHUNK_SIZE)
+    else:
+        if not versions:
+            # get data for current + up to three previous versions of each
+            # series, like for a single measure
+            series_versions = collections.defaultdict(list)
+            for (measure_id, channel_name, version) in Datum.objects.filter(
+                    series_filter).values_list(
+                        'measure_id', 'build__channel__name', 'build__version').distinct():
+                series_versions[(measure_id, channel_name)].append(version)
+            series_versions = {series: set(_sorted_version_list(series_version_list)[:4])
+                               for (series, series_version_list) in series_versions.items()}
+            datums = datums.filter(build__version__in=set().union(*series_versions.values()))
+        rows = _get_relative_rows(datums, start, interval, series_fields)
+
+    # (platform, channel, measure, build id, version, timestamp, value,
+    # usage hours) rows, of the series we asked for, a series at a time
+    rows = (
+        measure_names[row[0]][:1] + (row[1],) + measure_names[row[0]][1:] + row[2:]
+        for row in rows
+        if series_versions is None or row[3] in series_versions.get(row[:2], ()))
+
+    if max_points is not None:
+        rows = _downsample_rows(rows, int(max_points), num_series_columns=5)
+
+    if response_format == 'arrow':
+        return get_arrow_response(
+            get_series_arrays(rows, ('platform', 'channel', 'measure', 'build_id', 'version')),
+            metadata={'resolution': resolution})
+
+    measure_data = {
+        series: dict(_get_build_series(row[3:] for row in series_rows))
+        for (series, series_rows) in itertools.groupby(rows, key=lambda row: row[:3])
+    }
+
+    return JsonResponse(data={
+        'series': [{
+            'platform': platform_name,
+            'channel': channel_name,
+            'measure': measure_name,
+            'measure_data': measure_data.get((platform_name, channel_name, measure_name), {})
+        } for (platform_name, channel_name, measure_name) in series_list],
+        'resolution': resolution
+    })
 
 
 def experiment(request):
     '''
     Gets measure data associated with a specific experiment
+
+    Takes stream=1 to stream json responses, and since=<seconds since the
+    epoch> to only get new data, like the measure endpoint.
     '''
     measure_name = request.GET.get('measure')
     interval = request.GET.get('interval')
     start = request.GET.get('start')
     experiment_name = request.GET.get('experiment')
+    stream = _is_enabled(request.GET.get('stream'))
+    since = request.GET.get('since')
 
     if not all([measure_name, experiment_name, interval]):
         return HttpResponseBadRequest("Must specify measure, experiment, interval")
     if not all([val is None or val.isdigit() for val in (start, interval)]):
         raise HttpResponseBadRequest(
             "Interval / start time must be specified in seconds (as an integer)")
+    if since is not None and not since.isdigit():
+        return HttpResponseBadRequest("Since must be specified in seconds (as an integer)")
 
     datums = Datum.objects.filter(
         measure__name=measure_name,
@@ -261,17 +710,33 @@ def experiment(request):
         build__version=None,
         experiment_branch__experiment__name=experiment_name)
 
+    response_format = get_response_format(request)
+    format_error_response = _check_response_format(response_format)
+    if format_error_response:
+        return format_error_response
+
     if not datums.exists():
         return HttpResponseNotFound("No data available for this experiment")
 
-    ret = {}
-
     datums = _filter_datums_to_time_interval(datums, start, interval)
-    for (experiment_branch, timestamp, value, usage_hours) in datums.values_list(
-            'experiment_branch__name',
-            'timestamp', 'value', 'usage_hours').order_by('timestamp'):
-        if not ret.get(experiment_branch):
-            ret[experiment_branch] = []
-        ret[experiment_branch].append((timestamp, value, usage_hours))
-
-    return JsonResponse(data={'measure_data': ret})
+    if since is not None:
+        datums = _filter_datums_since(datums, since)
+    rows = datums.values_list(
+        'experiment_branch__name',
+        'timestamp', 'value', 'usage_hours').order_by(
+            'experiment_branch__name', 'timestamp').iterator(chunk_size=API_DATUM_CHUNK_SIZE)
+
+    cursor = None
+    if since is not None:
+        cursor = _Cursor(since)
+        rows = cursor.track(rows)
+
+    def _get_extra_data():
+        return {'cursor': cursor.value} if cursor is not None else {}
+
+    if response_format == 'arrow':
+        arrays = get_series_arrays(rows, ('experiment_branch',))
+        return get_arrow_response(arrays, metadata={
+            key: str(value) for (key, value) in _get_extra_data().items()} or None)
+
+    return _get_measure_data_response(_get_branch_series(rows), _get_extra_data, stream)
@@ -16,3 +16,14 @@ class BaseAppConfig(AppConfig):
         # library. See also
         # https://github.com/mozilla/sugardough/issues/38
         session_csrf.monkeypatch()
+
+        # measure summary responses depend on which measures are enabled
+        # for which channels, so let them know when that changes
+        from django.db.models.signals import (m2m_changed, post_delete,
+                                              post_save)
+        from missioncontrol.base.models import Measure
+        from missioncontrol.etl.measuresummary import set_measure_summaries_modified
+        post_save.connect(set_measure_summaries_modified, sender=Measure)
+        post_delete.connect(set_measure_summaries_modified, sender=Measure)
+        m2m_changed.connect(set_measure_summaries_modified,
+                            sender=Measure.channels.through)
@@ -0,0 +1,70 @@
+import time
+
+from django.core.cache import cache
+
+# values are stored in an "envelope" along with the time they should be
+# refreshed after (their soft expiry)
+SOFT_EXPIRY_KEY = 'softExpiry'
+VALUE_KEY = 'value'
+
+# how long to wait for a refresh of a stale value before scheduling another
+REFRESH_LOCK_EXPIRY = 15 * 60
+
+
+def _get_envelope(value, soft_expiry):
+    return {SOFT_EXPIRY_KEY: time.time() + soft_expiry, VALUE_KEY: value}
+
+
+def _get_refresh_lock_key(key):
+    return ':'.join([key, 'refreshing'])
+
+
+def set_with_soft_expiry(key, value, soft_expiry, hard_expiry):
+    '''
+    Caches a value which should be refreshed after soft_expiry seconds, but
+    can still be served (stale) until hard_expiry seconds
+    '''
+    cache.set(key, _get_envelope(value, soft_expiry), hard_expiry)
+    # the value has been refreshed, so the next time it goes stale it
+    # should be refreshed again
+    cache.delete(_get_refresh_lock_key(key))
+
+
+def set_many_with_soft_expiry(values, soft_expiry, hard_expiry):
+    '''
+    Same as set_with_soft_expiry, but for a dictionary of key -> value
+    '''
+    cache.set_many({key: _get_envelope(value, soft_expiry) for (key, value)
+                    in values.items()}, hard_expiry)
+    cache.delete_many([_get_refresh_lock_key(key) for key in values.keys()])
+
+
+def get_many_with_soft_expiry(keys, refresh):
+    '''
+    Returns a dictionary of key -> value for the keys that are cached, stale
+    or not
+
+    refresh(key) is called for every stale value, unless a refresh of it has
+    already been triggered (and not timed out) since it went stale: it is
+    expected to schedule a background recalculation of the value. Values
+    cached without a soft expiry (e.g. with a plain cache.set) are returned
+    as they are.
+    '''
+    values = {}
+    now = time.time()
+    for (key, value) in cache.get_many(keys).items():
+        if not isinstance(value, dict) or SOFT_EXPIRY_KEY not in value:
+            values[key] = value
+            continue
+        values[key] = value[VALUE_KEY]
+        if value[SOFT_EXPIRY_KEY] <= now and cache.add(_get_refresh_lock_key(key), True,
+                                                       REFRESH_LOCK_EXPIRY):
+            refresh(key)
+    return values
+
+
+def get_with_soft_expiry(key, refresh, default=None):
+    '''
+    Same as get_many_with_soft_expiry, but for a single key
+    '''
+    return get_many_with_soft_expiry([key], refresh).get(key, default)
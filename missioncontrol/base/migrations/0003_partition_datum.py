@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.utils import timezone
+
+from missioncontrol.base.partitions import (partition_datum_table,
+                                            unpartition_datum_table)
+from missioncontrol.settings import (DATA_EXPIRY_INTERVAL,
+                                     DATUM_PARTITION_PRECREATE_INTERVAL)
+
+
+def partition_datum(apps, schema_editor):
+    now = timezone.now()
+    partition_datum_table(now - DATA_EXPIRY_INTERVAL,
+                          now + DATUM_PARTITION_PRECREATE_INTERVAL,
+                          conn=schema_editor.connection)
+
+
+def unpartition_datum(apps, schema_editor):
+    unpartition_datum_table(conn=schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0002_index_on_datum_timestamp'),
+    ]
+
+    # this is a no-op on databases which do not support native partitioning
+    # (i.e. anything other than postgres 11 or later)
+    operations = [
+        migrations.RunPython(partition_datum, unpartition_datum),
+    ]
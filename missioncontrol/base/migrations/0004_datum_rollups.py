@@ -0,0 +1,46 @@
+# Generated by Django 2.2.9 on 2026-10-18 17:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0003_partition_datum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyDatum',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('value', models.FloatField()),
+                ('usage_hours', models.FloatField()),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Build')),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Measure')),
+            ],
+            options={
+                'db_table': 'datum_hourly',
+                'abstract': False,
+                'unique_together': {('build', 'measure', 'timestamp')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyDatum',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('value', models.FloatField()),
+                ('usage_hours', models.FloatField()),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Build')),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Measure')),
+            ],
+            options={
+                'db_table': 'datum_daily',
+                'abstract': False,
+                'unique_together': {('build', 'measure', 'timestamp')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.9 on 2026-10-18 17:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Max
+
+
+def create_watermarks(apps, schema_editor):
+    # seed the watermarks from whatever data we have already, so the etl
+    # picks up where it left off
+    Datum = apps.get_model('base', 'Datum')
+    IngestionWatermark = apps.get_model('base', 'IngestionWatermark')
+    IngestionWatermark.objects.bulk_create([
+        IngestionWatermark(application_id=v['build__application'],
+                           platform_id=v['build__platform'],
+                           channel_id=v['build__channel'],
+                           timestamp=v['timestamp__max'])
+        for v in Datum.objects.filter(build__isnull=False).values(
+            'build__application', 'build__platform', 'build__channel').annotate(
+                Max('timestamp'))
+    ] + [
+        IngestionWatermark(experiment_id=v['experiment_branch__experiment'],
+                           timestamp=v['timestamp__max'])
+        for v in Datum.objects.filter(experiment_branch__isnull=False).values(
+            'experiment_branch__experiment').annotate(Max('timestamp'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0004_datum_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('application', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='base.Application')),
+                ('channel', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='base.Channel')),
+                ('experiment', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='base.Experiment')),
+                ('platform', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='base.Platform')),
+            ],
+            options={
+                'db_table': 'ingestion_watermark',
+                'unique_together': {('experiment',), ('application', 'platform', 'channel')},
+            },
+        ),
+        migrations.RunPython(create_watermarks, migrations.RunPython.noop),
+    ]
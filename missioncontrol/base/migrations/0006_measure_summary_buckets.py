@@ -0,0 +1,33 @@
+# Generated by Django 2.2.9 on 2026-10-18 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_ingestion_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasureSummaryBucket',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField(db_index=True)),
+                ('min_timestamp', models.DateTimeField()),
+                ('max_timestamp', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('value', models.FloatField()),
+                ('usage_hours', models.FloatField()),
+                ('top_values', models.TextField()),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Build')),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Measure')),
+            ],
+            options={
+                'db_table': 'measure_summary_bucket',
+                'unique_together': {('build', 'measure', 'timestamp')},
+            },
+        ),
+    ]
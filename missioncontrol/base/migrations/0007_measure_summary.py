@@ -0,0 +1,28 @@
+# Generated by Django 2.2.9 on 2026-10-18 17:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_measure_summary_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasureSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('versions', models.TextField()),
+                ('last_updated', models.DateTimeField()),
+                ('channel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Channel')),
+                ('measure', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.Measure')),
+            ],
+            options={
+                'db_table': 'measure_summary',
+                'unique_together': {('measure', 'channel')},
+            },
+        ),
+    ]
@@ -131,3 +131,108 @@ class Datum(models.Model):
         db_table = 'datum'
         unique_together = (('build', 'measure', 'timestamp'),
                            ('experiment_branch', 'measure', 'timestamp'))
+
+
+class DatumRollup(models.Model):
+    '''
+    Base class for aggregates of build data over a longer period
+
+    Values and usage hours are summed over all datums in the period (so rates
+    derived from them stay accurate), rollups are kept up to date by the
+    measure ETL as new data comes in.
+    '''
+    id = models.BigAutoField(primary_key=True)
+    build = models.ForeignKey(Build, on_delete=models.CASCADE)
+    measure = models.ForeignKey(Measure, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(db_index=True)
+    value = models.FloatField()
+    usage_hours = models.FloatField()
+
+    class Meta:
+        abstract = True
+        unique_together = ('build', 'measure', 'timestamp')
+
+
+class HourlyDatum(DatumRollup):
+    '''
+    An aggregate of build data over an hour
+    '''
+    class Meta(DatumRollup.Meta):
+        db_table = 'datum_hourly'
+
+
+class DailyDatum(DatumRollup):
+    '''
+    An aggregate of build data over a day
+    '''
+    class Meta(DatumRollup.Meta):
+        db_table = 'datum_daily'
+
+
+class MeasureSummaryBucket(models.Model):
+    '''
+    Running aggregates of a day of build data, used to calculate measure
+    summaries incrementally
+
+    Besides sums, the (value, usage hours) of the datums with the highest
+    rates are kept, which is all summaries need to exclude outliers.
+    '''
+    id = models.BigAutoField(primary_key=True)
+    build = models.ForeignKey(Build, on_delete=models.CASCADE)
+    measure = models.ForeignKey(Measure, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField(db_index=True)
+    min_timestamp = models.DateTimeField()
+    max_timestamp = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    value = models.FloatField()
+    usage_hours = models.FloatField()
+    top_values = models.TextField()  # json list of [value, usage_hours] pairs
+
+    class Meta:
+        db_table = 'measure_summary_bucket'
+        unique_together = ('build', 'measure', 'timestamp')
+
+
+class MeasureSummary(models.Model):
+    '''
+    The most recently calculated summary of a measure on a channel
+
+    Summaries are served from the cache, this is what the cache is
+    (re)populated from when they're missing from it (e.g. after a restart).
+    '''
+    measure = models.ForeignKey(Measure, on_delete=models.CASCADE)
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    versions = models.TextField()  # json list of version summaries
+    last_updated = models.DateTimeField()
+
+    class Meta:
+        db_table = 'measure_summary'
+        unique_together = ('measure', 'channel')
+
+
+class IngestionWatermark(models.Model):
+    '''
+    The timestamp of the most recent datum ingested for a series of data
+
+    Series are either an application/platform/channel combination or an
+    experiment. Watermarks only ever move forward and are updated in the
+    same transaction as the data, so the ETL can resume from them (and we
+    can tell how fresh each series is) without scanning the datum table.
+    '''
+    application = models.ForeignKey(Application, on_delete=models.CASCADE, null=True)
+    platform = models.ForeignKey(Platform, on_delete=models.CASCADE, null=True)
+    channel = models.ForeignKey(Channel, on_delete=models.CASCADE, null=True)
+    experiment = models.ForeignKey(Experiment, on_delete=models.CASCADE, null=True)
+    timestamp = models.DateTimeField()
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ingestion_watermark'
+        unique_together = (('application', 'platform', 'channel'),
+                           ('experiment',))
+
+    def __str__(self):
+        if self.experiment_id:
+            return ' '.join([self.experiment.name, str(self.timestamp)])
+        return ' '.join([self.application.name, self.platform.name,
+                         self.channel.name, str(self.timestamp)])
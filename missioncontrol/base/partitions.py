@@ -0,0 +1,194 @@
+import datetime
+import logging
+import re
+
+from dateutil import parser
+from django.db import connection, transaction
+
+from missioncontrol.settings import DATUM_PARTITION_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+DATUM_TABLE = 'datum'
+DATUM_DEFAULT_PARTITION = 'datum_default'
+
+# 1970-01-05 was a monday, so weekly partitions always start on mondays
+PARTITION_EPOCH = datetime.date(1970, 1, 5)
+
+# native partitioning with primary keys, foreign keys and default partitions
+# is only available from postgres 11 onward
+MIN_PARTITIONING_SERVER_VERSION = 110000
+
+
+def supports_partitioning(conn=connection):
+    return (conn.vendor == 'postgresql' and
+            conn.pg_version >= MIN_PARTITIONING_SERVER_VERSION)
+
+
+def is_datum_partitioned(conn=connection):
+    if not supports_partitioning(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE '
+                       'partrelid = to_regclass(%s)', [DATUM_TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_partition_start(timestamp):
+    '''
+    Returns the (utc) date on which the partition holding timestamp starts
+    '''
+    days = (timestamp.date() - PARTITION_EPOCH).days
+    interval_days = DATUM_PARTITION_INTERVAL.days
+    return PARTITION_EPOCH + datetime.timedelta(days=days - days % interval_days)
+
+
+def get_partition_name(partition_start):
+    return '{}_p{}'.format(DATUM_TABLE, partition_start.strftime('%Y%m%d'))
+
+
+def _get_partition_bounds(min_timestamp, max_timestamp):
+    partition_start = get_partition_start(min_timestamp)
+    while partition_start <= max_timestamp.date():
+        partition_end = partition_start + DATUM_PARTITION_INTERVAL
+        yield (partition_start, partition_end)
+        partition_start = partition_end
+
+
+def _create_partitions(cursor, min_timestamp, max_timestamp):
+    created = 0
+    for (partition_start, partition_end) in _get_partition_bounds(min_timestamp,
+                                                                  max_timestamp):
+        partition_name = get_partition_name(partition_start)
+        cursor.execute('SELECT to_regclass(%s)', [partition_name])
+        if cursor.fetchone()[0] is not None:
+            continue
+        cursor.execute(
+            'CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+                partition_name, DATUM_TABLE),
+            [partition_start.strftime('%Y-%m-%d 00:00:00+00'),
+             partition_end.strftime('%Y-%m-%d 00:00:00+00')])
+        created += 1
+    return created
+
+
+def ensure_datum_partitions(min_timestamp, max_timestamp, conn=connection):
+    '''
+    Makes sure partitions exist for every timestamp between min_timestamp and
+    max_timestamp, returning the number of partitions created
+    '''
+    if not is_datum_partitioned(conn):
+        return 0
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        return _create_partitions(cursor, min_timestamp, max_timestamp)
+
+
+def get_datum_partitions(conn=connection):
+    '''
+    Returns a list of (partition name, upper bound) tuples for all range
+    partitions of the datum table, oldest first
+    '''
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)''', [DATUM_TABLE])
+        partitions = []
+        for (partition_name, partition_bound) in cursor.fetchall():
+            # the default partition has no upper bound and is never dropped
+            match = re.search(r"TO \('([^']+)'\)", partition_bound)
+            if match:
+                partitions.append((partition_name, parser.parse(match.group(1))))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def drop_expired_datum_partitions(max_age, conn=connection):
+    '''
+    Detaches and drops every partition only holding data older than max_age,
+    returning the names of the dropped partitions
+    '''
+    if not is_datum_partitioned(conn):
+        return []
+    dropped = []
+    for (partition_name, upper_bound) in get_datum_partitions(conn):
+        if upper_bound > max_age:
+            break
+        with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+            cursor.execute('ALTER TABLE {} DETACH PARTITION {}'.format(
+                DATUM_TABLE, partition_name))
+            cursor.execute('DROP TABLE {}'.format(partition_name))
+        logger.info('Dropped expired datum partition %s', partition_name)
+        dropped.append(partition_name)
+    return dropped
+
+
+def _add_datum_constraints(cursor, primary_key):
+    cursor.execute('''
+        ALTER TABLE datum
+        ADD CONSTRAINT datum_pkey PRIMARY KEY ({}),
+        ADD CONSTRAINT datum_build_id_measure_id_timestamp_uniq
+            UNIQUE (build_id, measure_id, "timestamp"),
+        ADD CONSTRAINT datum_experiment_branch_id_measure_id_timestamp_uniq
+            UNIQUE (experiment_branch_id, measure_id, "timestamp"),
+        ADD CONSTRAINT datum_build_id_fk_build_id
+            FOREIGN KEY (build_id) REFERENCES build (id)
+            DEFERRABLE INITIALLY DEFERRED,
+        ADD CONSTRAINT datum_experiment_branch_id_fk_experiment_branch_id
+            FOREIGN KEY (experiment_branch_id) REFERENCES experiment_branch (id)
+            DEFERRABLE INITIALLY DEFERRED,
+        ADD CONSTRAINT datum_measure_id_fk_measure_id
+            FOREIGN KEY (measure_id) REFERENCES measure (id)
+            DEFERRABLE INITIALLY DEFERRED'''.format(primary_key))
+    for column in ('timestamp', 'build_id', 'experiment_branch_id', 'measure_id'):
+        cursor.execute('CREATE INDEX datum_{0}_idx ON datum ("{0}")'.format(column))
+
+
+def partition_datum_table(min_timestamp, max_timestamp, conn=connection):
+    '''
+    Converts the datum table into a table range partitioned on timestamp
+
+    Partitions are created for existing data and up to max_timestamp,
+    anything outside of that ends up in a default partition.
+    '''
+    if not supports_partitioning(conn) or is_datum_partitioned(conn):
+        return
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        cursor.execute('SELECT min("timestamp") FROM datum')
+        oldest_timestamp = cursor.fetchone()[0]
+        if oldest_timestamp is not None:
+            min_timestamp = min(min_timestamp, oldest_timestamp)
+
+        cursor.execute('ALTER TABLE datum RENAME TO datum_unpartitioned')
+        cursor.execute('''
+            CREATE TABLE datum (LIKE datum_unpartitioned
+                                INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE ("timestamp")''')
+        _create_partitions(cursor, min_timestamp, max_timestamp)
+        cursor.execute('CREATE TABLE {} PARTITION OF datum DEFAULT'.format(
+            DATUM_DEFAULT_PARTITION))
+        cursor.execute('INSERT INTO datum SELECT * FROM datum_unpartitioned')
+        cursor.execute('ALTER SEQUENCE datum_id_seq OWNED BY datum.id')
+        cursor.execute('DROP TABLE datum_unpartitioned')
+
+        # unique constraints (including the primary key) on a partitioned
+        # table must contain the partition key
+        _add_datum_constraints(cursor, 'id, "timestamp"')
+
+
+def unpartition_datum_table(conn=connection):
+    '''
+    Converts a partitioned datum table back into a regular table
+    '''
+    if not is_datum_partitioned(conn):
+        return
+    with transaction.atomic(using=conn.alias), conn.cursor() as cursor:
+        cursor.execute('ALTER TABLE datum RENAME TO datum_partitioned')
+        cursor.execute('''
+            CREATE TABLE datum (LIKE datum_partitioned
+                                INCLUDING DEFAULTS INCLUDING CONSTRAINTS)''')
+        cursor.execute('INSERT INTO datum SELECT * FROM datum_partitioned')
+        cursor.execute('ALTER SEQUENCE datum_id_seq OWNED BY datum.id')
+        # dropping the parent drops all its partitions along with it
+        cursor.execute('DROP TABLE datum_partitioned')
+        _add_datum_constraints(cursor, 'id')
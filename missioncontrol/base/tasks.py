@@ -1,12 +1,34 @@
 import datetime
 
+from django.utils import timezone
+
 from missioncontrol.celery import celery
-from missioncontrol.settings import DATA_EXPIRY_INTERVAL
+from missioncontrol.settings import (DATA_EXPIRY_INTERVAL,
+                                     DATUM_PARTITION_PRECREATE_INTERVAL)
+
+from .models import (DailyDatum,
+                     Datum,
+                     HourlyDatum,
+                     MeasureSummary,
+                     MeasureSummaryBucket)
+from .partitions import (drop_expired_datum_partitions,
+                         ensure_datum_partitions)
 
-from .models import Datum
+
+@celery.task
+def create_datum_partitions():
+    now = timezone.now()
+    ensure_datum_partitions(now, now + DATUM_PARTITION_PRECREATE_INTERVAL)
 
 
 @celery.task
 def expire_old_data():
     max_age = datetime.datetime.now() - DATA_EXPIRY_INTERVAL
+    # dropping whole partitions is much cheaper than deleting their rows,
+    # what remains is the (partial) partition straddling max_age
+    drop_expired_datum_partitions(timezone.make_aware(max_age))
     Datum.objects.filter(timestamp__lt=max_age).delete()
+    for rollup_model in (HourlyDatum, DailyDatum, MeasureSummaryBucket):
+        rollup_model.objects.filter(timestamp__lt=max_age).delete()
+    # summaries of measures we no longer have any data for
+    MeasureSummary.objects.filter(last_updated__lt=max_age).delete()
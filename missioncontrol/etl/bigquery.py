@@ -1,5 +1,13 @@
+from django.conf import settings
 from google.cloud import bigquery
 
+from . import replay
+
 
 def get_bigquery_client():
-    return bigquery.Client()
+    if settings.ETL_REPLAY_DIR:
+        return replay.ReplayBigQueryClient(settings.ETL_REPLAY_DIR)
+    client = bigquery.Client()
+    if settings.ETL_RECORD_DIR:
+        return replay.RecordingBigQueryClient(client, settings.ETL_RECORD_DIR)
+    return client
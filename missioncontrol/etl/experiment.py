@@ -2,25 +2,33 @@ import datetime
 import logging
 
 import newrelic.agent
-from django.db.models import Max
+from django.db import transaction
 from django.utils import timezone
 from dateutil.tz import tzutc
 
-from missioncontrol.base.models import (Datum,
-                                        Experiment,
+from missioncontrol.base.models import (Experiment,
                                         ExperimentBranch,
                                         Measure)
 from missioncontrol.celery import celery
 from missioncontrol.settings import (DATA_EXPIRY_INTERVAL,
                                      PRESTO_EXPERIMENTS_ERROR_AGGREGATES_TABLE)
-from .presto import raw_query
+from .loader import load_datums
+from . import presto
+from .watermarks import (advance_watermark, get_watermark)
 
 
 logger = logging.getLogger(__name__)
 
 
 @celery.task
-def update_experiment(experiment_name):
+def update_experiment(experiment_name, raw_query=None):
+    '''
+    Loads any new measure data for an experiment, returning the number of
+    datums loaded
+
+    raw_query, if specified, is used in place of presto.raw_query to fetch
+    the data.
+    '''
     logger.info('Updating experiment: %s', experiment_name)
     newrelic.agent.add_custom_parameter("experiment", experiment_name)
 
@@ -30,9 +38,7 @@ def update_experiment(experiment_name):
     experiment = Experiment.objects.get(name=experiment_name)
 
     min_timestamp = timezone.now() - DATA_EXPIRY_INTERVAL
-    min_timestamp_in_data = Datum.objects.filter(
-        experiment_branch__experiment=experiment,
-        measure__in=measures).aggregate(Max('timestamp'))['timestamp__max']
+    min_timestamp_in_data = get_watermark(experiment=experiment)
     if min_timestamp_in_data:
         min_timestamp = max([min_timestamp, min_timestamp_in_data])
 
@@ -59,9 +65,9 @@ def update_experiment(experiment_name):
     newrelic.agent.add_custom_parameter("query", query_template % params)
 
     experiment_cache = {}
-    datum_objs = []
+    datum_rows = []
     for (window_start, experiment_branch_name, usage_hours, client_count,
-         *measure_counts) in raw_query(query_template, params):
+         *measure_counts) in (raw_query or presto.raw_query)(query_template, params):
         # skip datapoints with no usage hours
         if usage_hours <= 0:
             continue
@@ -85,11 +91,12 @@ def update_experiment(experiment_name):
             # presto doesn't specify timezone information (but it's really utc)
             window_start = datetime.datetime.fromtimestamp(
                 window_start.timestamp(), tz=tzutc())
-            datum_objs.append(Datum(
-                experiment_branch=experiment_branch,
-                measure=measure,
-                timestamp=window_start,
-                value=measure_count or 0,
-                usage_hours=usage_hours,
-                client_count=client_count))
-    Datum.objects.bulk_create(datum_objs)
+            datum_rows.append((None, experiment_branch.id, measure.id, window_start,
+                               measure_count or 0, usage_hours, client_count))
+    if not datum_rows:
+        return 0
+    with transaction.atomic():
+        load_datums(datum_rows)
+        advance_watermark(max([datum_row[3] for datum_row in datum_rows]),
+                          experiment=experiment)
+    return len(datum_rows)
@@ -0,0 +1,139 @@
+import io
+import itertools
+import logging
+import time
+
+from django.db import (connection, transaction)
+from psycopg2.extras import execute_values
+
+from missioncontrol.base.models import Datum
+from missioncontrol.settings import DATUM_BATCH_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+# the order of the values in the datum rows accepted by the loader
+DATUM_COLUMNS = ('build_id', 'experiment_branch_id', 'measure_id', 'timestamp',
+                 'value', 'usage_hours', 'client_count')
+# the values which identify a build / experiment datum
+BUILD_DATUM_KEY = ('build_id', 'measure_id', 'timestamp')
+EXPERIMENT_DATUM_KEY = ('experiment_branch_id', 'measure_id', 'timestamp')
+
+
+# characters with a special meaning in postgres' COPY text format
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def _format_copy_value(value):
+    # formats a value in postgres' COPY text format
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.translate(COPY_ESCAPES)
+    # (str rather than repr, so e.g. Decimal('1.5') and numpy floats are
+    # written out as plain numbers)
+    return str(value)
+
+
+def _copy_datums(datum_rows, conn):
+    buffer = io.StringIO()
+    num_rows = 0
+    for datum_row in datum_rows:
+        buffer.write('\t'.join([_format_copy_value(v) for v in datum_row]))
+        buffer.write('\n')
+        num_rows += 1
+    buffer.seek(0)
+    with conn.cursor() as cursor:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(
+            Datum._meta.db_table, ', '.join(DATUM_COLUMNS)), buffer)
+    return num_rows
+
+
+def _bulk_create_datums(datum_rows):
+    datum_objs = [Datum(**dict(zip(DATUM_COLUMNS, datum_row)))
+                  for datum_row in datum_rows]
+    Datum.objects.bulk_create(datum_objs)
+    return len(datum_objs)
+
+
+def load_datums(datum_rows, conn=connection):
+    '''
+    Inserts datum rows (tuples of values in the order of DATUM_COLUMNS)
+
+    On postgres the rows are streamed to the database with COPY, which is
+    much faster than inserting model instances. Other databases (e.g. sqlite
+    in development) fall back to a regular bulk insert.
+    '''
+    start_time = time.time()
+    if conn.vendor == 'postgresql':
+        num_rows = _copy_datums(datum_rows, conn)
+    else:
+        num_rows = _bulk_create_datums(datum_rows)
+    elapsed = time.time() - start_time
+    logger.info('Loaded %s datums in %.2fs (%.0f datums/s)', num_rows, elapsed,
+                num_rows / elapsed if elapsed else 0)
+    return num_rows
+
+
+def chunked(rows, chunk_size):
+    '''
+    Splits an iterable of rows into lists of (at most) chunk_size rows
+    '''
+    rows = iter(rows)
+    chunk = list(itertools.islice(rows, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(rows, chunk_size))
+
+
+def _insert_on_conflict_datums(datum_rows, key_columns, overwrite, batch_size,
+                               conn):
+    if overwrite:
+        conflict_action = 'UPDATE SET {}'.format(', '.join([
+            '{0} = EXCLUDED.{0}'.format(column) for column in DATUM_COLUMNS
+            if column not in key_columns]))
+    else:
+        conflict_action = 'NOTHING'
+    query = 'INSERT INTO {} ({}) VALUES %s ON CONFLICT ({}) DO {}'.format(
+        Datum._meta.db_table, ', '.join(DATUM_COLUMNS),
+        ', '.join(['"{}"'.format(column) for column in key_columns]),
+        conflict_action)
+    with conn.cursor() as cursor:
+        execute_values(cursor, query, datum_rows, page_size=batch_size)
+
+
+def _update_or_create_datums(datum_rows, key_columns, overwrite, batch_size):
+    for datum_rows_chunk in chunked(datum_rows, batch_size):
+        with transaction.atomic():
+            for datum_row in datum_rows_chunk:
+                datum_values = dict(zip(DATUM_COLUMNS, datum_row))
+                key = {column: datum_values.pop(column) for column in key_columns}
+                if overwrite:
+                    Datum.objects.update_or_create(defaults=datum_values, **key)
+                else:
+                    Datum.objects.get_or_create(defaults=datum_values, **key)
+
+
+def upsert_datums(datum_rows, key_columns=BUILD_DATUM_KEY, overwrite=False,
+                  batch_size=DATUM_BATCH_SIZE, conn=connection):
+    '''
+    Inserts datum rows which may already exist (e.g. when backfilling)
+
+    Existing datums with the same key are left alone, unless overwrite is
+    specified, in which case their values are replaced (useful for picking up
+    corrected aggregates). On postgres this is done with one
+    INSERT ... ON CONFLICT statement per batch_size rows.
+    '''
+    datum_rows = list(datum_rows)
+    start_time = time.time()
+    if conn.vendor == 'postgresql':
+        _insert_on_conflict_datums(datum_rows, key_columns, overwrite,
+                                   batch_size, conn)
+    else:
+        _update_or_create_datums(datum_rows, key_columns, overwrite, batch_size)
+    elapsed = time.time() - start_time
+    logger.info('Upserted %s datums in %.2fs (%.0f datums/s)', len(datum_rows),
+                elapsed, len(datum_rows) / elapsed if elapsed else 0)
+    return len(datum_rows)
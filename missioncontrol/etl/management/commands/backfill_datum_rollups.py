@@ -0,0 +1,50 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from missioncontrol.base.models import (Channel,
+                                        Measure,
+                                        Platform)
+from missioncontrol.etl.rollups import update_datum_rollups
+from missioncontrol.etl.watermarks import set_series_modified
+from missioncontrol.settings import DATA_EXPIRY_INTERVAL
+
+
+class Command(BaseCommand):
+    """
+    Management command to (re)calculate the hourly and daily datum rollups
+    from existing data, e.g. data ingested before there were rollups
+
+    Until the rollups cover all the data requested, the API falls back to
+    returning raw data.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--platform', dest='platform', type=str,
+                            help='only update rollups for specified platform')
+        parser.add_argument('--channel', dest='channel', type=str,
+                            help='only update rollups for specified channel')
+
+    def handle(self, *args, **options):
+        channels = (Channel.objects.all() if not options['channel'] else
+                    Channel.objects.filter(name=options['channel']))
+        platforms = (Platform.objects.all() if not options['platform'] else
+                     Platform.objects.filter(name=options['platform']))
+        now = timezone.now()
+        for channel in channels:
+            for platform in platforms:
+                measures = Measure.objects.filter(channels=channel, platform=platform)
+                if not measures.exists():
+                    continue
+                # one day at a time, to keep memory use in check
+                day = (now - DATA_EXPIRY_INTERVAL).replace(hour=0, minute=0, second=0,
+                                                           microsecond=0)
+                while day <= now:
+                    update_datum_rollups(platform, channel, measures, day,
+                                         day + datetime.timedelta(days=1, microseconds=-1))
+                    day += datetime.timedelta(days=1)
+                # cached responses may have fallen back to raw data
+                set_series_modified(platform.name, channel.name)
+                self.stdout.write('Updated datum rollups for {} {}'.format(
+                    channel.name, platform.name))
@@ -0,0 +1,209 @@
+import datetime
+import random
+import resource
+import time
+
+from dateutil.tz import tzutc
+from django.core.management.base import BaseCommand
+from django.db import (connection, transaction)
+from django.utils import timezone
+
+from missioncontrol.base.models import (Application,
+                                        Build,
+                                        Channel,
+                                        Experiment,
+                                        Measure,
+                                        Platform)
+from missioncontrol.etl import (experiment,
+                                measure,
+                                replay)
+from missioncontrol.etl.watermarks import get_watermark
+from missioncontrol.settings import (DATA_EXPIRY_INTERVAL,
+                                     DATUM_BATCH_SIZE)
+
+
+# number of (fake) builds to spread synthetic measure data over
+NUM_SYNTHETIC_BUILDS = 10
+SYNTHETIC_VERSION = '999.0'
+SYNTHETIC_EXPERIMENT_BRANCHES = ('control', 'treatment')
+
+
+class _Counter:
+    '''
+    Counts the rows passing through an iterable
+    '''
+
+    def __init__(self):
+        self.num_rows = 0
+
+    def count(self, rows):
+        for row in rows:
+            self.num_rows += 1
+            yield row
+
+
+class _CountingBigQueryClient:
+    '''
+    Answers bigquery queries with the given rows (or the results recorded in a
+    directory), counting the queries and rows returned
+    '''
+
+    def __init__(self, counter, rows=None, replay_dir=None):
+        (self.counter, self.rows, self.replay_dir) = (counter, rows, replay_dir)
+        self.num_queries = 0
+
+    def query(self, query):
+        self.num_queries += 1
+        rows = self.rows
+        if self.replay_dir:
+            rows = replay.load_result(self.replay_dir, query)
+        return replay.ReplayQueryJob(self.counter.count(rows))
+
+
+def _get_synthetic_windows(num_windows, min_timestamp):
+    # query results have no timezone information
+    window_start = min_timestamp.astimezone(tzutc()).replace(tzinfo=None)
+    for _ in range(num_windows):
+        window_start += datetime.timedelta(minutes=5)
+        yield window_start
+
+
+def _get_synthetic_counts(num_measures):
+    return [random.randint(0, 10) for _ in range(num_measures)]
+
+
+class Command(BaseCommand):
+    """
+    Management command to measure the throughput of the ETL
+
+    Data is loaded from synthetic (or previously recorded) query results, all
+    database changes are rolled back afterwards (and, as the data is never
+    committed, the caches are never told about it).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', dest='rows', type=int, default=10000,
+                            help='number of synthetic query result rows to load')
+        parser.add_argument('--replay', dest='replay', type=str,
+                            help='load results recorded in this directory (see '
+                            'ETL_RECORD_DIR) instead of synthetic ones')
+        parser.add_argument('--application', dest='application', default='firefox')
+        parser.add_argument('--platform', dest='platform', default='linux')
+        parser.add_argument('--channel', dest='channel', default='release')
+        parser.add_argument('--date', dest='date', type=str,
+                            help='submission date to load measure data for '
+                            '(needed to match recorded results), default is today')
+        parser.add_argument('--upsert', dest='upsert', action='store_true',
+                            help='load measure data the way backfills do')
+        parser.add_argument('--experiment', dest='experiment', type=str,
+                            help='benchmark loading data for this experiment '
+                            'instead of measures')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=DATUM_BATCH_SIZE)
+
+    def get_synthetic_measure_rows(self, options, submission_date):
+        (application, platform, channel) = (
+            Application.objects.get(name=options['application']),
+            Platform.objects.get(name=options['platform']),
+            Channel.objects.get(name=options['channel']))
+        builds = []
+        for i in range(NUM_SYNTHETIC_BUILDS):
+            build_id = (submission_date - datetime.timedelta(days=i)).strftime(
+                '%Y%m%d%H%M%S')
+            Build.objects.get_or_create(application=application, platform=platform,
+                                        channel=channel, build_id=build_id,
+                                        version=SYNTHETIC_VERSION)
+            builds.append(build_id)
+        num_measures = Measure.objects.filter(channels=channel,
+                                              application=application,
+                                              platform=platform,
+                                              enabled=True).count()
+        # only generate data newer than what we have already (if
+        # benchmarking against a database with real data in it)
+        min_timestamp = submission_date
+        if not options['date']:
+            min_timestamp = max([min_timestamp, get_watermark(
+                application=application, platform=platform,
+                channel=channel) or min_timestamp])
+        return [
+            [window_start, build_id, SYNTHETIC_VERSION, random.uniform(1, 100),
+             random.randint(1, 100)] + _get_synthetic_counts(num_measures)
+            for window_start in _get_synthetic_windows(
+                options['rows'] // len(builds) + 1, min_timestamp)
+            for build_id in builds][:options['rows']]
+
+    def run_measures(self, options, counter):
+        if options['date']:
+            submission_date = datetime.datetime.strptime(
+                options['date'], '%Y-%m-%d').replace(tzinfo=tzutc())
+        else:
+            now = datetime.datetime.utcnow()
+            submission_date = datetime.datetime(year=now.year, month=now.month,
+                                                day=now.day, tzinfo=tzutc())
+        if options['replay']:
+            client = _CountingBigQueryClient(counter, replay_dir=options['replay'])
+        else:
+            client = _CountingBigQueryClient(counter, rows=self.get_synthetic_measure_rows(
+                options, submission_date))
+
+        num_datums = measure.update_measures(
+            options['application'], options['platform'], options['channel'],
+            submission_date=(submission_date if options['date'] else None),
+            bulk_create=not options['upsert'], batch_size=options['batch_size'],
+            client=client)
+        return (num_datums, client.num_queries)
+
+    def run_experiment(self, options, counter):
+        (experiment_obj, _) = Experiment.objects.get_or_create(
+            name=options['experiment'], defaults={'enabled': True})
+        source_queries = []
+
+        def _raw_query(raw_sql, params):
+            source_queries.append(raw_sql)
+            if options['replay']:
+                return counter.count(replay.load_result(options['replay'],
+                                                        raw_sql, params))
+            min_timestamp = max([timezone.now() - DATA_EXPIRY_INTERVAL,
+                                 get_watermark(experiment=experiment_obj) or
+                                 timezone.now() - DATA_EXPIRY_INTERVAL])
+            num_measures = Measure.objects.filter(platform=None).count()
+            return counter.count([
+                [window_start, branch, random.uniform(1, 100),
+                 random.randint(1, 100)] + _get_synthetic_counts(num_measures)
+                for window_start in _get_synthetic_windows(
+                    options['rows'] // len(SYNTHETIC_EXPERIMENT_BRANCHES) + 1,
+                    min_timestamp)
+                for branch in SYNTHETIC_EXPERIMENT_BRANCHES][:options['rows']])
+
+        num_datums = experiment.update_experiment(options['experiment'],
+                                                  raw_query=_raw_query)
+        return (num_datums, len(source_queries))
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        counter = _Counter()
+        db_queries = []
+
+        def _count_query(execute, sql, params, many, context):
+            db_queries.append(None)
+            return execute(sql, params, many, context)
+
+        # (summary updates are only scheduled once the data is committed, so
+        # they're not part of what we're measuring here)
+        with transaction.atomic(), connection.execute_wrapper(_count_query):
+            start_time = time.time()
+            if options['experiment']:
+                (num_datums, num_source_queries) = self.run_experiment(options, counter)
+            else:
+                (num_datums, num_source_queries) = self.run_measures(options, counter)
+            elapsed = time.time() - start_time
+            transaction.set_rollback(True)
+
+        # ru_maxrss is in kilobytes (on linux)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(
+            'Loaded {} datums from {} rows in {:.2f}s ({:.0f} datums/s), {} source '
+            'queries, {} database queries, peak RSS {:.1f} MB'.format(
+                num_datums, counter.num_rows, elapsed,
+                num_datums / elapsed if elapsed else 0,
+                num_source_queries, len(db_queries), peak_rss))
@@ -1,7 +1,13 @@
 import datetime
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import (ProcessPoolExecutor,
+                                as_completed)
 
 from django.core.management.base import (BaseCommand,
                                          CommandError)
+from django.db import connections
 from dateutil import parser
 
 from missioncontrol.base.models import (Application,
@@ -9,6 +15,30 @@ from missioncontrol.base.models import (Application,
                                         Measure,
                                         Platform)
 from missioncontrol.etl.measure import update_measures
+from missioncontrol.settings import DATUM_BATCH_SIZE
+
+
+def _get_unit_name(unit):
+    (submission_date, application_name, platform_name, channel_name) = unit[:4]
+    return ' '.join([submission_date.strftime('%Y-%m-%d') if submission_date
+                     else 'latest', application_name, platform_name, channel_name])
+
+
+def _run_unit(unit):
+    '''
+    Updates measures for a single (date, combination) unit of work, returning
+    the error which occurred (if any) instead of raising it
+    '''
+    (submission_date, application_name, platform_name, channel_name,
+     bulk_create, overwrite, batch_size, parquet_path) = unit
+    try:
+        update_measures(application_name, platform_name, channel_name,
+                        submission_date=submission_date, bulk_create=bulk_create,
+                        overwrite=overwrite, batch_size=batch_size,
+                        parquet_path=parquet_path)
+    except Exception:
+        return traceback.format_exc()
+    return None
 
 
 class Command(BaseCommand):
@@ -23,9 +53,25 @@ class Command(BaseCommand):
                             help='only fetch data for specified channel(s)')
         parser.add_argument('--start-date', dest='start_date')
         parser.add_argument('--end-date', dest='end_date')
+        parser.add_argument('--overwrite', dest='overwrite', action='store_true',
+                            help='when backfilling, replace existing data with '
+                            'newly fetched values')
+        parser.add_argument('--batch-size', dest='batch_size', type=int,
+                            default=DATUM_BATCH_SIZE,
+                            help='number of datums to fetch and insert at once')
+        parser.add_argument('--workers', dest='workers', type=int, default=1,
+                            help='number of processes to update data with in '
+                            'parallel (one date/combination at a time each)')
+        parser.add_argument('--checkpoint', dest='checkpoint', type=str,
+                            help='when backfilling, record completed '
+                            'dates/combinations in this file and skip any '
+                            'already recorded there (to resume an interrupted run)')
+        parser.add_argument('--from-parquet', dest='parquet_path', type=str,
+                            help='read data from parquet file(s) at this path '
+                            '(e.g. a snapshot of the error aggregates table) '
+                            'instead of BigQuery')
 
-    def update_measures(self, application_name, platform_name, channel_name,
-                        submission_date=None, bulk_create=False):
+    def get_combinations(self, application_name, platform_name, channel_name):
         channels = (Channel.objects.all() if not channel_name else
                     Channel.objects.filter(name=channel_name))
         platforms = (Platform.objects.all() if not platform_name else
@@ -37,9 +83,26 @@ class Command(BaseCommand):
                 for application in applications:
                     if Measure.objects.filter(channels=channel, platform=platform,
                                               application=application).exists():
-                        update_measures(application.name, platform.name,
-                                        channel.name, submission_date=submission_date,
-                                        bulk_create=bulk_create)
+                        yield (application.name, platform.name, channel.name)
+
+    def run_units(self, units, workers):
+        '''
+        Runs units of work (serially or in a pool of worker processes),
+        yielding a (unit, error) tuple as each one completes
+        '''
+        if workers <= 1:
+            for unit in units:
+                yield (unit, _run_unit(unit))
+            return
+
+        # the workers are forked from this process, so make sure they don't
+        # share our database connection(s)
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = {executor.submit(_run_unit, unit): unit for unit in units}
+            for future in as_completed(futures):
+                yield (futures[future], future.result())
 
     def handle(self, *args, **options):
         (start_date, end_date) = (options['start_date'], options['end_date'])
@@ -49,12 +112,57 @@ class Command(BaseCommand):
                                    'specified (or neither)')
             (start, end) = (parser.parse(start_date + ' -0000'),
                             parser.parse(end_date + ' -0000'))
+            submission_dates = []
             current = start
             while current <= end:
-                self.update_measures(options['application'], options['platform'],
-                                     options['channel'], submission_date=current,
-                                     bulk_create=False)
+                submission_dates.append(current)
                 current += datetime.timedelta(days=1)
+            bulk_create = False
         else:
-            self.update_measures(options['application'], options['platform'],
-                                 options['channel'], bulk_create=True)
+            if options['checkpoint']:
+                raise CommandError('--checkpoint can only be used when '
+                                   'backfilling (with --start-date and --end-date)')
+            submission_dates = [None]
+            bulk_create = True
+
+        combinations = list(self.get_combinations(
+            options['application'], options['platform'], options['channel']))
+        units = [(submission_date, application_name, platform_name, channel_name,
+                  bulk_create, options['overwrite'], options['batch_size'],
+                  options['parquet_path'])
+                 for submission_date in submission_dates
+                 for (application_name, platform_name, channel_name) in combinations]
+
+        checkpoint = options['checkpoint']
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                completed = set(line.strip() for line in f)
+            num_units = len(units)
+            units = [unit for unit in units if _get_unit_name(unit) not in completed]
+            self.stdout.write('Skipping {} of {} units already completed '
+                              'according to {}'.format(num_units - len(units),
+                                                       num_units, checkpoint))
+
+        errors = []
+        checkpoint_file = open(checkpoint, 'a') if checkpoint else None
+        try:
+            for (i, (unit, error)) in enumerate(self.run_units(units,
+                                                               options['workers'])):
+                unit_name = _get_unit_name(unit)
+                if error:
+                    errors.append((unit_name, error))
+                elif checkpoint_file:
+                    checkpoint_file.write(unit_name + '\n')
+                    checkpoint_file.flush()
+                self.stdout.write('[{}/{}] {}: {}'.format(
+                    i + 1, len(units), unit_name, 'failed' if error else 'done'))
+        finally:
+            if checkpoint_file:
+                checkpoint_file.close()
+
+        if errors:
+            for (unit_name, error) in errors:
+                self.stderr.write('Error updating {}:\n{}'.format(unit_name, error))
+            raise CommandError('{} of {} units failed: {}'.format(
+                len(errors), len(units),
+                ', '.join([unit_name for (unit_name, _) in errors])))
@@ -0,0 +1,42 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from missioncontrol.base.models import (Channel,
+                                        Measure,
+                                        Platform)
+from missioncontrol.etl.summarybuckets import update_summary_buckets
+from missioncontrol.settings import DATA_EXPIRY_INTERVAL
+
+
+class Command(BaseCommand):
+    """
+    Management command to (re)calculate measure summary buckets from existing
+    data, e.g. before turning on MEASURE_SUMMARY_INCREMENTAL
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--platform', dest='platform', type=str,
+                            help='only update buckets for specified platform')
+        parser.add_argument('--channel', dest='channel', type=str,
+                            help='only update buckets for specified channel')
+
+    def handle(self, *args, **options):
+        channels = (Channel.objects.all() if not options['channel'] else
+                    Channel.objects.filter(name=options['channel']))
+        platforms = (Platform.objects.all() if not options['platform'] else
+                     Platform.objects.filter(name=options['platform']))
+        now = timezone.now()
+        for channel in channels:
+            for platform in platforms:
+                measures = Measure.objects.filter(channels=channel, platform=platform)
+                if not measures.exists():
+                    continue
+                # one day at a time, to keep memory use in check
+                day = now - DATA_EXPIRY_INTERVAL
+                while day <= now:
+                    update_summary_buckets(platform, channel, measures, day, day)
+                    day += datetime.timedelta(days=1)
+                self.stdout.write('Updated summary buckets for {} {}'.format(
+                    channel.name, platform.name))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from missioncontrol.base.cache import set_many_with_soft_expiry
+from missioncontrol.base.models import MeasureSummary
+from missioncontrol.etl.measuresummary import get_stored_measure_summaries
+from missioncontrol.settings import (MEASURE_SUMMARY_CACHE_EXPIRY,
+                                     MEASURE_SUMMARY_CACHE_HARD_EXPIRY)
+
+
+class Command(BaseCommand):
+    """
+    Management command to load all stored measure summaries into the cache,
+    e.g. on deploy or after the cache has been flushed
+    """
+
+    def handle(self, *args, **options):
+        measure_summary_map = get_stored_measure_summaries(MeasureSummary.objects.all())
+        if measure_summary_map:
+            set_many_with_soft_expiry(measure_summary_map, MEASURE_SUMMARY_CACHE_EXPIRY,
+                                      MEASURE_SUMMARY_CACHE_HARD_EXPIRY)
+        self.stdout.write('Loaded {} measure summaries into the cache'.format(
+            len(measure_summary_map)))
@@ -5,31 +5,263 @@ from pkg_resources import parse_version
 
 import newrelic.agent
 from django.db import transaction
-from django.db.models import Max
-from django.db.utils import IntegrityError
 
 from . import bigquery
 from missioncontrol.celery import celery
 from missioncontrol.base.models import (Application,
                                         Build,
                                         Channel,
-                                        Datum,
                                         Measure,
                                         Platform)
-from missioncontrol.settings import MISSION_CONTROL_TABLE
-from .measuresummary import update_measure_summary
+from missioncontrol.settings import (DATUM_BATCH_SIZE,
+                                     MEASURE_SUMMARY_INCREMENTAL,
+                                     MISSION_CONTROL_TABLE)
+from .loader import (load_datums, upsert_datums)
+from .parquet import read_measure_rows
+from .measuresummary import schedule_measure_summary_update
+from .rollups import update_datum_rollups
+from .summarybuckets import (add_to_summary_buckets,
+                             update_summary_buckets)
 from .versions import get_major_version
+from .watermarks import (advance_watermark,
+                         get_watermark,
+                         set_series_modified)
 
 
 logger = logging.getLogger(__name__)
 
 
+class NoValidVersionsError(Exception):
+    '''
+    Raised when there are no builds we know about (and thus no versions to
+    fetch data for) for an application/platform/channel combination
+    '''
+    pass
+
+
+def _get_build_index(application, platform, channel, min_build_id,
+                     max_build_id):
+    '''
+    Returns a dictionary mapping (build id, version) to the primary key of
+    every build we know about for a combination in the given build id range
+
+    Anything not in the index is a build not released by us, so looking
+    up builds while processing query results never hits the database.
+    '''
+    return {
+        (build_id, version): build_pk for (build_id, version, build_pk) in
+        Build.objects.filter(
+            application=application,
+            channel=channel,
+            platform=platform,
+            build_id__gte=min_build_id,
+            build_id__lte=max_build_id).values_list('build_id', 'version', 'id')
+    }
+
+
+def _get_datum_rows(rows, measures, build_index):
+    '''
+    Generates datum rows (see loader.DATUM_COLUMNS) from measure query results
+    '''
+    for row in rows:
+        (window_start, build_id, version, usage_hours, client_count) = row[:5]
+        build_pk = build_index.get((build_id, version))
+        if build_pk is None:
+            # build not released by us, skip
+            continue
+        # presto doesn't specify timezone information (but it's really utc)
+        window_start = datetime.datetime.fromtimestamp(
+            window_start.timestamp(), tz=tzutc())
+        for (measure, measure_count) in zip(measures, row[5:]):
+            if measure_count is None:
+                measure_count = 0
+            # skip datapoints with negative measure counts or no usage hours
+            # (in theory negative measures should be rejected at the ping
+            # validation level, but this is not yet the case at the time of this
+            # writing -- https://bugzilla.mozilla.org/show_bug.cgi?id=1447038)
+            if measure_count < 0 or usage_hours <= 0:
+                continue
+            yield (build_pk, None, measure.id, window_start, measure_count,
+                   usage_hours, client_count)
+
+
+def _get_latest_submission_date():
+    now = datetime.datetime.utcnow()
+    return datetime.datetime(year=now.year, month=now.month, day=now.day,
+                             tzinfo=tzutc())
+
+
+class _MeasureUpdate:
+    '''
+    Loads measure data for a single application/platform/channel combination
+
+    Query results for the combination are passed to add_rows() (possibly
+    over several calls), which writes them to the database in batches. Once
+    all results are in, finish() updates the rollups and measure summaries.
+    '''
+
+    def __init__(self, application, platform, channel, submission_date,
+                 latest=False, bulk_create=True, overwrite=False,
+                 batch_size=DATUM_BATCH_SIZE):
+        (self.application, self.platform, self.channel) = (application,
+                                                           platform, channel)
+        self.submission_date = submission_date
+        (self.bulk_create, self.overwrite, self.batch_size) = (bulk_create,
+                                                               overwrite,
+                                                               batch_size)
+        self.measures = list(Measure.objects.filter(channels=channel,
+                                                    application=application,
+                                                    platform=platform,
+                                                    enabled=True))
+        self.min_timestamp = submission_date
+        if latest:
+            # resume from the most recent data we have for today (if any)
+            watermark = get_watermark(application=application,
+                                      platform=platform, channel=channel)
+            if watermark and watermark > submission_date:
+                self.min_timestamp = watermark
+
+        # ignore any buildids older than twice the update interval
+        min_buildid_timestamp = submission_date - (channel.update_interval * 2)
+        # ignore any buildids in the future of the submission date
+        max_buildid_timestamp = submission_date + datetime.timedelta(days=1)
+        (self.min_build_id, self.max_build_id) = (
+            min_buildid_timestamp.strftime('%Y%m%d'),
+            max_buildid_timestamp.strftime('%Y%m%d'))
+
+        self.build_index = _get_build_index(application, platform, channel,
+                                            self.min_build_id, self.max_build_id)
+
+        # also place a restriction on version (to avoid fetching data
+        # for bogus versions)
+        valid_versions = sorted(set([version for (_, version) in self.build_index.keys()]),
+                                key=parse_version)
+        if not valid_versions:
+            raise NoValidVersionsError('No valid versions found for combination: {}'.format(
+                '/'.join((application.name, channel.name, platform.name))))
+        (self.min_version, self.max_version) = (
+            get_major_version(valid_versions[0]),
+            get_major_version(valid_versions[-1]) + 1)
+
+        self.pending_datum_rows = []
+        (self.num_datums, self.min_datum_timestamp, self.max_datum_timestamp) = (
+            0, None, None)
+
+    def add_rows(self, rows, measure_names=None):
+        '''
+        Adds query result rows of the form (window_start, build_id, version,
+        usage_hours, client_count, <measure counts...>), ordered by
+        window_start
+
+        measure_names gives the measure each count column belongs to, if
+        different from this combination's measures (columns for measures not
+        enabled for this combination are ignored).
+        '''
+        measures = self.measures
+        if measure_names is not None:
+            measure_columns = {name: i for (i, name) in enumerate(measure_names)}
+            measures = [measure for measure in self.measures
+                        if measure.name in measure_columns]
+            rows = (row[:5] + tuple(row[5 + measure_columns[measure.name]]
+                                    for measure in measures) for row in rows)
+        for datum_row in _get_datum_rows(rows, measures, self.build_index):
+            # the query may cover windows we already have (if it was shared
+            # with combinations which are further behind)
+            if datum_row[3] <= self.min_timestamp:
+                continue
+            # batches only ever end between windows, so every window up to
+            # the watermark is fully loaded once a batch is committed (and
+            # if loading a later batch fails, the next run resumes from it)
+            if len(self.pending_datum_rows) >= self.batch_size and \
+                    datum_row[3] != self.pending_datum_rows[-1][3]:
+                self._flush()
+            self.pending_datum_rows.append(datum_row)
+
+    def _flush(self):
+        datum_rows = self.pending_datum_rows
+        if not datum_rows:
+            return
+        timestamps = [datum_row[3] for datum_row in datum_rows]
+        with transaction.atomic():
+            if self.bulk_create:
+                load_datums(datum_rows)
+                if MEASURE_SUMMARY_INCREMENTAL:
+                    add_to_summary_buckets(datum_rows)
+            else:
+                upsert_datums(datum_rows, overwrite=self.overwrite,
+                              batch_size=self.batch_size)
+            advance_watermark(max(timestamps), application=self.application,
+                              platform=self.platform, channel=self.channel)
+        self.num_datums += len(datum_rows)
+        timestamps += [
+            t for t in (self.min_datum_timestamp, self.max_datum_timestamp) if t]
+        (self.min_datum_timestamp, self.max_datum_timestamp) = (min(timestamps),
+                                                                max(timestamps))
+        self.pending_datum_rows = []
+
+    def finish(self):
+        self._flush()
+        logger.info('Loaded %s datums for %s %s', self.num_datums,
+                    self.channel.name, self.platform.name)
+        if self.num_datums:
+            update_datum_rollups(self.platform, self.channel, self.measures,
+                                 self.min_datum_timestamp, self.max_datum_timestamp)
+            if MEASURE_SUMMARY_INCREMENTAL and not self.bulk_create:
+                # upserted datums may have replaced ones already counted in
+                # the buckets, so recalculate the days they're on
+                update_summary_buckets(self.platform, self.channel, self.measures,
+                                       self.min_datum_timestamp,
+                                       self.max_datum_timestamp)
+        # only let the caches know about the new data once it's committed
+        # (if we're running in a transaction, e.g. when benchmarking)
+        transaction.on_commit(self._notify)
+        return self.num_datums
+
+    def _notify(self):
+        if self.num_datums:
+            set_series_modified(self.platform.name, self.channel.name)
+
+        # update the measure summary in our cache (unless that's already
+        # scheduled to happen)
+        num_skipped = 0
+        for measure in self.measures:
+            if not schedule_measure_summary_update(
+                    self.application.name, self.platform.name,
+                    self.channel.name, measure.name):
+                num_skipped += 1
+        logger.info('Scheduled %s measure summary updates for %s %s (%s already pending)',
+                    len(self.measures) - num_skipped, self.channel.name,
+                    self.platform.name, num_skipped)
+        newrelic.agent.add_custom_parameter("skipped_summary_updates", num_skipped)
+
+
+def _run_query(query_sql, batch_size, client=None):
+    logger.info('Querying: %s', query_sql)
+
+    if client is None:
+        client = bigquery.get_bigquery_client()
+    query_job = client.query(query=query_sql)
+
+    # the query results are fetched page by page, and the datums loaded from
+    # them a batch at a time, so memory use stays bounded no matter how much
+    # data there is
+    return query_job.result(page_size=batch_size)
+
+
 @celery.task
 def update_measures(application_name, platform_name, channel_name,
-                    submission_date=None, bulk_create=True):
+                    submission_date=None, bulk_create=True, overwrite=False,
+                    batch_size=DATUM_BATCH_SIZE, parquet_path=None, client=None):
     '''
     Updates (or creates) a local cache entry for a specify platform/channel/measure
     aggregate, which can later be retrieved by the API
+
+    If bulk_create is false (e.g. when backfilling), existing data is skipped
+    or, if overwrite is specified, replaced. If parquet_path is specified,
+    data is read from the parquet file(s) there instead of BigQuery (client,
+    if specified, is used in place of the default BigQuery client).
+
+    Returns the number of datums loaded.
     '''
     logger.info('Updating measures: %s %s (date: %s)', channel_name, platform_name,
                 submission_date or 'latest')
@@ -38,66 +270,30 @@ def update_measures(application_name, platform_name, channel_name,
     newrelic.agent.add_custom_parameter("platform", platform_name)
     newrelic.agent.add_custom_parameter("channel", channel_name)
 
-    application = Application.objects.get(name=application_name)
-    platform = Platform.objects.get(name=platform_name)
-    channel = Channel.objects.get(name=channel_name)
-    measures = Measure.objects.filter(channels=channel,
-                                      application=application,
-                                      platform=platform,
-                                      enabled=True)
-    if submission_date is None:
-        now = datetime.datetime.utcnow()
-        submission_date = datetime.datetime(year=now.year, month=now.month,
-                                            day=now.day, tzinfo=tzutc())
-        min_timestamp = Datum.objects.filter(
-            timestamp__gte=submission_date,
-            build__channel=channel,
-            measure__in=measures).aggregate(Max('timestamp'))['timestamp__max']
-    else:
-        min_timestamp = None
-
-    if not min_timestamp:
-        min_timestamp = submission_date
-
-    # ignore any buildids older than twice the update interval
-    min_buildid_timestamp = submission_date - (channel.update_interval * 2)
-    # ignore any buildids in the future of the submission date
-    max_buildid_timestamp = submission_date + datetime.timedelta(days=1)
-
-    # also place a restriction on version (to avoid fetching data
-    # for bogus versions)
-    valid_versions = sorted(
-        list(
-            Build.objects.filter(
-                application=application,
-                channel=channel,
-                platform=platform,
-                build_id__gte=min_buildid_timestamp.strftime('%Y%m%d'),
-                build_id__lte=max_buildid_timestamp.strftime('%Y%m%d')).values_list(
-                    'version', flat=True)
-        ), key=parse_version)
-    if not valid_versions:
-        raise Exception('No valid versions found for combination: {}'.format(
-            '/'.join(('application', 'channel', 'platform'))))
-    (min_version, max_version) = (get_major_version(valid_versions[0]),
-                                  get_major_version(valid_versions[-1]) + 1)
+    update = _MeasureUpdate(
+        Application.objects.get(name=application_name),
+        Platform.objects.get(name=platform_name),
+        Channel.objects.get(name=channel_name),
+        submission_date or _get_latest_submission_date(),
+        latest=(submission_date is None), bulk_create=bulk_create,
+        overwrite=overwrite, batch_size=batch_size)
 
     # we prefer to specify parameters in a seperate params dictionary
     # where possible (to reduce the risk of creating a malformed
     # query from incorrect parameters
     measure_sums = ', '.join([
-        'sum({})'.format(measure.name) for measure in measures])
+        'sum({})'.format(measure.name) for measure in update.measures])
 
     params = {
-        'application_name': application.telemetry_name,
-        'min_version': str(min_version),
-        'max_version': str(max_version),
-        'min_build_id': min_buildid_timestamp.strftime('%Y%m%d'),
-        'max_build_id': max_buildid_timestamp.strftime('%Y%m%d'),
-        'os_name': platform.telemetry_name,
+        'application_name': update.application.telemetry_name,
+        'min_version': str(update.min_version),
+        'max_version': str(update.max_version),
+        'min_build_id': update.min_build_id,
+        'max_build_id': update.max_build_id,
+        'os_name': update.platform.telemetry_name,
         'channel_name': channel_name,
-        'min_timestamp': min_timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-        'submission_date': submission_date.strftime("%Y-%m-%d")
+        'min_timestamp': update.min_timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        'submission_date': update.submission_date.strftime("%Y-%m-%d")
     }
 
     query_sql = ' '.join(f'''
@@ -111,7 +307,7 @@ def update_measures(application_name, platform_name, channel_name,
     FROM
         {MISSION_CONTROL_TABLE}
     WHERE
-        submission_date = \'{submission_date.strftime('%Y-%m-%d')}\'
+        submission_date = \'{params['submission_date']}\'
         AND application = \'{params['application_name']}\'
         AND mozfun.norm.truncate_version(display_version, \'major\') > {params['min_version']}
         AND mozfun.norm.truncate_version(display_version, \'major\') < {params['max_version']}
@@ -126,59 +322,137 @@ def update_measures(application_name, platform_name, channel_name,
         display_version
     HAVING
         summed_usage_hours > 0
+    ORDER BY
+        window_start
     '''.split())
 
-    logger.info('Querying: %s', query_sql)
+    if parquet_path:
+        rows = read_measure_rows(
+            parquet_path, params['application_name'], params['os_name'],
+            channel_name, update.submission_date, update.min_timestamp,
+            update.min_build_id, update.max_build_id,
+            [measure.name for measure in update.measures], batch_size=batch_size)
+    else:
+        rows = _run_query(query_sql, batch_size, client=client)
+    update.add_rows(rows)
+    return update.finish()
 
-    client = bigquery.get_bigquery_client()
-    query_job = client.query(query=query_sql)
 
-    # bulk create any new datum objects from the returned results
-    build_cache = {}
-    datum_objs = []
-    for row in query_job:
-        (window_start, build_id, version, usage_hours, client_count) = row[:5]
-        for (measure, measure_count) in zip(measures, row[5:]):
-            if measure_count is None:
-                measure_count = 0
-            # skip datapoints with negative measure counts or no usage hours
-            # (in theory negative measures should be rejected at the ping
-            # validation level, but this is not yet the case at the time of this
-            # writing -- https://bugzilla.mozilla.org/show_bug.cgi?id=1447038)
-            if measure_count < 0 or usage_hours <= 0:
-                continue
-            build = build_cache.get((build_id, version))
-            if not build:
-                try:
-                    build = Build.objects.get(
-                        platform=platform, channel=channel, build_id=build_id,
-                        version=version)
-                    build_cache[(build_id, version)] = build
-                except Build.DoesNotExist:
-                    # build not released by us, skip
-                    continue
-            # presto doesn't specify timezone information (but it's really utc)
-            window_start = datetime.datetime.fromtimestamp(
-                window_start.timestamp(), tz=tzutc())
-            datum_objs.append(Datum(
-                build=build,
-                measure=measure,
-                timestamp=window_start,
-                value=measure_count,
-                usage_hours=usage_hours,
-                client_count=client_count))
-    if bulk_create:
-        Datum.objects.bulk_create(datum_objs)
-    else:
-        for datum_obj in datum_objs:
-            try:
-                with transaction.atomic():
-                    datum_obj.save()
-            except IntegrityError:
-                continue
+def _get_combinations():
+    for channel in Channel.objects.all():
+        for platform in Platform.objects.all():
+            for application in Application.objects.all():
+                if Measure.objects.filter(
+                        channels=channel, platform=platform,
+                        application=application).exists():
+                    yield (application, platform, channel)
+
+
+def _quote_list(values):
+    return ', '.join(["\'{}\'".format(value) for value in sorted(set(values))])
+
+
+@celery.task
+def update_all_measures(submission_date=None, bulk_create=True, overwrite=False,
+                        batch_size=DATUM_BATCH_SIZE, client=None):
+    '''
+    Updates measures for every application/platform/channel combination
+
+    Unlike scheduling update_measures for each combination, this fetches the
+    data for all of them with a single query (and thus a single scan of the
+    underlying table), splitting the results up locally. client, if
+    specified, is used in place of the default BigQuery client.
+    '''
+    logger.info('Updating all measures (date: %s)', submission_date or 'latest')
+
+    latest = submission_date is None
+    if latest:
+        submission_date = _get_latest_submission_date()
+
+    updates = {}
+    for (application, platform, channel) in _get_combinations():
+        try:
+            update = _MeasureUpdate(
+                application, platform, channel, submission_date,
+                latest=latest, bulk_create=bulk_create,
+                overwrite=overwrite, batch_size=batch_size)
+        except NoValidVersionsError as e:
+            # don't let one combination hold back all the others
+            logger.warning('Not updating measures for %s %s %s: %s',
+                           application.name, platform.name, channel.name, e)
+            continue
+        updates[(application.telemetry_name, platform.telemetry_name,
+                 channel.name)] = update
+    if not updates:
+        return
+
+    measure_names = sorted(set(measure.name for update in updates.values()
+                               for measure in update.measures))
+    measure_sums = ', '.join([
+        'sum({})'.format(measure_name) for measure_name in measure_names])
+    # the query covers the union of what every combination needs, whatever
+    # a combination doesn't need is filtered out as the results are split up
+    params = {
+        'application_names': _quote_list([key[0] for key in updates.keys()]),
+        'os_names': _quote_list([key[1] for key in updates.keys()]),
+        'channel_names': _quote_list([key[2] for key in updates.keys()]),
+        'min_version': str(min(u.min_version for u in updates.values())),
+        'max_version': str(max(u.max_version for u in updates.values())),
+        'min_build_id': min(u.min_build_id for u in updates.values()),
+        'max_build_id': max(u.max_build_id for u in updates.values()),
+        'min_timestamp': min(u.min_timestamp for u in updates.values()).strftime(
+            "%Y-%m-%d %H:%M:%S"),
+        'submission_date': submission_date.strftime("%Y-%m-%d")
+    }
+
+    query_sql = ' '.join(f'''
+    SELECT
+        application,
+        os_name,
+        channel,
+        window_start,
+        build_id,
+        display_version,
+        SUM(usage_hours) summed_usage_hours,
+        SUM(count),
+        {measure_sums}
+    FROM
+        {MISSION_CONTROL_TABLE}
+    WHERE
+        submission_date = \'{params['submission_date']}\'
+        AND application IN ({params['application_names']})
+        AND mozfun.norm.truncate_version(display_version, \'major\') > {params['min_version']}
+        AND mozfun.norm.truncate_version(display_version, \'major\') < {params['max_version']}
+        AND build_id > \'{params['min_build_id']}\'
+        AND build_id < \'{params['max_build_id']}\'
+        AND os_name IN ({params['os_names']})
+        AND channel IN ({params['channel_names']})
+        AND window_start > \'{params['min_timestamp']}\'
+    GROUP BY
+        application,
+        os_name,
+        channel,
+        window_start,
+        build_id,
+        display_version
+    HAVING
+        summed_usage_hours > 0
+    ORDER BY
+        window_start
+    '''.split())
+
+    # split the results up by combination, handing them over a batch at a time
+    pending_rows = {key: [] for key in updates.keys()}
+    for row in _run_query(query_sql, batch_size, client=client):
+        key = tuple(row[:3])
+        if key not in pending_rows:
+            # a combination we don't track (the IN clauses match a superset)
+            continue
+        pending_rows[key].append(tuple(row[3:]))
+        if len(pending_rows[key]) >= batch_size:
+            updates[key].add_rows(pending_rows[key], measure_names)
+            pending_rows[key] = []
 
-    # update the measure summary in our cache
-    for measure in measures:
-        update_measure_summary.apply_async(
-            args=[application_name, platform_name, channel_name,
-                  measure.name])
+    for (key, update) in updates.items():
+        update.add_rows(pending_rows[key], measure_names)
+        update.finish()
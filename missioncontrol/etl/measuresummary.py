@@ -1,21 +1,42 @@
 import datetime
+import itertools
+import json
+import logging
 import math
 
 import newrelic.agent
+import numpy
 from django.core.cache import cache
+from django.db import connection
 from django.db.models import (Max, Min)
+from django.utils import timezone
 from pkg_resources import parse_version
 
+from missioncontrol.base.cache import (get_many_with_soft_expiry,
+                                       set_many_with_soft_expiry,
+                                       set_with_soft_expiry)
 from missioncontrol.base.models import (Build,
+                                        Channel,
                                         Datum,
-                                        Measure)
+                                        Measure,
+                                        MeasureSummary,
+                                        MeasureSummaryBucket)
 from missioncontrol.celery import celery
 from missioncontrol.settings import (MEASURE_SUMMARY_CACHE_EXPIRY,
+                                     MEASURE_SUMMARY_CACHE_HARD_EXPIRY,
+                                     MEASURE_SUMMARY_INCREMENTAL,
+                                     MEASURE_SUMMARY_PENDING_EXPIRY,
+                                     MEASURE_SUMMARY_UPDATE_DELAY,
                                      MEASURE_SUMMARY_VERSION_INTERVAL)
+from .summarybuckets import (TooManyOutliersError,
+                             get_bucket_interval_stats)
 from .versions import (get_current_firefox_version,
                        get_major_version)
 
 
+logger = logging.getLogger(__name__)
+
+
 def get_measure_summary_cache_key(application_name, platform_name,
                                   channel_name, measure_name):
     return ':'.join(
@@ -23,6 +44,101 @@ def get_measure_summary_cache_key(application_name, platform_name,
                              measure_name, 'summary']])
 
 
+# when any measure summary was last (re)calculated
+MEASURE_SUMMARIES_MODIFIED_KEY = 'measure_summaries:modified'
+
+
+def _get_measure_summary_pending_key(application_name, platform_name,
+                                     channel_name, measure_name):
+    return ':'.join([get_measure_summary_cache_key(application_name, platform_name,
+                                                   channel_name, measure_name),
+                     'pending'])
+
+
+def get_stored_measure_summaries(stored_summaries):
+    '''
+    Returns a dictionary of measure summaries (keyed by cache key) for a
+    queryset of MeasureSummary objects
+    '''
+    stored_summaries = stored_summaries.select_related(
+        'measure__application', 'measure__platform', 'channel')
+    return {
+        get_measure_summary_cache_key(stored_summary.measure.application.name,
+                                      stored_summary.measure.platform.name,
+                                      stored_summary.channel.name,
+                                      stored_summary.measure.name): {
+            'versions': json.loads(stored_summary.versions),
+            'lastUpdated': stored_summary.last_updated
+        } for stored_summary in stored_summaries
+    }
+
+
+def get_measure_summaries(measure_keys):
+    '''
+    Returns a dictionary of measure key -> summary for a set of measure keys
+    (application name, platform name, channel name, measure name tuples)
+
+    Summaries are read from the cache all at once, those missing from it are
+    read from the database (and put back in the cache). Stale summaries are
+    still returned, with a recalculation of them scheduled.
+    '''
+    measure_key_map = {
+        get_measure_summary_cache_key(*measure_key): measure_key
+        for measure_key in measure_keys
+    }
+    measure_summary_map = get_many_with_soft_expiry(
+        measure_key_map.keys(), lambda cache_key: schedule_measure_summary_update(
+            *measure_key_map[cache_key]))
+    missing_measure_keys = [
+        measure_key for (cache_key, measure_key) in measure_key_map.items()
+        if cache_key not in measure_summary_map]
+    if missing_measure_keys:
+        # fetch all the combinations of what's missing in one go, then
+        # discard what we didn't ask for
+        (application_names, platform_names, channel_names, measure_names) = [
+            set(names) for names in zip(*missing_measure_keys)]
+        stored_summary_map = {
+            cache_key: measure_summary for (cache_key, measure_summary) in
+            get_stored_measure_summaries(MeasureSummary.objects.filter(
+                measure__application__name__in=application_names,
+                measure__platform__name__in=platform_names,
+                measure__name__in=measure_names,
+                channel__name__in=channel_names)).items()
+            if cache_key in measure_key_map and cache_key not in measure_summary_map
+        }
+        if stored_summary_map:
+            set_many_with_soft_expiry(stored_summary_map, MEASURE_SUMMARY_CACHE_EXPIRY,
+                                      MEASURE_SUMMARY_CACHE_HARD_EXPIRY)
+            measure_summary_map.update(stored_summary_map)
+    return {
+        measure_key: measure_summary_map[cache_key]
+        for (cache_key, measure_key) in measure_key_map.items()
+        if cache_key in measure_summary_map
+    }
+
+
+def set_measure_summaries_modified(**kwargs):
+    '''
+    Records that the measure summaries (or which measures are shown with
+    them) just changed
+
+    Also used as a receiver for changes to measures and their channels.
+    '''
+    cache.set(MEASURE_SUMMARIES_MODIFIED_KEY, timezone.now(), None)
+
+
+def get_measure_summaries_last_modified():
+    '''
+    Returns when any measure summary was last (re)calculated (as far as the
+    cache knows, otherwise we assume just now)
+    '''
+    last_modified = cache.get(MEASURE_SUMMARIES_MODIFIED_KEY)
+    if last_modified is None:
+        last_modified = timezone.now()
+        cache.add(MEASURE_SUMMARIES_MODIFIED_KEY, last_modified, None)
+    return last_modified
+
+
 # returns a list of (rate, value, usage_hours) tuples in the interval for that
 # version
 def _get_data_interval_for_version(builds, measure, version, start, end):
@@ -38,6 +154,151 @@ def _get_data_interval_for_version(builds, measure, version, start, end):
                    (value, usage_hours) in value_usage_hours])
 
 
+def _get_python_interval_stats(builds, measure, intervals):
+    interval_stats = []
+    for (version, start, end) in intervals:
+        values = _get_data_interval_for_version(builds, measure, version, start, end)
+        if not values:
+            interval_stats.append(None)
+            continue
+        raw_count = int(sum([v[1] for v in values]))
+
+        # to prevent outliers from impacting our rate calculation, we'll use
+        # the 99.9th percentile of captured values for calculating the rate
+        end = math.ceil(len(values) * 0.999)
+        rate_values = values[:end]
+        interval_stats.append((raw_count, round(
+            sum([v[1] for v in rate_values]) /
+            sum([v[2]/1000.0 for v in rate_values]), 2)))
+    return interval_stats
+
+
+def _get_sorted_indices(indices, rates, values, usage_hours):
+    # orders indices of datums by (rate, value, usage_hours), like the tuples
+    # in the python version
+    return indices[numpy.lexsort((usage_hours[indices], values[indices],
+                                  rates[indices]))]
+
+
+def _get_numpy_interval_stats(builds, measure, intervals):
+    # same as the python version, but with array operations: the datums to
+    # keep are found with a partial sort, and as the order floats are added
+    # up in affects the result, the sums are taken in the same order as in
+    # python (i.e. one at a time, by rate)
+    interval_stats = []
+    for (version, start, end) in intervals:
+        value_usage_hours = Datum.objects.filter(
+            build__in=builds.filter(version__startswith=version),
+            measure=measure,
+            timestamp__range=(start, end)).values_list('value', 'usage_hours')
+        data = numpy.fromiter(itertools.chain.from_iterable(value_usage_hours),
+                              dtype=float)
+        if not len(data):
+            interval_stats.append(None)
+            continue
+        (values, usage_hours) = (data[0::2], data[1::2])
+        rates = values / (usage_hours / 1000.0)
+
+        # to prevent outliers from impacting our rate calculation, we'll use
+        # the 99.9th percentile of captured values for calculating the rate.
+        # datums tied at the cutoff rate are kept by value and usage hours
+        num_kept = math.ceil(len(values) * 0.999)
+        cutoff = rates[numpy.argpartition(rates, num_kept - 1)[num_kept - 1]]
+        tied = _get_sorted_indices(numpy.flatnonzero(rates == cutoff), rates,
+                                   values, usage_hours)
+        below = numpy.flatnonzero(rates < cutoff)
+        kept = numpy.concatenate([below, tied[:num_kept - len(below)]])
+        excluded = numpy.concatenate([tied[num_kept - len(below):],
+                                      numpy.flatnonzero(rates > cutoff)])
+        order = numpy.concatenate([
+            _get_sorted_indices(kept, rates, values, usage_hours),
+            _get_sorted_indices(excluded, rates, values, usage_hours)])
+
+        # (cumsum adds up one element at a time, unlike sum)
+        value_sums = numpy.cumsum(values[order])
+        usage_hours_sums = numpy.cumsum(usage_hours[order] / 1000.0)
+        interval_stats.append((int(value_sums[-1]), round(float(
+            value_sums[num_kept - 1] / usage_hours_sums[num_kept - 1]), 2)))
+    return interval_stats
+
+
+def _get_sql_interval_stats(builds, measure, intervals):
+    # same as the python version, but for all intervals at once (with a
+    # single pass over the data): each datum is ranked by rate within its
+    # interval, so we can sum up the 99.9th percentile of values. the sums
+    # are taken in the same order as in python, so the results are identical
+    values_sql = ', '.join(['(%s, %s, %s::timestamptz, %s::timestamptz)'] *
+                           len(intervals))
+    with connection.cursor() as cursor:
+        cursor.execute(f'''
+            WITH intervals (idx, version_prefix, start_ts, end_ts) AS (
+                VALUES {values_sql}
+            ), ranked AS (
+                SELECT intervals.idx, datum.value, datum.usage_hours,
+                       datum.value / (datum.usage_hours / 1000.0) AS rate,
+                       row_number() OVER (
+                           PARTITION BY intervals.idx
+                           ORDER BY datum.value / (datum.usage_hours / 1000.0),
+                                    datum.value, datum.usage_hours) AS rank,
+                       count(*) OVER (PARTITION BY intervals.idx) AS num_values
+                FROM intervals
+                JOIN build ON left(build.version,
+                                   length(intervals.version_prefix)) =
+                              intervals.version_prefix
+                JOIN datum ON datum.build_id = build.id
+                WHERE build.id = ANY(%s) AND datum.measure_id = %s AND
+                      datum.timestamp BETWEEN intervals.start_ts AND intervals.end_ts
+            )
+            SELECT idx,
+                   sum(value ORDER BY rate, value, usage_hours),
+                   sum(value ORDER BY rate, value, usage_hours)
+                       FILTER (WHERE rank <= ceil(num_values * 0.999::float8)),
+                   sum(usage_hours / 1000.0 ORDER BY rate, value, usage_hours)
+                       FILTER (WHERE rank <= ceil(num_values * 0.999::float8))
+            FROM ranked
+            GROUP BY idx''', [param for (i, interval) in enumerate(intervals)
+                              for param in (i,) + tuple(interval)] + [
+                                  list(builds.values_list('id', flat=True)),
+                                  measure.id])
+        interval_stats = [None] * len(intervals)
+        for (i, value_sum, rate_value_sum, rate_usage_hours_sum) in cursor.fetchall():
+            interval_stats[i] = (int(value_sum),
+                                 round(rate_value_sum / rate_usage_hours_sum, 2))
+    return interval_stats
+
+
+def _get_interval_stats(builds, measure, intervals):
+    '''
+    Returns a (count, rate) tuple for the datums of each (version, start, end)
+    interval in intervals (or None if there are no datums in an interval)
+    '''
+    if MEASURE_SUMMARY_INCREMENTAL:
+        interval_stats = []
+        fallback_indices = []
+        for (i, interval) in enumerate(intervals):
+            try:
+                interval_stats.append(get_bucket_interval_stats(builds, measure, interval))
+            except TooManyOutliersError:
+                # fall back to looking at the datums for any intervals the
+                # buckets can't tell us about
+                interval_stats.append(None)
+                fallback_indices.append(i)
+        fallback_stats = _get_datum_interval_stats(
+            builds, measure, [intervals[i] for i in fallback_indices])
+        for (i, stats) in zip(fallback_indices, fallback_stats):
+            interval_stats[i] = stats
+        return interval_stats
+    return _get_datum_interval_stats(builds, measure, intervals)
+
+
+def _get_datum_interval_stats(builds, measure, intervals):
+    if not intervals:
+        return []
+    if connection.vendor == 'postgresql':
+        return _get_sql_interval_stats(builds, measure, intervals)
+    return _get_numpy_interval_stats(builds, measure, intervals)
+
+
 def get_measure_summary(application_name, platform_name, channel_name, measure_name):
     '''
     Returns a data structure summarizing the "current" status of a measure
@@ -66,10 +327,18 @@ def get_measure_summary(application_name, platform_name, channel_name, measure_n
     datums = Datum.objects.filter(build__in=builds,
                                   measure=measure)
 
-    raw_version_data = sorted(
-        datums.values_list('build__version').distinct().annotate(
-            Min('timestamp'), Max('timestamp')
-        ), key=lambda d: parse_version(d[0]))
+    if MEASURE_SUMMARY_INCREMENTAL:
+        buckets = MeasureSummaryBucket.objects.filter(build__in=builds,
+                                                      measure=measure)
+        raw_version_data = sorted(
+            buckets.values_list('build__version').distinct().annotate(
+                Min('min_timestamp'), Max('max_timestamp')
+            ), key=lambda d: parse_version(d[0]))
+    else:
+        raw_version_data = sorted(
+            datums.values_list('build__version').distinct().annotate(
+                Min('timestamp'), Max('timestamp')
+            ), key=lambda d: parse_version(d[0]))
     if not raw_version_data:
         return None
 
@@ -124,31 +393,16 @@ def get_measure_summary(application_name, platform_name, channel_name, measure_n
                     'version': version[0],
                     'fieldDuration': int(field_duration.total_seconds())
                 }
-                for (rate_id, count_id, interval) in (
+                # the counts and rates are filled in below, once we have
+                # gathered all the intervals to calculate them for
+                version_intervals = [
+                    (rate_id, count_id, (version[0], version_start,
+                                         version_start + interval))
+                    for (rate_id, count_id, interval) in (
                         ('rate', 'count', field_duration),
                         ('adjustedRate', 'adjustedCount', adjusted_duration)
-                ):
-                    values = _get_data_interval_for_version(builds, measure,
-                                                            version[0],
-                                                            version_start,
-                                                            version_start + interval)
-                    if not values:
-                        # in rare cases (mostly during backfilling) we might not
-                        # have any actual data for the version in question in the
-                        # interval we want
-                        continue
-                    raw_count = int(sum([v[1] for v in values]))
-                    version_summary[count_id] = raw_count
-
-                    # to prevent outliers from impacting our rate calculation, we'll use
-                    # the 99.9th percentile of captured values for calculating the rate
-                    end = math.ceil(len(values) * 0.999)
-                    rate_values = values[:end]
-                    version_summary[rate_id] = round(
-                        sum([v[1] for v in rate_values]) /
-                        sum([v[2]/1000.0 for v in rate_values]), 2)
-
-                version_summaries.append(version_summary)
+                    )]
+                version_summaries.append((version_summary, version_intervals))
 
         return version_summaries
 
@@ -166,18 +420,37 @@ def get_measure_summary(application_name, platform_name, channel_name, measure_n
         version_summaries.extend(_get_version_summaries(recent_point_releases,
                                                         None))
 
+    interval_stats = iter(_get_interval_stats(
+        builds, measure, [interval for (_, version_intervals) in version_summaries
+                          for (_, _, interval) in version_intervals]))
+    for (version_summary, version_intervals) in version_summaries:
+        for (rate_id, count_id, _) in version_intervals:
+            stats = next(interval_stats)
+            if stats is None:
+                # in rare cases (mostly during backfilling) we might not
+                # have any actual data for the version in question in the
+                # interval we want
+                continue
+            (version_summary[count_id], version_summary[rate_id]) = stats
+    version_summaries = [version_summary for (version_summary, _) in version_summaries]
+
     if not version_summaries:
         return None
 
     return {
         "versions": list(reversed(version_summaries)),
-        "lastUpdated": datums.aggregate(Max('timestamp'))['timestamp__max']
+        "lastUpdated": max([max_timestamp for (_, _, max_timestamp) in raw_version_data])
     }
 
 
 @celery.task
 def update_measure_summary(application_name, platform_name, channel_name,
                            measure_name):
+    # clear the pending flag before we start, so updates to the data made
+    # while we're calculating schedule another recalculation
+    cache.delete(_get_measure_summary_pending_key(application_name, platform_name,
+                                                  channel_name, measure_name))
+
     newrelic.agent.add_custom_parameter("application", application_name)
     newrelic.agent.add_custom_parameter("platform", platform_name)
     newrelic.agent.add_custom_parameter("channel", channel_name)
@@ -187,9 +460,39 @@ def update_measure_summary(application_name, platform_name, channel_name,
                                           channel_name, measure_name)
 
     if measure_summary:
-        cache.set(
+        MeasureSummary.objects.update_or_create(
+            measure=Measure.objects.get(name=measure_name,
+                                        application__name=application_name,
+                                        platform__name=platform_name),
+            channel=Channel.objects.get(name=channel_name),
+            defaults={
+                'versions': json.dumps(measure_summary['versions']),
+                'last_updated': measure_summary['lastUpdated']
+            })
+        set_with_soft_expiry(
             get_measure_summary_cache_key(application_name, platform_name,
                                           channel_name, measure_name),
             measure_summary,
-            MEASURE_SUMMARY_CACHE_EXPIRY
+            MEASURE_SUMMARY_CACHE_EXPIRY,
+            MEASURE_SUMMARY_CACHE_HARD_EXPIRY
         )
+        set_measure_summaries_modified()
+
+
+def schedule_measure_summary_update(application_name, platform_name,
+                                    channel_name, measure_name):
+    '''
+    Schedules a (slightly delayed) recalculation of a measure summary, unless
+    one is already scheduled
+
+    Returns False if the recalculation was coalesced with an already scheduled
+    one, True otherwise.
+    '''
+    if not cache.add(_get_measure_summary_pending_key(application_name, platform_name,
+                                                      channel_name, measure_name),
+                     True, MEASURE_SUMMARY_PENDING_EXPIRY):
+        return False
+    update_measure_summary.apply_async(
+        args=[application_name, platform_name, channel_name, measure_name],
+        countdown=MEASURE_SUMMARY_UPDATE_DELAY)
+    return True
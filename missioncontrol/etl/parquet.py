@@ -0,0 +1,84 @@
+import datetime
+
+import pyarrow
+import pyarrow.dataset
+import pytz
+
+from missioncontrol.settings import DATUM_BATCH_SIZE
+
+
+def _get_scalar(schema, column, value):
+    column_type = schema.field(column).type
+    if pyarrow.types.is_timestamp(column_type):
+        value = value.astimezone(pytz.UTC).replace(tzinfo=None)
+    elif pyarrow.types.is_string(column_type):
+        value = value.strftime('%Y-%m-%d')
+    elif pyarrow.types.is_date(column_type):
+        value = value.date()
+    return pyarrow.scalar(value, type=column_type)
+
+
+def read_measure_rows(path, application_name, os_name, channel_name,
+                      submission_date, min_timestamp, min_build_id,
+                      max_build_id, measure_names, batch_size=DATUM_BATCH_SIZE):
+    '''
+    Reads measure aggregates from a parquet file (or directory of them) with
+    the same columns as the error aggregates table
+
+    Rows are returned in the same form as the results of the measure query
+    (window_start, build_id, version, usage_hours, client_count, <measure
+    sums...>). Only the columns we need are read, and row groups not matching
+    the given combination and bounds are skipped using their statistics.
+    '''
+    dataset = pyarrow.dataset.dataset(path, format='parquet')
+    schema = dataset.schema
+    field = pyarrow.dataset.field
+
+    # older exports (like the sample in this repository) have "version" in
+    # place of "display_version"
+    version_column = ('display_version' if 'display_version' in schema.names
+                      else 'version')
+    group_columns = ['window_start', 'build_id', version_column]
+    # measures not in the data are treated as having no counts
+    sum_columns = ['usage_hours', 'count'] + [
+        measure_name for measure_name in measure_names if measure_name in schema.names]
+
+    expression = ((field('application') == application_name) &
+                  (field('os_name') == os_name) &
+                  (field('channel') == channel_name) &
+                  (field('build_id') > min_build_id) &
+                  (field('build_id') < max_build_id) &
+                  (field('window_start') > _get_scalar(schema, 'window_start',
+                                                       min_timestamp)))
+    if 'submission_date' in schema.names:
+        expression &= (field('submission_date') ==
+                       _get_scalar(schema, 'submission_date', submission_date))
+    else:
+        # without a submission date, go by the date of the window
+        expression &= (field('window_start') < _get_scalar(
+            schema, 'window_start', submission_date + datetime.timedelta(days=1)))
+
+    # batches may contain parts of the same group, so sum up the sums for
+    # each batch
+    sums = {}
+    for batch in dataset.to_batches(columns=group_columns + sum_columns,
+                                    filter=expression, batch_size=batch_size):
+        grouped = pyarrow.Table.from_batches([batch]).group_by(group_columns).aggregate(
+            [(column, 'sum') for column in sum_columns])
+        for group in grouped.to_pylist():
+            key = tuple(group[column] for column in group_columns)
+            values = [group['{}_sum'.format(column)] or 0 for column in sum_columns]
+            if key in sums:
+                sums[key] = [a + b for (a, b) in zip(sums[key], values)]
+            else:
+                sums[key] = values
+
+    measure_columns = {column: i for (i, column) in enumerate(sum_columns)}
+    for key in sorted(sums.keys()):
+        values = sums[key]
+        # same as "HAVING summed_usage_hours > 0" in the measure query
+        if values[0] <= 0:
+            continue
+        yield key + (values[0], values[1]) + tuple(
+            values[measure_columns[measure_name]] if measure_name in measure_columns
+            else None for measure_name in measure_names)
@@ -3,6 +3,8 @@ from django.core.cache import cache
 from sqlalchemy.engine import create_engine
 from sqlalchemy import select, text, MetaData, Table
 
+from . import replay
+
 
 DIMENSION_LIST = (
     'window_start',
@@ -42,8 +44,18 @@ def get_table():
 
 
 def raw_query(raw_sql, params):
+    if settings.ETL_REPLAY_DIR:
+        return replay.load_result(settings.ETL_REPLAY_DIR, raw_sql, params)
     engine = get_engine()
-    return engine.execute(raw_sql, params).fetchall()
+    rows = engine.execute(raw_sql, params).fetchall()
+    if settings.ETL_RECORD_DIR:
+        replay.save_result(settings.ETL_RECORD_DIR, raw_sql, params, rows)
+    return rows
+
+
+def get_aggregates(measurements, conditions, dimensions):
+    query_builder = QueryBuilder(measurements, conditions, dimensions)
+    return [dict(row) for row in query_builder.execute().fetchall()]
 
 
 class QueryBuilder(object):
@@ -0,0 +1,98 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+
+from dateutil import parser
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError('Cannot serialize {!r}'.format(value))
+
+
+def _decode_value(obj):
+    if '$datetime' in obj:
+        return parser.parse(obj['$datetime'])
+    return obj
+
+
+def get_result_path(directory, query, params=None):
+    '''
+    Returns the path of the file holding the results of a query (with
+    the given parameters) inside a recording directory
+    '''
+    key = hashlib.sha1(json.dumps([query, params], sort_keys=True,
+                                  default=str).encode('utf-8')).hexdigest()
+    return os.path.join(directory, '{}.json.gz'.format(key))
+
+
+def save_result(directory, query, params, rows):
+    os.makedirs(directory, exist_ok=True)
+    with gzip.open(get_result_path(directory, query, params), 'wt') as f:
+        json.dump({'query': query, 'params': params,
+                   'rows': [list(row) for row in rows]}, f,
+                  default=_encode_value)
+
+
+def load_result(directory, query, params=None):
+    path = get_result_path(directory, query, params)
+    if not os.path.exists(path):
+        raise Exception('No recorded result for query (expected in {}): {}'.format(
+            path, query))
+    with gzip.open(path, 'rt') as f:
+        return json.load(f, object_hook=_decode_value)['rows']
+
+
+class _RecordingQueryJob:
+
+    def __init__(self, query_job, directory, query):
+        (self.query_job, self.directory, self.query) = (query_job, directory, query)
+
+    def result(self, page_size=None):
+        rows = []
+        for row in self.query_job.result(page_size=page_size):
+            rows.append(tuple(row))
+            yield row
+        save_result(self.directory, self.query, None, rows)
+
+
+class RecordingBigQueryClient:
+    '''
+    Wraps a bigquery client, saving the results of its queries to a directory
+    (so they can be replayed later with ReplayBigQueryClient)
+    '''
+
+    def __init__(self, client, directory):
+        (self.client, self.directory) = (client, directory)
+
+    def query(self, query):
+        return _RecordingQueryJob(self.client.query(query=query), self.directory,
+                                  query)
+
+
+class ReplayQueryJob:
+    '''
+    A stand-in for a bigquery query job, with the given rows as its results
+    '''
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self, page_size=None):
+        return iter(self.rows)
+
+
+class ReplayBigQueryClient:
+    '''
+    A stand-in for a bigquery client, which answers queries with results
+    previously saved by RecordingBigQueryClient
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def query(self, query):
+        return ReplayQueryJob(load_result(self.directory, query))
@@ -0,0 +1,59 @@
+import datetime
+
+import pytz
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Trunc
+
+from missioncontrol.base.models import (DailyDatum,
+                                        Datum,
+                                        HourlyDatum)
+
+
+ROLLUPS = (
+    ('hour', datetime.timedelta(hours=1), HourlyDatum),
+    ('day', datetime.timedelta(days=1), DailyDatum)
+)
+
+
+def _truncate(timestamp, kind):
+    timestamp = timestamp.astimezone(pytz.UTC).replace(minute=0, second=0,
+                                                       microsecond=0)
+    if kind == 'day':
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def update_datum_rollups(platform, channel, measures, min_timestamp,
+                         max_timestamp):
+    '''
+    Recalculates the hourly and daily rollups for a platform/channel combination
+    covering every datum between min_timestamp and max_timestamp (inclusive)
+
+    Only the rollup periods touched by that interval are recalculated, so the
+    cost is proportional to the amount of new data.
+    '''
+    for (kind, period_duration, rollup_model) in ROLLUPS:
+        period_start = _truncate(min_timestamp, kind)
+        period_end = _truncate(max_timestamp, kind) + period_duration
+        datums = Datum.objects.filter(
+            build__platform=platform, build__channel=channel,
+            measure__in=measures,
+            timestamp__gte=period_start, timestamp__lt=period_end)
+        aggregates = datums.annotate(
+            period=Trunc('timestamp', kind, tzinfo=pytz.UTC)
+        ).values('build_id', 'measure_id', 'period').annotate(
+            summed_value=Sum('value'), summed_usage_hours=Sum('usage_hours')
+        ).values_list('build_id', 'measure_id', 'period', 'summed_value',
+                      'summed_usage_hours')
+        with transaction.atomic():
+            rollup_model.objects.filter(
+                build__platform=platform, build__channel=channel,
+                measure__in=measures,
+                timestamp__gte=period_start, timestamp__lt=period_end).delete()
+            rollup_model.objects.bulk_create([
+                rollup_model(build_id=build_id, measure_id=measure_id,
+                             timestamp=period, value=value,
+                             usage_hours=usage_hours)
+                for (build_id, measure_id, period, value, usage_hours) in aggregates
+            ])
@@ -0,0 +1,194 @@
+import datetime
+import heapq
+import json
+import math
+
+import pytz
+from django.db import transaction
+from django.db.models import Q
+
+from missioncontrol.base.models import (Datum,
+                                        MeasureSummaryBucket)
+from missioncontrol.settings import MEASURE_SUMMARY_BUCKET_TOP_VALUES
+
+
+class TooManyOutliersError(Exception):
+    '''
+    Raised when more outliers need to be excluded from an interval than the
+    summary buckets keep track of
+    '''
+    pass
+
+
+def _get_day(timestamp):
+    return timestamp.astimezone(pytz.UTC).replace(hour=0, minute=0, second=0,
+                                                  microsecond=0)
+
+
+def _get_rate_key(value_usage_hours):
+    # datums are ordered the same way as in measuresummary, i.e. by
+    # (rate, value, usage_hours)
+    (value, usage_hours) = value_usage_hours
+    return (value/(usage_hours/1000.0), value, usage_hours)
+
+
+def _new_bucket(timestamp):
+    return {'min_timestamp': timestamp, 'max_timestamp': timestamp,
+            'count': 0, 'value': 0, 'usage_hours': 0, 'values': []}
+
+
+def _add_to_bucket(bucket, timestamp, value, usage_hours):
+    bucket['min_timestamp'] = min(bucket['min_timestamp'], timestamp)
+    bucket['max_timestamp'] = max(bucket['max_timestamp'], timestamp)
+    bucket['count'] += 1
+    bucket['value'] += value
+    bucket['usage_hours'] += usage_hours
+    bucket['values'].append((value, usage_hours))
+
+
+def _get_top_values(values):
+    return json.dumps(heapq.nlargest(MEASURE_SUMMARY_BUCKET_TOP_VALUES,
+                                     values, key=_get_rate_key))
+
+
+def add_to_summary_buckets(datum_rows):
+    '''
+    Adds newly loaded build datum rows (see loader.DATUM_COLUMNS) to the
+    measure summary buckets for their days
+
+    Only the new datums are read, so the cost doesn't depend on how much data
+    the buckets already cover. The datums must not have been counted already
+    (use update_summary_buckets to recalculate days where datums were
+    replaced).
+    '''
+    buckets = {}
+    for (build_id, _, measure_id, timestamp, value, usage_hours, _) in datum_rows:
+        key = (build_id, measure_id, _get_day(timestamp))
+        if key not in buckets:
+            buckets[key] = _new_bucket(timestamp)
+        _add_to_bucket(buckets[key], timestamp, value, usage_hours)
+    if not buckets:
+        return
+
+    (build_ids, measure_ids, days) = (set(k) for k in zip(*buckets.keys()))
+    with transaction.atomic():
+        existing = MeasureSummaryBucket.objects.select_for_update().filter(
+            build_id__in=build_ids, measure_id__in=measure_ids,
+            timestamp__in=days)
+        updated = []
+        for summary_bucket in existing:
+            bucket = buckets.pop((summary_bucket.build_id, summary_bucket.measure_id,
+                                  summary_bucket.timestamp), None)
+            if bucket is None:
+                continue
+            summary_bucket.min_timestamp = min(summary_bucket.min_timestamp,
+                                               bucket['min_timestamp'])
+            summary_bucket.max_timestamp = max(summary_bucket.max_timestamp,
+                                               bucket['max_timestamp'])
+            summary_bucket.count += bucket['count']
+            summary_bucket.value += bucket['value']
+            summary_bucket.usage_hours += bucket['usage_hours']
+            summary_bucket.top_values = _get_top_values(
+                [tuple(v) for v in json.loads(summary_bucket.top_values)] +
+                bucket['values'])
+            updated.append(summary_bucket)
+        MeasureSummaryBucket.objects.bulk_update(
+            updated, ['min_timestamp', 'max_timestamp', 'count', 'value',
+                      'usage_hours', 'top_values'])
+        MeasureSummaryBucket.objects.bulk_create([
+            MeasureSummaryBucket(
+                build_id=build_id, measure_id=measure_id, timestamp=day,
+                min_timestamp=bucket['min_timestamp'],
+                max_timestamp=bucket['max_timestamp'], count=bucket['count'],
+                value=bucket['value'], usage_hours=bucket['usage_hours'],
+                top_values=_get_top_values(bucket['values']))
+            for ((build_id, measure_id, day), bucket) in buckets.items()
+        ])
+
+
+def update_summary_buckets(platform, channel, measures, min_timestamp,
+                           max_timestamp):
+    '''
+    Recalculates the measure summary buckets for a platform/channel combination
+    for every day between min_timestamp and max_timestamp (inclusive), from
+    all the datums for those days
+    '''
+    (day_start, day_end) = (_get_day(min_timestamp),
+                            _get_day(max_timestamp) + datetime.timedelta(days=1))
+    buckets = {}
+    for (build_id, measure_id, timestamp, value, usage_hours) in Datum.objects.filter(
+            build__platform=platform, build__channel=channel,
+            measure__in=measures,
+            timestamp__gte=day_start, timestamp__lt=day_end).values_list(
+                'build_id', 'measure_id', 'timestamp', 'value', 'usage_hours'):
+        key = (build_id, measure_id, _get_day(timestamp))
+        if key not in buckets:
+            buckets[key] = _new_bucket(timestamp)
+        _add_to_bucket(buckets[key], timestamp, value, usage_hours)
+
+    with transaction.atomic():
+        MeasureSummaryBucket.objects.filter(
+            build__platform=platform, build__channel=channel,
+            measure__in=measures,
+            timestamp__gte=day_start, timestamp__lt=day_end).delete()
+        MeasureSummaryBucket.objects.bulk_create([
+            MeasureSummaryBucket(
+                build_id=build_id, measure_id=measure_id, timestamp=day,
+                min_timestamp=bucket['min_timestamp'],
+                max_timestamp=bucket['max_timestamp'], count=bucket['count'],
+                value=bucket['value'], usage_hours=bucket['usage_hours'],
+                top_values=_get_top_values(bucket['values']))
+            for ((build_id, measure_id, day), bucket) in buckets.items()
+        ])
+
+
+def get_bucket_interval_stats(builds, measure, interval):
+    '''
+    Returns a (count, rate) tuple for the datums in a (version, start, end)
+    interval, calculated from summary buckets (or None if there are no datums)
+
+    Buckets for the days the interval starts and ends on may only partly
+    overlap it, so the datums for those are read directly. If more outliers
+    need to be excluded than the buckets keep track of, TooManyOutliersError
+    is raised (and the caller should look at all the datums instead).
+
+    The same datums are excluded as when calculating from the datums, but as
+    the rate is worked out by subtracting them from the sums, it can differ
+    from the datum-based one by floating point rounding.
+    '''
+    (version, start, end) = interval
+    version_builds = builds.filter(version__startswith=version)
+    (first_day, last_day) = (_get_day(start), _get_day(end))
+
+    (count, value_sum, usage_hours_sum) = (0, 0, 0)
+    candidates = []
+    for (bucket_count, value, usage_hours, top_values) in MeasureSummaryBucket.objects.filter(
+            build__in=version_builds, measure=measure,
+            timestamp__gt=first_day, timestamp__lt=last_day).values_list(
+                'count', 'value', 'usage_hours', 'top_values'):
+        count += bucket_count
+        value_sum += value
+        usage_hours_sum += usage_hours
+        candidates.extend([tuple(v) for v in json.loads(top_values)])
+    for (value, usage_hours) in Datum.objects.filter(
+            Q(timestamp__lt=first_day + datetime.timedelta(days=1)) |
+            Q(timestamp__gte=last_day),
+            build__in=version_builds, measure=measure,
+            timestamp__range=(start, end)).values_list('value', 'usage_hours'):
+        count += 1
+        value_sum += value
+        usage_hours_sum += usage_hours
+        candidates.append((value, usage_hours))
+    if not count:
+        return None
+
+    # to prevent outliers from impacting our rate calculation, we'll use
+    # the 99.9th percentile of captured values for calculating the rate
+    num_excluded = count - math.ceil(count * 0.999)
+    if num_excluded > MEASURE_SUMMARY_BUCKET_TOP_VALUES:
+        raise TooManyOutliersError('{} outliers to exclude, only {} kept per bucket'.format(
+            num_excluded, MEASURE_SUMMARY_BUCKET_TOP_VALUES))
+    excluded = heapq.nlargest(num_excluded, candidates, key=_get_rate_key)
+    return (int(value_sum), round(
+        (value_sum - sum([v[0] for v in excluded])) /
+        ((usage_hours_sum - sum([v[1] for v in excluded])) / 1000.0), 2))
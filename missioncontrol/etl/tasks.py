@@ -1,16 +1,22 @@
 import logging
 import requests
 
+from missioncontrol.base.cache import set_with_soft_expiry
 from missioncontrol.base.models import (Application,
                                         Channel,
                                         Experiment,
                                         Measure,
                                         Platform)
 from missioncontrol.celery import celery
-from missioncontrol.settings import FIREFOX_EXPERIMENTS_URL
-from missioncontrol.etl.measure import update_measures
+from missioncontrol.settings import (AGGREGATES_CACHE_EXPIRY,
+                                     AGGREGATES_CACHE_HARD_EXPIRY,
+                                     FIREFOX_EXPERIMENTS_URL,
+                                     MEASURE_CONSOLIDATED_QUERY)
+from missioncontrol.etl.measure import (update_all_measures,
+                                        update_measures)
 from .builds import update_builds
 from .experiment import update_experiment
+from .presto import get_aggregates
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +27,10 @@ def update_channel_measures():
     Updates channel/platform data
     """
     logger.info('Scheduling data updates...')
+    if MEASURE_CONSOLIDATED_QUERY:
+        # fetch everything at once, with a single query
+        update_all_measures.apply_async()
+        return
     for channel in Channel.objects.all():
         for platform in Platform.objects.all():
             for application in Application.objects.all():
@@ -72,3 +82,12 @@ def update_experiment_list():
     # any experiments not specified in that list should be considered inactive
     Experiment.objects.exclude(name__in=enabled_experiment_slugs).update(
         enabled=False)
+
+
+@celery.task
+def update_aggregates(cache_key, measurements, conditions, dimensions):
+    """
+    Recalculates a set of (cached) aggregates
+    """
+    set_with_soft_expiry(cache_key, get_aggregates(measurements, conditions, dimensions),
+                         AGGREGATES_CACHE_EXPIRY, AGGREGATES_CACHE_HARD_EXPIRY)
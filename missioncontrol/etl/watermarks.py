@@ -0,0 +1,86 @@
+import functools
+import operator
+
+from django.core.cache import cache
+from django.db.models import (Max,
+                              Q)
+from django.utils import timezone
+
+from missioncontrol.base.models import IngestionWatermark
+
+
+def _get_series_modified_key(platform_name, channel_name):
+    return ':'.join([platform_name.lower(), channel_name.lower(), 'modified'])
+
+
+def get_watermark(**series):
+    '''
+    Returns the timestamp of the most recent datum ingested for a series
+    (e.g. application/platform/channel or experiment), or None if we have
+    never ingested anything for it
+    '''
+    return IngestionWatermark.objects.filter(**series).values_list(
+        'timestamp', flat=True).first()
+
+
+def advance_watermark(timestamp, **series):
+    '''
+    Moves the watermark for a series forward to timestamp (if it is not
+    already past it)
+
+    Should be called in the same transaction as the data being ingested.
+    '''
+    (watermark, created) = IngestionWatermark.objects.get_or_create(
+        defaults={'timestamp': timestamp}, **series)
+    if not created:
+        IngestionWatermark.objects.filter(
+            id=watermark.id, timestamp__lt=timestamp).update(
+                timestamp=timestamp, last_updated=timezone.now())
+
+
+def get_many_series_last_modified(series_list):
+    '''
+    Returns a dictionary of (platform name, channel name) -> when the measure
+    data for it last changed, for those of the given platform/channel pairs
+    we have ingested anything for
+
+    These are kept in the cache, so they can be checked without querying the
+    database (other than once to fall back to the watermarks for any that
+    aren't there).
+    '''
+    cache_keys = {_get_series_modified_key(*series): series for series in series_list}
+    last_modified = {cache_keys[cache_key]: value for (cache_key, value) in
+                     cache.get_many(cache_keys.keys()).items()}
+    missing = set(cache_keys.values()) - set(last_modified.keys())
+    if missing:
+        series_filter = functools.reduce(operator.or_, [
+            Q(platform__name=platform_name, channel__name=channel_name)
+            for (platform_name, channel_name) in missing])
+        for (platform_name, channel_name, max_last_updated) in \
+                IngestionWatermark.objects.filter(series_filter).values_list(
+                    'platform__name', 'channel__name').annotate(Max('last_updated')):
+            series = (platform_name, channel_name)
+            if series in missing:
+                last_modified[series] = max_last_updated
+                cache.add(_get_series_modified_key(*series), max_last_updated, None)
+    return last_modified
+
+
+def get_series_last_modified(platform_name, channel_name):
+    '''
+    Returns when the measure data for a platform/channel last changed, or
+    None if we have never ingested anything for it
+    '''
+    return get_many_series_last_modified([(platform_name, channel_name)]).get(
+        (platform_name, channel_name))
+
+
+def set_series_modified(platform_name, channel_name):
+    '''
+    Records that the measure data for a platform/channel just changed
+
+    Should be called once everything derived from the data (e.g. rollups)
+    has been updated as well.
+    '''
+    cache.set(_get_series_modified_key(platform_name, channel_name),
+              timezone.now(), None)
@@ -101,6 +101,10 @@ MISSION_CONTROL_TABLE = config('MISSION_CONTROL_TABLE',
 PRESTO_EXPERIMENTS_ERROR_AGGREGATES_TABLE = config(
     'PRESTO_EXPERIMENTS_ERROR_AGGREGATES_TABLE',
     default='telemetry.experiment_error_aggregates_v1')
+# if set, results of queries to bigquery/presto are saved to this directory...
+ETL_RECORD_DIR = config('ETL_RECORD_DIR', default=None)
+# ...and if this is set, they are read back from here instead of querying
+ETL_REPLAY_DIR = config('ETL_REPLAY_DIR', default=None)
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
@@ -271,6 +275,10 @@ if FETCH_MEASURE_DATA:
         'expire_old_data': {
             'schedule': crontab(minute=0, hour=0),  # every day at midnight
             'task': 'missioncontrol.base.tasks.expire_old_data'
+        },
+        'create_datum_partitions': {
+            'schedule': crontab(minute=30, hour=0),  # every day at 00:30
+            'task': 'missioncontrol.base.tasks.create_datum_partitions'
         }
     })
 
@@ -369,6 +377,27 @@ FIREFOX_EXPERIMENTS_URL = ('https://normandy.cdn.mozilla.net/api/v1/recipe/'
                            'signed/?enabled=true&' 'latest_revision__action=3')
 
 DATA_EXPIRY_INTERVAL = timedelta(days=200)
+# cache api responses (and change their etags) at least this often, even if
+# the data they are based on hasn't changed
+API_RESPONSE_CACHE_EXPIRY = 5 * 60
+# number of datums read from the database at once when building (or streaming) api responses
+API_DATUM_CHUNK_SIZE = config('API_DATUM_CHUNK_SIZE', default=2000, cast=int)
+AGGREGATES_CACHE_EXPIRY = 5 * 60  # recalculate cached aggregates after five minutes
+AGGREGATES_CACHE_HARD_EXPIRY = 24 * 60 * 60  # serve stale aggregates for up to a day
+DATUM_PARTITION_INTERVAL = timedelta(days=7)  # datum is range partitioned by week
+DATUM_PARTITION_PRECREATE_INTERVAL = timedelta(days=28)  # create partitions this far ahead
+# number of datums read and written at once by the measure ETL, bounding its memory use
+DATUM_BATCH_SIZE = config('DATUM_BATCH_SIZE', default=5000, cast=int)
+# fetch measure data for every application/platform/channel with one query per cycle
+MEASURE_CONSOLIDATED_QUERY = config('MEASURE_CONSOLIDATED_QUERY', default=False, cast=bool)
+MEASURE_MIN_DATAPOINTS = 200  # minimum datapoints per series when picking a data resolution
 MEASURE_SUMMARY_SAMPLING_INTERVAL = timedelta(days=1)
 MEASURE_SUMMARY_VERSION_INTERVAL = 3  # maximum number of previous major versions to consider
-MEASURE_SUMMARY_CACHE_EXPIRY = 24 * 60 * 60  # keep measure summaries in cache for up to one day
+MEASURE_SUMMARY_CACHE_EXPIRY = 24 * 60 * 60  # recalculate cached measure summaries after one day
+# serve stale measure summaries (while they're recalculated) for up to a week
+MEASURE_SUMMARY_CACHE_HARD_EXPIRY = 7 * 24 * 60 * 60
+MEASURE_SUMMARY_UPDATE_DELAY = 60  # delay summary recalculations by this long, to coalesce them
+MEASURE_SUMMARY_PENDING_EXPIRY = 15 * 60  # consider a queued summary update lost after this long
+# calculate measure summaries from running per-day aggregates (see MeasureSummaryBucket)
+MEASURE_SUMMARY_INCREMENTAL = config('MEASURE_SUMMARY_INCREMENTAL', default=False, cast=bool)
+MEASURE_SUMMARY_BUCKET_TOP_VALUES = 100  # number of highest-rate datums kept per bucket
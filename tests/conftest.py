@@ -31,6 +31,27 @@ def responses():
         yield rsps
 
 
+@pytest.fixture
+def mock_bigquery_client():
+    '''
+    A stand-in for a BigQuery client, which answers every query with its
+    rows (and keeps track of the queries it was asked)
+    '''
+    class MockClient:
+        def __init__(self):
+            self.rows = []
+            self.queries = []
+
+        def query(self, query):
+            self.queries.append(query)
+            return self
+
+        def result(self, page_size=None):
+            return iter(self.rows)
+
+    return MockClient()
+
+
 @pytest.fixture
 def fake_build_data():
     return [
@@ -1,15 +1,25 @@
 import datetime
+import json
 import time
 
+import pyarrow
 import pytest
 from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from freezegun import freeze_time
 
 from missioncontrol.etl.measuresummary import (get_measure_summary,
-                                               get_measure_summary_cache_key)
+                                               get_measure_summary_cache_key,
+                                               update_measure_summary)
+from missioncontrol.etl.rollups import update_datum_rollups
+from missioncontrol.etl.watermarks import set_series_modified
 from missioncontrol.base.models import (Application,
+                                        Build,
                                         Channel,
+                                        Datum,
                                         Measure,
                                         Platform)
 
@@ -106,6 +116,90 @@ def test_measure_summary_incorporated(client, monkeypatch, prepopulated_version_
     }
 
 
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('warm_cache', [False, True])
+def test_measure_summary_stored(client, monkeypatch, prepopulated_version_cache,
+                                fake_measure_data, warm_cache):
+    update_measure_summary('firefox', 'linux', 'release', 'main_crashes')
+    params = {'platform': 'linux', 'channel': 'release'}
+    resp = client.get(reverse('channel-platform-summary'), params)
+    assert resp.status_code == 200
+    assert len(resp.json()['summaries'][0]['measures']) == 1
+
+    # the summary should still be available once the cache has been flushed
+    # (either by warming it up or by reading through it to the database)
+    cache_key = get_measure_summary_cache_key('firefox', 'linux', 'release', 'main_crashes')
+    cache.delete(cache_key)
+    if warm_cache:
+        call_command('warm_summary_cache')
+        assert cache.get(cache_key) is not None
+    stored_resp = client.get(reverse('channel-platform-summary'), params)
+    assert stored_resp.status_code == 200
+    assert stored_resp.json() == resp.json()
+    assert cache.get(cache_key) is not None
+
+
+@freeze_time('2017-07-01 13:00')
+def test_channel_platform_summary_num_queries(client, monkeypatch, prepopulated_version_cache,
+                                              fake_measure_data):
+    update_measure_summary('firefox', 'linux', 'release', 'main_crashes')
+
+    # the number of queries shouldn't depend on the number of combinations:
+    # one for the measures, one for the summaries missing from the cache
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(reverse('channel-platform-summary'))
+    assert resp.status_code == 200
+    assert len(resp.json()['summaries']) > 1
+    assert len(queries.captured_queries) == 2
+
+    # (and the same if they're all missing)
+    cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        stored_resp = client.get(reverse('channel-platform-summary'))
+    assert stored_resp.json() == resp.json()
+    assert len(queries.captured_queries) == 2
+
+
+@freeze_time('2017-07-01 13:00')
+def test_channel_platform_summary_conditional(client, monkeypatch, prepopulated_version_cache,
+                                              fake_measure_data):
+    update_measure_summary('firefox', 'linux', 'release', 'main_crashes')
+    params = {'platform': 'linux', 'channel': 'release'}
+    resp = client.get(reverse('channel-platform-summary'), params)
+    assert resp.status_code == 200
+    etag = resp['ETag']
+
+    # polling for unchanged summaries shouldn't touch the database
+    with CaptureQueriesContext(connection) as queries:
+        not_modified_resp = client.get(reverse('channel-platform-summary'), params,
+                                       HTTP_IF_NONE_MATCH=etag)
+    assert not_modified_resp.status_code == 304
+    assert len(queries.captured_queries) == 0
+
+    # ...but changing a measure's channels should give us a new response
+    with freeze_time('2017-07-01 13:01'):
+        Measure.objects.get(name='main_crashes', platform__name='linux').channels.remove(
+            Channel.objects.get(name='release'))
+    modified_resp = client.get(reverse('channel-platform-summary'), params,
+                               HTTP_IF_NONE_MATCH=etag)
+    assert modified_resp.status_code == 200
+    assert modified_resp['ETag'] != etag
+    assert modified_resp['Last-Modified'] == 'Sat, 01 Jul 2017 13:01:00 GMT'
+    assert 'main_crashes' not in [measure['name'] for measure in
+                                  modified_resp.json()['summaries'][0]['measures']]
+
+
+def test_get_measure_bad_format(client, transactional_db):
+    resp = client.get(reverse('measure'), {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400,
+        'format': 'xml'
+    })
+    assert resp.status_code == 400
+
+
 @pytest.mark.parametrize('missing_param', ['platform', 'channel', 'measure', 'interval'])
 def test_get_measure_missing_params(client, missing_param):
     params = {
@@ -246,6 +340,254 @@ def test_get_measure(fake_measure_data, client):
     }
 
 
+@freeze_time('2017-07-01 13:00')
+def test_get_measure_conditional(fake_measure_data, client):
+    params = {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400
+    }
+    set_series_modified('linux', 'release')
+    resp = client.get(reverse('measure'), params)
+    assert resp.status_code == 200
+    assert resp['Last-Modified'] == 'Sat, 01 Jul 2017 13:00:00 GMT'
+    etag = resp['ETag']
+
+    # polling for unchanged data shouldn't touch the database
+    with CaptureQueriesContext(connection) as queries:
+        not_modified_resp = client.get(reverse('measure'), params,
+                                       HTTP_IF_NONE_MATCH=etag)
+    assert not_modified_resp.status_code == 304
+    assert len(queries.captured_queries) == 0
+    # (nor should asking for the same thing again, with the parameters in a
+    # different order)
+    with CaptureQueriesContext(connection) as queries:
+        cached_resp = client.get(reverse('measure'), dict(reversed(list(params.items()))))
+    assert cached_resp.status_code == 200
+    assert cached_resp['ETag'] == etag
+    assert cached_resp.json() == resp.json()
+    assert len(queries.captured_queries) == 0
+
+    # with a start time, the response stays the same until new data comes in
+    start_params = dict(params, start=int(datetime.datetime(
+        2017, 7, 1, tzinfo=datetime.timezone.utc).timestamp()))
+    start_etag = client.get(reverse('measure'), start_params)['ETag']
+    with freeze_time('2017-07-01 13:10'):
+        assert client.get(reverse('measure'), start_params,
+                          HTTP_IF_NONE_MATCH=start_etag).status_code == 304
+        # (without one, it covers a different time)
+        assert client.get(reverse('measure'), params,
+                          HTTP_IF_NONE_MATCH=etag).status_code == 200
+
+    # once new data is ingested, we should get a new response
+    with freeze_time('2017-07-01 13:01'):
+        set_series_modified('linux', 'release')
+    modified_resp = client.get(reverse('measure'), params, HTTP_IF_NONE_MATCH=etag)
+    assert modified_resp.status_code == 200
+    assert modified_resp['ETag'] != etag
+    assert modified_resp['Last-Modified'] == 'Sat, 01 Jul 2017 13:01:00 GMT'
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('params,headers', [
+    ({'format': 'arrow'}, {}),
+    ({}, {'HTTP_ACCEPT': 'application/vnd.apache.arrow.stream'})])
+def test_get_measure_arrow(fake_measure_data, client, params, headers):
+    resp = client.get(reverse('measure'), {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400,
+        **params
+    }, **headers)
+    assert resp.status_code == 200
+    assert resp['Content-Type'] == 'application/vnd.apache.arrow.stream'
+    table = pyarrow.ipc.open_stream(resp.content).read_all()
+    assert table.schema.metadata == {b'resolution': b'raw'}
+    assert table.schema.field('timestamp').type == pyarrow.int64()
+    assert table.to_pydict() == {
+        'build_id': ['20170620075044'] * 3 + ['20170629075044'] * 3,
+        'version': ['55.0.1'] * 3 + ['55.0'] * 3,
+        'timestamp': [1498909800, 1498910100, 1498910400] * 2,
+        'value': [100.0, 10.0, 10.0] * 2,
+        'usage_hours': [20.0, 16.0, 20.0] * 2
+    }
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('params', [
+    {'interval': 86400},
+    {'interval': 86400, 'relative': 1},
+    {'interval': 86400, 'max_points': 3},
+    {'interval': 86400, 'start': 0}])
+def test_get_measure_stream(fake_measure_data, client, params):
+    params = {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        **params
+    }
+    resp = client.get(reverse('measure'), params)
+    stream_resp = client.get(reverse('measure'), {'stream': 1, **params})
+    assert stream_resp.status_code == 200
+    assert stream_resp.streaming
+    assert stream_resp['Content-Type'] == 'application/json'
+    # should be exactly the same as the non-streamed response
+    assert b''.join(stream_resp.streaming_content) == resp.content
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('stream', [0, 1])
+def test_get_measure_since(fake_measure_data, client, stream):
+    params = {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400,
+        'stream': stream
+    }
+
+    def _get_measure(since):
+        resp = client.get(reverse('measure'), {'since': since, **params})
+        assert resp.status_code == 200
+        return json.loads(b''.join(resp.streaming_content) if stream else resp.content)
+
+    # the first request gets everything, and a cursor
+    resp_json = _get_measure(0)
+    assert len(resp_json['measure_data']['20170620075044']['data']) == 3
+    assert resp_json['cursor'] == 1498910400  # 2017-07-01 12:00
+
+    # points at or after the cursor should be returned
+    assert _get_measure(1498910100) == {
+        'measure_data': {
+            '20170620075044': {
+                'data': [['2017-07-01T11:55:00Z', 10.0, 16.0],
+                         ['2017-07-01T12:00:00Z', 10.0, 20.0]],
+                'version': '55.0.1'
+            },
+            '20170629075044': {
+                'data': [['2017-07-01T11:55:00Z', 10.0, 16.0],
+                         ['2017-07-01T12:00:00Z', 10.0, 20.0]],
+                'version': '55.0'
+            }
+        },
+        'resolution': 'raw',
+        'cursor': 1498910400
+    }
+
+    # nothing new: the cursor should stay the same
+    assert _get_measure(1498910500) == {
+        'measure_data': {},
+        'resolution': 'raw',
+        'cursor': 1498910500
+    }
+
+
+@pytest.mark.parametrize('params', [
+    {'since': 'yesterday'},
+    {'since': 1498910100, 'relative': 1}])
+def test_get_measure_bad_since(initial_data, client, params):
+    resp = client.get(reverse('measure'), {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400,
+        **params
+    })
+    assert resp.status_code == 400
+
+
+@freeze_time('2017-07-01 13:00')
+def test_get_measure_resolution(fake_measure_data, base_datapoint_time, client):
+    (platform, channel, measure) = ('linux', 'release', 'main_crashes')
+    update_datum_rollups(Platform.objects.get(name=platform),
+                         Channel.objects.get(name=channel),
+                         Measure.objects.filter(name=measure, platform__name=platform),
+                         base_datapoint_time - datetime.timedelta(minutes=10),
+                         base_datapoint_time)
+
+    for (resolution, expected_data) in (
+            ('hour', [['2017-07-01T11:00:00Z', 110.0, 36.0],
+                      ['2017-07-01T12:00:00Z', 10.0, 20.0]]),
+            ('day', [['2017-07-01T00:00:00Z', 120.0, 56.0]])):
+        resp = client.get(reverse('measure'), {
+            'platform': platform,
+            'channel': channel,
+            'measure': measure,
+            'interval': 86400,
+            'resolution': resolution
+        })
+        assert resp.json() == {
+            'measure_data': {
+                '20170620075044': {
+                    'data': expected_data,
+                    'version': '55.0.1'
+                },
+                '20170629075044': {
+                    'data': expected_data,
+                    'version': '55.0'
+                }
+            },
+            'resolution': resolution
+        }
+
+    # without an explicit resolution, we should get the coarsest one giving
+    # enough datapoints for the interval
+    for (interval, expected_resolution) in ((86400, 'raw'),
+                                            (30 * 86400, 'hour'),
+                                            (365 * 86400, 'day')):
+        resp = client.get(reverse('measure'), {
+            'platform': platform,
+            'channel': channel,
+            'measure': measure,
+            'interval': interval
+        })
+        assert resp.json()['resolution'] == expected_resolution
+
+    resp = client.get(reverse('measure'), {
+        'platform': platform,
+        'channel': channel,
+        'measure': measure,
+        'interval': 86400,
+        'resolution': 'minute'
+    })
+    assert resp.status_code == 400
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('params', [
+    {'interval': 86400, 'resolution': 'hour'},
+    {'interval': 365 * 86400},
+    {'interval': 365 * 86400, 'relative': 1},
+    {'interval': 86400, 'start': int(datetime.datetime(
+        2017, 6, 30, 13, tzinfo=datetime.timezone.utc).timestamp()), 'resolution': 'hour'}])
+def test_get_measure_resolution_not_rolled_up(fake_measure_data, client, params):
+    params = {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        **params
+    }
+    # without rollups for the data, we should get raw data instead
+    set_series_modified('linux', 'release')
+    resp = client.get(reverse('measure'), params)
+    assert resp.json()['resolution'] == 'raw'
+    assert len(resp.json()['measure_data']['20170629075044']['data']) == 3
+
+    # ... until they're backfilled (which should also replace any cached
+    # responses)
+    with freeze_time('2017-07-01 13:01'):
+        call_command('backfill_datum_rollups', platform='linux', channel='release')
+    etag = resp['ETag']
+    resp = client.get(reverse('measure'), params, HTTP_IF_NONE_MATCH=etag)
+    assert resp.status_code == 200
+    assert resp['ETag'] != etag
+    assert resp.json()['resolution'] == params.get('resolution', 'day')
+    assert len(resp.json()['measure_data']['20170629075044']['data']) == (
+        2 if params.get('resolution') == 'hour' else 1)
+
+
 @pytest.mark.parametrize('interval', [86400, 300, 0])
 @pytest.mark.parametrize('start', [None, 0, 250, 301])
 @freeze_time('2017-07-01 13:00')
@@ -284,6 +626,38 @@ def test_compare(fake_measure_data_offset, client, interval, start):
     }
 
 
+@freeze_time('2017-07-01 13:00')
+def test_compare_num_queries(fake_measure_data_offset, base_datapoint_time, client):
+    params = {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400,
+        'relative': 1
+    }
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(reverse('measure'), params)
+    assert len(resp.json()['measure_data']) == 2
+    num_queries = len(queries.captured_queries)
+
+    # more builds of the same versions shouldn't mean more queries
+    build = Build.objects.get(build_id='20170629075044')
+    for i in range(5):
+        other_build = Build.objects.create(
+            application=build.application, platform=build.platform,
+            channel=build.channel, build_id='2017063007504{}'.format(i),
+            version=build.version)
+        Datum.objects.create(build=other_build, measure=Measure.objects.get(
+            name='main_crashes', platform__name='linux'),
+            timestamp=base_datapoint_time + datetime.timedelta(hours=i),
+            value=1, usage_hours=1, client_count=1)
+    with CaptureQueriesContext(connection) as queries:
+        resp = client.get(reverse('measure'), params)
+    assert len(resp.json()['measure_data']) == 7
+    assert len(queries.captured_queries) == num_queries
+    assert resp.json()['measure_data']['20170630075043']['data'] == [[0, 1.0, 1.0]]
+
+
 @freeze_time('2017-07-01 13:00')
 def test_compare_version(fake_measure_data_offset, client):
     (platform, channel, measure) = ('linux', 'release', 'main_crashes')
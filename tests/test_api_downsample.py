@@ -0,0 +1,52 @@
+import datetime
+import random
+
+import pytest
+from django.urls import reverse
+from freezegun import freeze_time
+
+from missioncontrol.api import downsample
+
+
+@pytest.fixture
+def noisy_series():
+    random.seed(0)
+    start = datetime.datetime(2017, 7, 1)
+    return [(start + datetime.timedelta(minutes=5 * i),
+             random.choice([0.0, 1.0, 10.0, 100.0]), random.uniform(1, 20))
+            for i in range(1000)]
+
+
+@pytest.mark.parametrize('max_points', [3, 50, 999])
+def test_downsample(noisy_series, max_points):
+    downsampled = downsample.downsample(noisy_series, max_points)
+    assert len(downsampled) == max_points
+    assert downsampled[0] == noisy_series[0]
+    assert downsampled[-1] == noisy_series[-1]
+    assert downsampled == sorted(downsampled)
+    assert set(downsampled) <= set(noisy_series)
+
+    # a spike should always survive downsampling
+    spiky_series = list(noisy_series)
+    spiky_series[500] = (spiky_series[500][0], 100000.0, 1.0)
+    assert spiky_series[500] in downsample.downsample(spiky_series, max_points)
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('max_points,status_code,num_points', [
+    (None, 200, 3), ('3', 200, 3), ('1000', 200, 3), ('2', 400, None), ('x', 400, None)])
+def test_measure_max_points(fake_measure_data, client, max_points, status_code,
+                            num_points):
+    params = {
+        'platform': 'linux',
+        'channel': 'release',
+        'measure': 'main_crashes',
+        'interval': 86400
+    }
+    if max_points:
+        params['max_points'] = max_points
+    resp = client.get(reverse('measure'), params)
+    assert resp.status_code == status_code
+    if num_points:
+        assert [len(build_data['data']) for build_data in
+                resp.json()['measure_data'].values()] == [num_points, num_points]
@@ -1,3 +1,4 @@
+import pyarrow
 import pytest
 from django.urls import reverse
 from freezegun import freeze_time
@@ -25,6 +26,55 @@ def test_experiments_api(fake_experiments_data, client):
     }
 
 
+@freeze_time('2017-07-01 13:00')
+def test_experiments_api_stream(fake_experiments_data, client):
+    params = {
+        'measure': 'main_crashes',
+        'interval': 86400,
+        'experiment': 'my_experiment'
+    }
+    resp = client.get(reverse('experiment'), params)
+    stream_resp = client.get(reverse('experiment'), {'stream': 1, **params})
+    assert stream_resp.status_code == 200
+    assert stream_resp.streaming
+    assert b''.join(stream_resp.streaming_content) == resp.content
+
+
+@freeze_time('2017-07-01 13:00')
+def test_experiments_api_since(fake_experiments_data, client):
+    resp = client.get(reverse('experiment'), {
+        'measure': 'main_crashes',
+        'interval': 86400,
+        'experiment': 'my_experiment',
+        'since': 1498910400  # 2017-07-01 12:00
+    })
+    assert resp.json() == {
+        'measure_data': {
+            'branch1': [['2017-07-01T12:00:00Z', 10.0, 20.0]],
+            'branch2': [['2017-07-01T12:00:00Z', 10.0, 20.0]]
+        },
+        'cursor': 1498910400
+    }
+
+
+@freeze_time('2017-07-01 13:00')
+def test_experiments_api_arrow(fake_experiments_data, client):
+    resp = client.get(reverse('experiment'), {
+        'measure': 'main_crashes',
+        'interval': 86400,
+        'experiment': 'my_experiment',
+        'format': 'arrow'
+    })
+    assert resp.status_code == 200
+    table = pyarrow.ipc.open_stream(resp.content).read_all()
+    assert table.to_pydict() == {
+        'experiment_branch': ['branch1'] * 3 + ['branch2'] * 3,
+        'timestamp': [1498909800, 1498910100, 1498910400] * 2,
+        'value': [100.0, 10.0, 10.0] * 2,
+        'usage_hours': [20.0, 16.0, 20.0] * 2
+    }
+
+
 @pytest.mark.parametrize('missing_param', ['experiment', 'measure', 'interval'])
 def test_experiments_api_missing_params(client, missing_param):
     params = {
@@ -0,0 +1,109 @@
+import datetime
+
+import pyarrow
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from freezegun import freeze_time
+
+from missioncontrol.base.models import (Application,
+                                        Build,
+                                        Channel,
+                                        Datum,
+                                        Measure,
+                                        Platform)
+
+
+@pytest.fixture
+def more_fake_measure_data(fake_measure_data_offset, base_datapoint_time):
+    # data for another measure on the same builds, and the same measure on
+    # another channel
+    for build in Build.objects.all():
+        Datum.objects.create(build=build, measure=Measure.objects.get(
+            name='content_crashes', platform__name='linux'),
+            timestamp=base_datapoint_time, value=5, usage_hours=10, client_count=10)
+    beta_build = Build.objects.create(application=Application.objects.get(name='firefox'),
+                                      platform=Platform.objects.get(name='linux'),
+                                      channel=Channel.objects.get(name='beta'),
+                                      build_id='20170629075044', version='56.0b1')
+    Datum.objects.create(build=beta_build, measure=Measure.objects.get(
+        name='main_crashes', platform__name='linux'),
+        timestamp=base_datapoint_time, value=1, usage_hours=1, client_count=1)
+
+
+SERIES = ['linux:release:main_crashes', 'linux:release:content_crashes',
+          'linux:beta:main_crashes', 'windows:release:main_crashes']
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('params', [
+    {'interval': 86400},
+    {'interval': 2 * 86400, 'start': 300},
+    {'interval': 86400, 'relative': 1},
+    {'interval': 300, 'start': 300, 'relative': 1},
+    {'interval': 86400, 'relative': 1, 'version': '55.0'},
+    {'interval': 2 * 86400, 'max_points': 3}])
+def test_measures(more_fake_measure_data, client, params):
+    resp = client.get(reverse('measures'), {'series': SERIES, **params})
+    assert resp.status_code == 200
+
+    # should be the same as asking for each series separately
+    expected_series = []
+    for series in SERIES:
+        (platform, channel, measure) = series.split(':')
+        measure_resp = client.get(reverse('measure'), {
+            'platform': platform, 'channel': channel, 'measure': measure, **params})
+        expected_series.append({
+            'platform': platform,
+            'channel': channel,
+            'measure': measure,
+            'measure_data': measure_resp.json()['measure_data']
+        })
+    assert resp.json() == {
+        'series': expected_series,
+        'resolution': 'raw'
+    }
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('relative', [0, 1])
+def test_measures_num_queries(more_fake_measure_data, client, relative):
+    num_queries = []
+    for num_series in (1, len(SERIES)):
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get(reverse('measures'), {
+                'series': SERIES[:num_series], 'interval': 86400, 'relative': relative})
+        assert resp.status_code == 200
+        num_queries.append(len(queries.captured_queries))
+    assert num_queries[0] == num_queries[1]
+
+
+@pytest.mark.parametrize('params,status_code', [
+    ({'interval': 86400}, 400),
+    ({'series': 'linux:release:main_crashes'}, 400),
+    ({'series': 'linux:main_crashes', 'interval': 86400}, 400),
+    ({'series': 'linux:release:main_crashes', 'interval': 0, 'relative': 1}, 400),
+    ({'series': ['linux:release:main_crashes', 'linux:release:not_a_measure'],
+      'interval': 86400}, 404)])
+def test_measures_bad_params(initial_data, client, params, status_code):
+    resp = client.get(reverse('measures'), params)
+    assert resp.status_code == status_code
+
+
+@freeze_time('2017-07-01 13:00')
+def test_measures_arrow(more_fake_measure_data, client):
+    resp = client.get(reverse('measures'), {
+        'series': SERIES[1:3], 'interval': 86400, 'format': 'arrow'})
+    assert resp.status_code == 200
+    assert pyarrow.ipc.open_stream(resp.content).read_all().to_pydict() == {
+        'platform': ['linux'] * 3,
+        'channel': ['release', 'release', 'beta'],
+        'measure': ['content_crashes', 'content_crashes', 'main_crashes'],
+        'build_id': ['20170620075044', '20170629075044', '20170629075044'],
+        'version': ['55.0.1', '55.0', '56.0b1'],
+        'timestamp': [int(datetime.datetime(
+            2017, 7, 1, 12, tzinfo=datetime.timezone.utc).timestamp())] * 3,
+        'value': [5.0, 5.0, 1.0],
+        'usage_hours': [10.0, 10.0, 1.0]
+    }
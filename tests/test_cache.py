@@ -0,0 +1,43 @@
+from unittest.mock import Mock
+
+from django.core.cache import cache
+from freezegun import freeze_time
+
+from missioncontrol.base.cache import (get_many_with_soft_expiry,
+                                       get_with_soft_expiry,
+                                       set_with_soft_expiry)
+
+
+def test_soft_expiry():
+    refresh = Mock()
+    with freeze_time('2017-07-01 12:00') as frozen_time:
+        set_with_soft_expiry('key', 'value', 60, 600)
+        assert get_with_soft_expiry('key', refresh) == 'value'
+        refresh.assert_not_called()
+
+        # once stale, the value is still returned but refreshed (only once,
+        # no matter how often it's read)
+        frozen_time.tick(61)
+        assert get_with_soft_expiry('key', refresh) == 'value'
+        assert get_with_soft_expiry('key', refresh) == 'value'
+        refresh.assert_called_once_with('key')
+
+        # ...until it has actually been refreshed and gone stale again
+        set_with_soft_expiry('key', 'new value', 60, 600)
+        assert get_with_soft_expiry('key', refresh) == 'new value'
+        assert refresh.call_count == 1
+        frozen_time.tick(61)
+        assert get_with_soft_expiry('key', refresh) == 'new value'
+        assert refresh.call_count == 2
+
+
+def test_soft_expiry_missing_and_raw_values():
+    refresh = Mock()
+    cache.set('raw', {'versions': []})
+    set_with_soft_expiry('wrapped', {'versions': []}, 60, 600)
+    assert get_many_with_soft_expiry(['raw', 'wrapped', 'missing'], refresh) == {
+        'raw': {'versions': []},
+        'wrapped': {'versions': []}
+    }
+    assert get_with_soft_expiry('missing', refresh, default=[]) == []
+    refresh.assert_not_called()
@@ -0,0 +1,71 @@
+import datetime
+import decimal
+
+import pytest
+
+from missioncontrol.base.models import (Build,
+                                        Datum,
+                                        Measure)
+from missioncontrol.etl.loader import (_format_copy_value,
+                                       load_datums,
+                                       upsert_datums)
+
+
+def test_load_datums(prepopulated_builds, base_datapoint_time):
+    build = Build.objects.get(build_id='20170629075044')
+    measure = Measure.objects.get(name='main_crashes', platform__name='linux')
+    datum_rows = [
+        (build.id, None, measure.id,
+         base_datapoint_time + datetime.timedelta(minutes=5 * i),
+         float(i), 10.5, i + 100)
+        for i in range(10)
+    ]
+
+    assert load_datums(datum_rows) == 10
+    assert list(Datum.objects.values_list(
+        'build_id', 'experiment_branch_id', 'measure_id', 'timestamp', 'value',
+        'usage_hours', 'client_count').order_by('timestamp')) == datum_rows
+
+
+def test_load_datums_value_types(prepopulated_builds, base_datapoint_time):
+    # values from query results aren't necessarily python floats / ints
+    build = Build.objects.get(build_id='20170629075044')
+    measure = Measure.objects.get(name='main_crashes', platform__name='linux')
+    assert load_datums([(build.id, None, measure.id, base_datapoint_time,
+                         decimal.Decimal('1.5'), decimal.Decimal('10.25'), 100)]) == 1
+    assert list(Datum.objects.values_list('value', 'usage_hours', 'client_count')) == [
+        (1.5, 10.25, 100)]
+
+
+@pytest.mark.parametrize('value,expected', [
+    (None, '\\N'),
+    (1.5, '1.5'),
+    (decimal.Decimal('1.5'), '1.5'),
+    (100, '100'),
+    (datetime.datetime(2017, 7, 1, 12), '2017-07-01T12:00:00'),
+    ('55.0', '55.0'),
+    ('a\tb\nc\\d\re', 'a\\tb\\nc\\\\d\\re')])
+def test_format_copy_value(value, expected):
+    assert _format_copy_value(value) == expected
+
+
+@pytest.mark.parametrize('overwrite', [False, True])
+def test_upsert_datums(prepopulated_builds, base_datapoint_time, overwrite):
+    build = Build.objects.get(build_id='20170629075044')
+    measure = Measure.objects.get(name='main_crashes', platform__name='linux')
+    existing_datum_row = (build.id, None, measure.id, base_datapoint_time, 1.0, 10.0, 100)
+    load_datums([existing_datum_row])
+
+    # a corrected version of the existing datum, plus a new one
+    corrected_datum_row = (build.id, None, measure.id, base_datapoint_time, 2.0, 20.0, 200)
+    new_datum_row = (build.id, None, measure.id,
+                     base_datapoint_time + datetime.timedelta(minutes=5), 3.0, 30.0, 300)
+    assert upsert_datums([corrected_datum_row, new_datum_row], overwrite=overwrite,
+                         batch_size=1) == 2
+
+    assert list(Datum.objects.values_list(
+        'build_id', 'experiment_branch_id', 'measure_id', 'timestamp', 'value',
+        'usage_hours', 'client_count').order_by('timestamp')) == [
+            corrected_datum_row if overwrite else existing_datum_row,
+            new_datum_row
+        ]
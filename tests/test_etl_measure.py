@@ -1,13 +1,24 @@
 import datetime
+import json
+import os
 
+import pyarrow.parquet
 import pytest
+import pytz
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from freezegun import freeze_time
 from unittest.mock import (call, patch)
 
 from missioncontrol.base.models import (Application,
+                                        Build,
                                         Channel,
+                                        DailyDatum,
                                         Datum,
+                                        HourlyDatum,
+                                        IngestionWatermark,
                                         Measure,
+                                        MeasureSummaryBucket,
                                         Platform)
 from missioncontrol.etl.date import datetime_to_utc
 
@@ -24,29 +35,31 @@ def mock_raw_query_data(monkeypatch, base_datapoint_time):
 
 
 @pytest.fixture
-def mock_raw_query(monkeypatch, mock_raw_query_data):
+def mock_raw_query(monkeypatch, mock_bigquery_client, mock_raw_query_data):
     import missioncontrol.etl.bigquery
 
-    class MockClient:
-        def query(self, query):
-            return mock_raw_query_data
-
-    monkeypatch.setattr(missioncontrol.etl.bigquery, 'get_bigquery_client', MockClient)
+    mock_bigquery_client.rows = mock_raw_query_data
+    monkeypatch.setattr(missioncontrol.etl.bigquery, 'get_bigquery_client',
+                        lambda: mock_bigquery_client)
 
 
 def test_update_measures_no_build_data(initial_data,
                                        mock_raw_query_data):
     (application, platform, channel) = ('firefox', 'linux', 'release')
-    with pytest.raises(Exception, match='No valid versions'):
-        from missioncontrol.etl.measure import update_measures
+    from missioncontrol.etl.measure import (NoValidVersionsError,
+                                            update_measures)
+    with pytest.raises(NoValidVersionsError,
+                       match='No valid versions found for combination: firefox/release/linux'):
         update_measures(application, platform, channel)
 
 
+@pytest.mark.parametrize('batch_size', [1, 5000])
 @freeze_time('2017-07-01 13:00')
 def test_update_measures(prepopulated_builds,
                          mock_raw_query,
                          mock_raw_query_data,
-                         base_datapoint_time):
+                         base_datapoint_time,
+                         batch_size):
     (application, platform, channel) = ('firefox', 'linux', 'release')
 
     # delete linux release measures except for main_crashes (since we're
@@ -57,7 +70,7 @@ def test_update_measures(prepopulated_builds,
                                name='main_crashes').delete()
 
     from missioncontrol.etl.measure import update_measures
-    update_measures(application, platform, channel)
+    update_measures(application, platform, channel, batch_size=batch_size)
     # assert that data gets inserted as expected
     assert list(Datum.objects.filter(
         measure__name='main_crashes',
@@ -74,6 +87,105 @@ def test_update_measures(prepopulated_builds,
     # assert that we have the expected number of total datums
     assert Datum.objects.count() == 2
 
+    # assert that both datums were rolled up into the same hour / day
+    for rollup_model in (HourlyDatum, DailyDatum):
+        assert list(rollup_model.objects.values_list(
+            'measure__name', 'value', 'usage_hours')) == [('main_crashes', 240.0, 30.0)]
+
+    # assert that the watermark was moved up to the latest datum
+    assert list(IngestionWatermark.objects.values_list(
+        'application__name', 'platform__name', 'channel__name', 'timestamp')) == [
+            (application, platform, channel,
+             max(datetime_to_utc(d[0]) for d in mock_raw_query_data))]
+
+
+@freeze_time('2017-07-01 13:00')
+@pytest.mark.parametrize('bulk_create, batch_size', [(True, 1000), (True, 1), (False, 1)])
+def test_update_measures_incremental_summary(prepopulated_builds, mock_raw_query,
+                                             mock_raw_query_data, bulk_create,
+                                             batch_size):
+    # we're pretending to only return main_crashes
+    Measure.objects.filter(application__name='firefox', channels__name='release',
+                           platform__name='linux').exclude(name='main_crashes').delete()
+
+    from missioncontrol.etl.measure import update_measures
+    with patch('missioncontrol.etl.measure.MEASURE_SUMMARY_INCREMENTAL', True):
+        # with a batch size of 1, the second datum is added to the bucket
+        # created for the first one
+        update_measures('firefox', 'linux', 'release', bulk_create=bulk_create,
+                        batch_size=batch_size)
+    assert list(MeasureSummaryBucket.objects.values_list(
+        'measure__name', 'min_timestamp', 'max_timestamp', 'count', 'value',
+        'usage_hours')) == [
+            ('main_crashes', datetime_to_utc(mock_raw_query_data[0][0]),
+             datetime_to_utc(mock_raw_query_data[1][0]), 2, 240.0, 30.0)]
+    assert json.loads(MeasureSummaryBucket.objects.get().top_values) == [
+        [120.0, 10.0], [120.0, 20.0]]
+
+
+@freeze_time('2017-07-01 13:00')
+def test_update_measures_resumes_from_watermark(prepopulated_builds, mock_bigquery_client,
+                                                base_datapoint_time):
+    from missioncontrol.etl.measure import update_measures
+    from missioncontrol.etl.watermarks import advance_watermark
+
+    advance_watermark(base_datapoint_time,
+                      application=Application.objects.get(name='firefox'),
+                      platform=Platform.objects.get(name='linux'),
+                      channel=Channel.objects.get(name='release'))
+    update_measures('firefox', 'linux', 'release', client=mock_bigquery_client)
+    queries = mock_bigquery_client.queries
+    assert "window_start > '2017-07-01 12:00:00'" in queries[0]
+    # (results need to be in order for the watermark to be safe to advance
+    # as they're loaded)
+    assert queries[0].endswith('ORDER BY window_start')
+
+
+@freeze_time('2017-07-01 13:00')
+def test_update_measures_partial_failure(prepopulated_builds, mock_bigquery_client,
+                                         base_datapoint_time):
+    from missioncontrol.etl import measure
+
+    # we're pretending to only return main_crashes
+    Measure.objects.filter(application__name='firefox', channels__name='release',
+                           platform__name='linux').exclude(name='main_crashes').delete()
+    window_start = datetime.datetime.fromtimestamp(
+        base_datapoint_time.timestamp(), tz=None)
+    window_starts = [window_start + datetime.timedelta(minutes=5 * i) for i in range(3)]
+    # two datums per window
+    mock_bigquery_client.rows = [
+        [w, build_id, version, 10, 120, 1] for w in window_starts
+        for (build_id, version) in (('20170620075044', '55.0.1'),
+                                    ('20170629075044', '55.0'))]
+    load_datums = measure.load_datums
+    num_batches = []
+
+    def _load_datums_failing_second_batch(datum_rows):
+        num_batches.append(None)
+        if len(num_batches) == 2:
+            raise Exception('Database went away')
+        load_datums(datum_rows)
+
+    with patch.object(measure, 'load_datums', _load_datums_failing_second_batch), \
+            pytest.raises(Exception, match='Database went away'):
+        measure.update_measures('firefox', 'linux', 'release', batch_size=3,
+                                client=mock_bigquery_client)
+
+    # only complete windows should have been loaded (the first batch ends
+    # after the second window, not in the middle of it), and the watermark
+    # should not have moved past them
+    assert sorted(Datum.objects.values_list('timestamp', flat=True)) == sorted(
+        [datetime_to_utc(w) for w in window_starts[:2]] * 2)
+    assert IngestionWatermark.objects.get().timestamp == datetime_to_utc(window_starts[1])
+
+    # the next run should pick up where the last one left off
+    measure.update_measures('firefox', 'linux', 'release', batch_size=3,
+                            client=mock_bigquery_client)
+    assert "window_start > '2017-07-01 12:05:00'" in mock_bigquery_client.queries[-1]
+    assert sorted(Datum.objects.values_list('timestamp', flat=True)) == sorted(
+        [datetime_to_utc(w) for w in window_starts] * 2)
+    assert IngestionWatermark.objects.get().timestamp == datetime_to_utc(window_starts[-1])
+
 
 def test_all_measure_update_tasks_scheduled(initial_data, *args):
     # this test is a bit tautological, but at least exercises the function
@@ -94,3 +206,130 @@ def test_all_measure_update_tasks_scheduled(initial_data, *args):
     with patch('missioncontrol.etl.measure.update_measures.apply_async') as mock_task:
         update_channel_measures()
         mock_task.assert_has_calls(expected_calls, any_order=True)
+
+
+def test_consolidated_measure_update_task_scheduled(initial_data):
+    from missioncontrol.etl.tasks import update_channel_measures
+    with patch('missioncontrol.etl.tasks.MEASURE_CONSOLIDATED_QUERY', True), \
+            patch('missioncontrol.etl.measure.update_measures.apply_async') as mock_task, \
+            patch('missioncontrol.etl.measure.update_all_measures.apply_async') as mock_all_task:
+        update_channel_measures()
+        mock_all_task.assert_called_once_with()
+        mock_task.assert_not_called()
+
+
+@freeze_time('2017-07-01 13:00')
+def test_update_all_measures(prepopulated_builds, mock_bigquery_client,
+                             base_datapoint_time):
+    from missioncontrol.etl.measure import update_all_measures
+
+    # also create a windows build, so we have two combinations to update
+    (application, channel) = (Application.objects.get(name='firefox'),
+                              Channel.objects.get(name='release'))
+    Build.objects.create(application=application,
+                         platform=Platform.objects.get(name='windows'),
+                         channel=channel, build_id='20170629075044',
+                         version='55.0')
+    measure_names = sorted(set(Measure.objects.filter(
+        application=application, channels=channel,
+        platform__name__in=['linux', 'windows']).values_list('name', flat=True)))
+
+    window_start = datetime.datetime.fromtimestamp(
+        base_datapoint_time.timestamp(), tz=None)
+    mock_bigquery_client.rows = [
+        (application.telemetry_name, Platform.objects.get(name=platform_name).telemetry_name,
+         channel_name, window_start, '20170629075044', '55.0', 10, 120) +
+        (value,) * len(measure_names)
+        for (platform_name, channel_name, value) in (
+            ('linux', 'release', 1),
+            ('windows', 'release', 2),
+            # no builds for this combination, so it should be ignored
+            ('linux', 'beta', 3))
+    ]
+    update_all_measures(client=mock_bigquery_client)
+
+    # everything should have been fetched with a single query
+    queries = mock_bigquery_client.queries
+    assert len(queries) == 1
+    assert queries[0].endswith('ORDER BY window_start')
+    for (platform_name, value) in (('linux', 1), ('windows', 2)):
+        expected_measure_names = Measure.objects.filter(
+            application=application, channels=channel,
+            platform__name=platform_name).values_list('name', flat=True)
+        assert sorted(Datum.objects.filter(
+            build__platform__name=platform_name).values_list(
+                'measure__name', 'value')) == sorted(
+                    [(measure_name, value) for measure_name in expected_measure_names])
+    assert not Datum.objects.filter(build__channel__name='beta').exists()
+
+
+def test_update_all_measures_error(prepopulated_builds):
+    from missioncontrol.etl import measure
+
+    # only combinations without versions should be skipped, anything else
+    # going wrong should not be swallowed
+    with patch.object(measure, '_get_build_index', side_effect=RuntimeError('oops')), \
+            pytest.raises(RuntimeError, match='oops'):
+        measure.update_all_measures()
+
+
+@freeze_time('2017-07-01 13:00')
+def test_update_measures_num_queries(prepopulated_builds, mock_bigquery_client,
+                                     base_datapoint_time):
+    from missioncontrol.etl.measure import update_measures
+
+    def _get_num_queries(num_windows):
+        Datum.objects.all().delete()
+        IngestionWatermark.objects.all().delete()
+        window_start = datetime.datetime.fromtimestamp(
+            base_datapoint_time.timestamp(), tz=None)
+        rows = mock_bigquery_client.rows = []
+        for i in reversed(range(num_windows)):
+            for (build_id, version) in (('20170629075044', '55.0'),
+                                        ('20170620075044', '55.0.1'),
+                                        # not a build we know about
+                                        ('20170630075044', '55.0')):
+                rows.append([window_start - datetime.timedelta(minutes=5 * i),
+                             build_id, version, 10, 120] + [1] * 7)
+
+        with CaptureQueriesContext(connection) as context:
+            update_measures('firefox', 'linux', 'release',
+                            submission_date=base_datapoint_time.replace(hour=0),
+                            client=mock_bigquery_client)
+        return len(context.captured_queries)
+
+    # the number of queries should not depend on the number of rows returned
+    assert _get_num_queries(1) == _get_num_queries(10)
+    assert Datum.objects.count() == 10 * 2 * Measure.objects.filter(
+        application__name='firefox', platform__name='linux',
+        channels__name='release').count()
+
+
+def test_update_measures_from_parquet(initial_data):
+    from missioncontrol.etl.measure import update_measures
+
+    parquet_path = os.path.join(os.path.dirname(__file__), '..',
+                                'sample.snappy.parquet')
+    # the sample uses the os names from older telemetry
+    Platform.objects.filter(name='windows').update(telemetry_name='Windows_NT')
+    build = Build.objects.create(application=Application.objects.get(name='firefox'),
+                                 platform=Platform.objects.get(name='windows'),
+                                 channel=Channel.objects.get(name='release'),
+                                 build_id='20170608105825', version='54.0')
+    update_measures('firefox', 'windows', 'release', bulk_create=False,
+                    submission_date=datetime.datetime(2017, 6, 29, tzinfo=pytz.UTC),
+                    parquet_path=parquet_path)
+
+    sample_rows = [row for row in pyarrow.parquet.read_table(parquet_path).to_pylist()
+                   if row['os_name'] == 'Windows_NT' and row['channel'] == 'release' and
+                   row['build_id'] == build.build_id]
+    measures = Measure.objects.filter(application__name='firefox',
+                                      platform__name='windows',
+                                      channels__name='release')
+    assert sorted(Datum.objects.values_list(
+        'build', 'measure__name', 'usage_hours', 'client_count', 'value')) == sorted([
+            (build.id, measure.name,
+             pytest.approx(sum([row['usage_hours'] for row in sample_rows])),
+             sum([row['count'] for row in sample_rows]),
+             sum([row.get(measure.name) or 0 for row in sample_rows]))
+            for measure in measures])
@@ -0,0 +1,74 @@
+import datetime
+import re
+
+from django.core.cache import cache
+from django.core.management import call_command
+
+from missioncontrol.base.models import (Build,
+                                        Datum,
+                                        Measure)
+from missioncontrol.etl.measuresummary import _get_measure_summary_pending_key
+from missioncontrol.etl.watermarks import get_series_last_modified
+
+
+def test_record_and_replay_bigquery(settings, monkeypatch, mock_bigquery_client, tmpdir):
+    from missioncontrol.etl import bigquery
+
+    rows = [(datetime.datetime(2017, 7, 1, 12, 0), '20170629075044', '55.0', 10.5, 120, None)]
+    mock_bigquery_client.rows = rows
+    monkeypatch.setattr(bigquery.bigquery, 'Client', lambda: mock_bigquery_client)
+    settings.ETL_RECORD_DIR = str(tmpdir)
+    assert list(bigquery.get_bigquery_client().query('SELECT 1').result()) == rows
+
+    # replaying should give back the same results, without querying
+    settings.ETL_RECORD_DIR = None
+    settings.ETL_REPLAY_DIR = str(tmpdir)
+    assert [tuple(row) for row in bigquery.get_bigquery_client().query(
+        'SELECT 1').result()] == rows
+    assert len(mock_bigquery_client.queries) == 1
+
+
+def test_record_and_replay_presto(settings, monkeypatch, tmpdir):
+    from missioncontrol.etl import presto
+
+    rows = [(datetime.datetime(2017, 7, 1, 12, 0), 'branch1', 10.5, 120, 1)]
+
+    class MockEngine:
+        def execute(self, raw_sql, params):
+            return self
+
+        def fetchall(self):
+            return rows
+
+    monkeypatch.setattr(presto, 'get_engine', MockEngine)
+    settings.ETL_RECORD_DIR = str(tmpdir)
+    assert presto.raw_query('SELECT %(foo)s', {'foo': 1}) == rows
+
+    settings.ETL_RECORD_DIR = None
+    settings.ETL_REPLAY_DIR = str(tmpdir)
+    monkeypatch.setattr(presto, 'get_engine', None)
+    assert [tuple(row) for row in presto.raw_query('SELECT %(foo)s', {'foo': 1})] == rows
+
+
+def test_benchmark_etl(initial_data, capsys):
+    cache.clear()
+    measure_names = Measure.objects.filter(application__name='firefox',
+                                           platform__name='linux',
+                                           channels__name='release').values_list(
+                                               'name', flat=True)
+    call_command('benchmark_etl', '--rows', '50')
+    num_datums = int(re.search(r'Loaded (\d+) datums from 50 rows',
+                               capsys.readouterr().out).group(1))
+    # (synthetic counts may be zero, but they're never negative)
+    assert num_datums == 50 * len(measure_names)
+
+    call_command('benchmark_etl', '--rows', '50', '--experiment', 'my_experiment')
+    assert re.search(r'Loaded \d+ datums from 50 rows', capsys.readouterr().out)
+
+    # everything the benchmark loaded should have been rolled back
+    assert not Datum.objects.exists()
+    assert not Build.objects.exists()
+    # ... and the caches should not have been told about any of it
+    assert get_series_last_modified('linux', 'release') is None
+    assert not any(cache.get(_get_measure_summary_pending_key(
+        'firefox', 'linux', 'release', measure_name)) for measure_name in measure_names)
@@ -0,0 +1,34 @@
+import datetime
+
+from missioncontrol.base.models import (Application,
+                                        Channel,
+                                        Experiment,
+                                        IngestionWatermark,
+                                        Platform)
+from missioncontrol.etl.watermarks import (advance_watermark,
+                                           get_watermark)
+
+
+def test_advance_watermark(initial_data, base_datapoint_time):
+    series = {
+        'application': Application.objects.get(name='firefox'),
+        'platform': Platform.objects.get(name='linux'),
+        'channel': Channel.objects.get(name='release')
+    }
+    assert get_watermark(**series) is None
+
+    advance_watermark(base_datapoint_time, **series)
+    assert get_watermark(**series) == base_datapoint_time
+
+    # watermarks only move forward
+    advance_watermark(base_datapoint_time - datetime.timedelta(minutes=5), **series)
+    assert get_watermark(**series) == base_datapoint_time
+    advance_watermark(base_datapoint_time + datetime.timedelta(minutes=5), **series)
+    assert get_watermark(**series) == base_datapoint_time + datetime.timedelta(minutes=5)
+
+    # other series are tracked separately
+    experiment = Experiment.objects.create(name='my_experiment', enabled=True)
+    assert get_watermark(experiment=experiment) is None
+    advance_watermark(base_datapoint_time, experiment=experiment)
+    assert get_watermark(experiment=experiment) == base_datapoint_time
+    assert IngestionWatermark.objects.count() == 2
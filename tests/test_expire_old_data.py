@@ -1,8 +1,18 @@
 import datetime
 import pytz
 
+import pytest
+from django.utils import timezone
+
 from missioncontrol.base.models import (Build, Datum, Measure)
-from missioncontrol.base.tasks import expire_old_data
+from missioncontrol.base.partitions import (get_datum_partitions,
+                                            get_partition_name,
+                                            get_partition_start,
+                                            partition_datum_table,
+                                            supports_partitioning,
+                                            unpartition_datum_table)
+from missioncontrol.base.tasks import (create_datum_partitions,
+                                       expire_old_data)
 
 
 def test_expire_data(prepopulated_builds, settings):
@@ -41,3 +51,56 @@ def test_expire_data(prepopulated_builds, settings):
     assert list(Datum.objects.values_list('timestamp', 'value')) == [
         (pytz.UTC.localize(new_datum_timestamp), 10.0)
     ]
+
+
+@pytest.fixture
+def partitioned_datum(prepopulated_builds, settings):
+    if not supports_partitioning():
+        pytest.skip('database does not support native partitioning')
+    now = timezone.now()
+    partition_datum_table(now - settings.DATA_EXPIRY_INTERVAL - datetime.timedelta(days=30),
+                          now)
+    yield
+    unpartition_datum_table()
+
+
+def test_expire_data_partitioned(partitioned_datum, settings):
+    build = Build.objects.first()
+    measure = Measure.objects.filter(application=build.application,
+                                     platform=build.platform).first()
+
+    # old enough that its whole partition should be dropped
+    expired_partition_timestamp = (timezone.now() - settings.DATA_EXPIRY_INTERVAL -
+                                   datetime.timedelta(days=21))
+    # old, but shares a partition with data that should be kept
+    old_datum_timestamp = (timezone.now() - settings.DATA_EXPIRY_INTERVAL -
+                           datetime.timedelta(hours=1))
+    new_datum_timestamp = timezone.now() - datetime.timedelta(hours=1)
+    for (timestamp, value) in ((expired_partition_timestamp, 0.0),
+                               (old_datum_timestamp, 5.0),
+                               (new_datum_timestamp, 10.0)):
+        Datum.objects.create(build=build, measure=measure, timestamp=timestamp,
+                             client_count=1, usage_hours=1.0, value=value)
+
+    expired_partition_name = get_partition_name(
+        get_partition_start(expired_partition_timestamp))
+    assert expired_partition_name in [
+        partition_name for (partition_name, _) in get_datum_partitions()]
+
+    expire_old_data()
+
+    assert expired_partition_name not in [
+        partition_name for (partition_name, _) in get_datum_partitions()]
+    assert list(Datum.objects.values_list('value', flat=True)) == [10.0]
+
+
+def test_create_datum_partitions(partitioned_datum, settings):
+    future_partition_name = get_partition_name(get_partition_start(
+        timezone.now() + settings.DATUM_PARTITION_PRECREATE_INTERVAL))
+    assert future_partition_name not in [
+        partition_name for (partition_name, _) in get_datum_partitions()]
+
+    create_datum_partitions()
+
+    assert future_partition_name in [
+        partition_name for (partition_name, _) in get_datum_partitions()]
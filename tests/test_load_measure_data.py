@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from unittest.mock import patch
+
+
+def test_load_measure_data_checkpoint(initial_data, tmpdir):
+    checkpoint = str(tmpdir.join('checkpoint'))
+    updated = []
+
+    def _update_measures(application_name, platform_name, channel_name,
+                         submission_date=None, **kwargs):
+        if submission_date.day == 2 and platform_name == 'windows':
+            raise Exception('oh no')
+        updated.append((submission_date, application_name, platform_name,
+                        channel_name))
+
+    with patch('missioncontrol.etl.management.commands.load_measure_data.update_measures',
+               _update_measures):
+        args = ['load_measure_data', '--application', 'firefox', '--channel',
+                'release', '--start-date', '2017-07-01', '--end-date', '2017-07-02',
+                '--checkpoint', checkpoint]
+        with pytest.raises(CommandError, match='1 of 6 units failed: '
+                           '2017-07-02 firefox windows release'):
+            call_command(*args)
+        assert len(updated) == 5
+
+        # running again should only retry the unit which failed
+        updated.clear()
+        with pytest.raises(CommandError, match='1 of 1 units failed'):
+            call_command(*args)
+        assert updated == []
+
+    with open(checkpoint) as f:
+        assert sorted(f.read().splitlines()) == sorted([
+            '2017-07-01 firefox linux release',
+            '2017-07-01 firefox mac release',
+            '2017-07-01 firefox windows release',
+            '2017-07-02 firefox linux release',
+            '2017-07-02 firefox mac release'])
+
+    # checkpoints only make sense for backfills
+    with pytest.raises(CommandError, match='--checkpoint'):
+        call_command('load_measure_data', '--checkpoint', checkpoint)
+
+
+def test_load_measure_data_workers(initial_data, tmpdir):
+    checkpoint = str(tmpdir.join('checkpoint'))
+    updated_dir = tmpdir.mkdir('updated')
+
+    def _update_measures(application_name, platform_name, channel_name,
+                         submission_date=None, **kwargs):
+        if submission_date.day == 2 and platform_name == 'windows':
+            raise Exception('oh no')
+        # (runs in a worker process, so record what was updated (and where)
+        # in the filesystem)
+        updated_dir.join(' '.join([submission_date.strftime('%Y-%m-%d'),
+                                   platform_name])).write(str(os.getpid()))
+
+    with patch('missioncontrol.etl.management.commands.load_measure_data.update_measures',
+               _update_measures):
+        with pytest.raises(CommandError, match='1 of 6 units failed: '
+                           '2017-07-02 firefox windows release'):
+            call_command('load_measure_data', '--application', 'firefox', '--channel',
+                         'release', '--start-date', '2017-07-01', '--end-date',
+                         '2017-07-02', '--checkpoint', checkpoint, '--workers', '2')
+
+    assert sorted(f.basename for f in updated_dir.listdir()) == [
+        '2017-07-01 linux', '2017-07-01 mac', '2017-07-01 windows',
+        '2017-07-02 linux', '2017-07-02 mac']
+    # everything should have been updated by the workers, not by us
+    assert str(os.getpid()) not in set(f.read() for f in updated_dir.listdir())
+    # the units which succeeded should have been checkpointed as they completed
+    with open(checkpoint) as f:
+        assert sorted(f.read().splitlines()) == sorted([
+            '2017-07-01 firefox linux release',
+            '2017-07-01 firefox mac release',
+            '2017-07-01 firefox windows release',
+            '2017-07-02 firefox linux release',
+            '2017-07-02 firefox mac release'])
@@ -3,6 +3,9 @@ import math
 import random
 
 import pytest
+from django.db import connection
+from django.db.models import (Max, Min)
+from unittest.mock import patch
 
 from missioncontrol.base.models import (Application,
                                         Build,
@@ -10,7 +13,8 @@ from missioncontrol.base.models import (Application,
                                         Datum,
                                         Measure,
                                         Platform)
-from missioncontrol.etl.measuresummary import get_measure_summary
+from missioncontrol.etl.measuresummary import (get_measure_summary,
+                                               schedule_measure_summary_update)
 
 
 # silly helper function to generate some fake data
@@ -181,3 +185,118 @@ def test_get_measure_summary_recent_releases(prepopulated_version_cache, base_da
         measure_summary = get_measure_summary(
             application_name, platform_name, channel_name, measure_name)
         assert [version['version'] for version in measure_summary['versions']] == expected_versions
+
+
+@pytest.fixture
+def noisy_interval_data(initial_data, base_datapoint_time):
+    (application, platform, channel) = (Application.objects.get(name='firefox'),
+                                        Platform.objects.get(name='linux'),
+                                        Channel.objects.get(name='release'))
+    measure = Measure.objects.get(name='main_crashes', application=application,
+                                  platform=platform)
+    random.seed(42)
+    for (build_id, version) in (('20170629075044', '55.0'),
+                                ('20170701075044', '55.0.1'),
+                                ('20170801075044', '56.0')):
+        build = Build.objects.create(application=application, platform=platform,
+                                     channel=channel, build_id=build_id,
+                                     version=version)
+        # lots of (partly duplicate) values, so the trimming and ordering
+        # of ties matter
+        Datum.objects.bulk_create([
+            Datum(build=build, measure=measure,
+                  timestamp=base_datapoint_time + datetime.timedelta(minutes=5 * i),
+                  value=random.choice([0, 1, 2, random.random() * 1000]),
+                  usage_hours=random.choice([1, random.random() * 100]),
+                  client_count=1)
+            for i in range(2500)])
+    # and a few outliers with the same rate (but different values), so it
+    # matters which of them are trimmed
+    Datum.objects.bulk_create([
+        Datum(build=Build.objects.get(build_id='20170629075044'), measure=measure,
+              timestamp=base_datapoint_time + datetime.timedelta(minutes=5 * i + 1),
+              value=1000000.0 * usage_hours, usage_hours=usage_hours, client_count=1)
+        for (i, usage_hours) in enumerate((1, 2, 4, 1, 2, 4, 8, 1))])
+
+    intervals = [
+        (version, base_datapoint_time + datetime.timedelta(hours=start),
+         base_datapoint_time + datetime.timedelta(hours=end))
+        for version in ('55', '55.0', '55.0.1', '56', '57')
+        for (start, end) in ((0, 1), (0, 1000), (24, 48), (-10, -1))]
+    return (Build.objects.all(), measure, intervals)
+
+
+def test_sql_interval_stats(noisy_interval_data):
+    if connection.vendor != 'postgresql':
+        pytest.skip('requires postgres')
+    from missioncontrol.etl.measuresummary import (_get_python_interval_stats,
+                                                   _get_sql_interval_stats)
+
+    assert _get_sql_interval_stats(*noisy_interval_data) == \
+        _get_python_interval_stats(*noisy_interval_data)
+
+
+def test_numpy_interval_stats(noisy_interval_data, monkeypatch):
+    from missioncontrol.etl import measuresummary
+    from missioncontrol.etl.measuresummary import (_get_numpy_interval_stats,
+                                                   _get_python_interval_stats)
+
+    # the rates should be the same even before they're rounded (which they
+    # only are if the same datums are added up in the same order)
+    monkeypatch.setattr(measuresummary, 'round', lambda value, ndigits: value,
+                        raising=False)
+    assert _get_numpy_interval_stats(*noisy_interval_data) == \
+        _get_python_interval_stats(*noisy_interval_data)
+
+
+@pytest.mark.parametrize('top_values', [100, 1])
+@pytest.mark.parametrize('add_datums', [False, True])
+def test_get_measure_summary_incremental(prepopulated_version_cache,
+                                         noisy_interval_data, top_values,
+                                         add_datums):
+    from missioncontrol.etl.loader import DATUM_COLUMNS
+    from missioncontrol.etl.summarybuckets import (add_to_summary_buckets,
+                                                   update_summary_buckets)
+
+    (builds, measure, _) = noisy_interval_data
+    args = ('firefox', 'linux', 'release', 'main_crashes')
+    expected = get_measure_summary(*args)
+    assert expected
+
+    with patch('missioncontrol.etl.summarybuckets.MEASURE_SUMMARY_BUCKET_TOP_VALUES',
+               top_values), \
+            patch('missioncontrol.etl.measuresummary.MEASURE_SUMMARY_INCREMENTAL', True):
+        # with too few top values kept, we have to fall back to looking at
+        # the datums (the result should be the same either way)
+        if add_datums:
+            # add the datums in two goes, as if they were loaded separately
+            datum_rows = list(Datum.objects.order_by('id').values_list(*DATUM_COLUMNS))
+            add_to_summary_buckets(datum_rows[:len(datum_rows) // 2])
+            add_to_summary_buckets(datum_rows[len(datum_rows) // 2:])
+        else:
+            update_summary_buckets(Platform.objects.get(name='linux'),
+                                   Channel.objects.get(name='release'), [measure],
+                                   *Datum.objects.aggregate(Min('timestamp'),
+                                                            Max('timestamp')).values())
+        assert get_measure_summary(*args) == expected
+
+
+def test_schedule_measure_summary_update(transactional_db):
+    args = ['firefox', 'linux', 'release', 'main_crashes']
+    with patch('missioncontrol.etl.measuresummary.update_measure_summary.apply_async') as mock_task:
+        assert schedule_measure_summary_update(*args)
+        # further updates are coalesced with the pending one...
+        assert not schedule_measure_summary_update(*args)
+        assert not schedule_measure_summary_update(*args)
+        # ...but not with updates of other summaries
+        assert schedule_measure_summary_update('firefox', 'linux', 'beta', 'main_crashes')
+        assert mock_task.call_count == 2
+        mock_task.assert_any_call(args=args, countdown=60)
+
+    # once the summary starts being recalculated, we can schedule another update
+    from missioncontrol.etl.measuresummary import update_measure_summary
+    with patch('missioncontrol.etl.measuresummary.get_measure_summary', return_value=None):
+        update_measure_summary(*args)
+    with patch('missioncontrol.etl.measuresummary.update_measure_summary.apply_async') as mock_task:
+        assert schedule_measure_summary_update(*args)
+        mock_task.assert_called_once_with(args=args, countdown=60)